@@ -19,17 +19,19 @@ from os.path import basename, dirname, curdir, abspath, isdir, isfile, exists, s
 import logging
 #import time
 import re
+import math
 from glob import glob
 import string
-import numpy as np
 import traceback
 from datetime import datetime
-import h5py
 
 from unaggregate import find_aggregated, unaggregate_inputs
 
 LOG = logging.getLogger('active_fire_interface')
 
+# The leap second tables, which are only read once per process
+_leapsec_tables = {}
+
 def get_granule_ID(IET_StartTime):
     """
     Calculates the deterministic granule ID. From...
@@ -47,7 +49,7 @@ def get_granule_ID(IET_StartTime):
 
     # Divide the elapsed time by the granule size to obtain the granule number;
     # the integer division will give the desired floor value.
-    granuleNumber = int(np.floor(elapsedTime / granuleSize))
+    granuleNumber = int(math.floor(elapsedTime / granuleSize))
 
     # Multiply the granule number by the granule size, then add the spacecraft
     # base time to obtain the granule start boundary time. Add the granule
@@ -131,7 +133,9 @@ def get_file_info(filename, afire_options, read_file=False):
 
     # Get a table of the leap seconds
     iet_epoch = datetime(1958, 1, 1)
-    leapsec_dt_list = get_leapsec_table(afire_options['ancil_dir'])
+    if afire_options['ancil_dir'] not in _leapsec_tables:
+        _leapsec_tables[afire_options['ancil_dir']] = get_leapsec_table(afire_options['ancil_dir'])
+    leapsec_dt_list = _leapsec_tables[afire_options['ancil_dir']]
 
     # Compile the regular expression for the filename...
     re_pattern = re.compile(pattern)
@@ -154,6 +158,9 @@ def get_file_info(filename, afire_options, read_file=False):
     agg_iet_times = []
 
     if read_file:
+        # h5py is only imported when an input file is actually read
+        import h5py
+
         try:
             # Open the file and get the collection short name
             file_obj = h5py.File(filename, 'r')
@@ -314,6 +321,10 @@ def generate_file_dict(inputs, afire_options, full=False):
     m_band_prefixes = ['GMTCO', 'SVM05', 'SVM07', 'SVM11', 'SVM13', 'SVM15', 'SVM16']
     i_band_prefixes = ['GMTCO', 'GITCO', 'SVI01', 'SVI02', 'SVI03', 'SVI04', 'SVI05', 'SVM13', 'IVCDB']
 
+    # The I-band only needs the M-band geolocation if the LWM is granulated from it.
+    if afire_options['lwm_geo_prefix'] != 'GMTCO':
+        i_band_prefixes.remove('GMTCO')
+
     input_prefixes = i_band_prefixes if afire_options['i_band'] else m_band_prefixes
 
     afire_options['input_prefixes'] = input_prefixes
@@ -532,9 +543,12 @@ def construct_cmd_invocations(afire_data_dict, afire_options):
         GRLWM_npp_d{}_t{}_e{}_b{}_cspp_dev.nc AFEDR_npp_d{}_t{}_e{}_b{}_cCTIME_cspp_dev.nc \
         metadata_id metadata_link time
 
-    The I-band AF still requires the M-band geolocation (GMTCO) to granulate the LWM, which is still
-    750m resolution.
+    By default the I-band AF still requires the M-band geolocation (GMTCO) to granulate the LWM,
+    which is then 750m resolution. With the "native_lwm" option, the I-band LWM is instead
+    granulated from the GITCO geolocation, at 375m resolution.
     '''
+    # The LWM cache (and with it numpy, h5py and netCDF4) is only imported once there are inputs
+    from ancillary.lwm_cache import lwm_file_prefixes
 
     granule_id_list = sorted(afire_data_dict.keys())
 
@@ -562,7 +576,8 @@ def construct_cmd_invocations(afire_data_dict, afire_options):
             afire_data_dict[granule_id][geo_prefix]['end_time']
             )
 
-        land_water_mask = 'AF-LAND_MASK_NASA_1KM_{}_s{}_e{}.nc'.format(
+        land_water_mask = '{}_{}_s{}_e{}.nc'.format(
+            lwm_file_prefixes[afire_options['lwm_geo_prefix']],
             afire_data_dict[granule_id][geo_prefix]['sat'],
             lwm_start_time,
             lwm_end_time,
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+afire_server.py
+
+ * DESCRIPTION: Server mode of CSPP Active Fires ("cspp_active_fire_noaa.py --serve SOCKET"), which
+ avoids the startup cost of each run: the interpreter, the imports, the forking of the pool
+ workers, and the loading of their libraries, DEM file and templates. The server starts a shared
+ pool of warm worker processes, and accepts jobs from cspp_active_fire_noaa_client.py on a Unix
+ domain socket. Each job has the same options as a normal run, which are parsed in the working
+ directory of the client, and its log is written to the work directory as usual, and streamed
+ back to the client as it runs, followed by the return code and the granule IDs of the run.
+
+ Jobs are run one at a time, in the order the clients connect. The verbosity of the server
+ limits that of the jobs, since the pool workers keep the logging level of the server, and the
+ jobs run in the pool workers of the server, whatever their --num-cpu option.
+
+ The CSPP_ACTIVE_FIRE_* (and NPP_GRANULE_ID_BASETIME) environment variables of the client are
+ applied to its job, in place of those of the server. The pool workers have already loaded the
+ software and static ancillary data of the server, so jobs whose CSPP_ACTIVE_FIRE_HOME or
+ CSPP_ACTIVE_FIRE_STATIC_DIR differ from those of the server are rejected.
+
+ The protocol is one JSON object per line. The client sends {"argv": [...], "cwd": "...",
+ "env": {...}}, and the server replies with any number of {"stream": "stdout" or "stderr",
+ "text": "..."} messages, followed by {"rc": ..., "runs": {...}, "wall": ...}.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import io
+import sys
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+
+import log_common
+from args import argument_parser, log_level
+from worker_pool import start_shared_pool, stop_shared_pool, shared_pool_size
+
+LOG = logging.getLogger('afire_server')
+
+# The environment variables of a client which are applied to its job: those with this prefix,
+# and these others.
+JOB_ENV_PREFIX = 'CSPP_ACTIVE_FIRE_'
+JOB_ENV_VARS = ['NPP_GRANULE_ID_BASETIME']
+
+# The environment variables of the server which a job may not change, since the pool workers have
+# already loaded the software and static ancillary data they point to.
+SERVER_ENV_VARS = ['CSPP_ACTIVE_FIRE_HOME', 'CSPP_ACTIVE_FIRE_STATIC_DIR']
+
+
+class JobConnection():
+    '''
+    The connection to the client of a job, to which messages are sent as JSON lines. Messages may
+    be sent from any thread. If the client goes away the job carries on, but later messages are
+    dropped.
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, **message):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.conn.sendall((json.dumps(message) + '\n').encode('utf-8'))
+                return
+            except (IOError, OSError):
+                self.closed = True
+        LOG.warning("The client has gone away, the job will carry on without it")
+
+
+class ClientLogHandler(logging.Handler):
+    '''
+    Streams the log records of a job to its client, as lines of the client's stdout (info and
+    debug) or stderr (warnings and errors).
+    '''
+
+    def __init__(self, job_conn):
+        logging.Handler.__init__(self)
+        self.job_conn = job_conn
+
+    def emit(self, record):
+        try:
+            stream = 'stdout' if record.levelno in [logging.INFO, logging.DEBUG] else 'stderr'
+            self.job_conn.send(stream=stream, text=self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+def bind_socket(socket_path):
+    '''
+    Return a socket listening on socket_path, replacing the file of any server which has gone
+    away, or None if another server is already listening on it.
+    '''
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            LOG.error("There is already a server listening on {}".format(socket_path))
+            return None
+        except (IOError, OSError):
+            LOG.debug("Removing the stale socket {}".format(socket_path))
+            os.unlink(socket_path)
+        finally:
+            probe.close()
+
+    server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_sock.bind(socket_path)
+    # Only the user running the server may submit jobs to it
+    os.chmod(socket_path, 0o600)
+    server_sock.listen(16)
+    return server_sock
+
+
+def is_job_env_var(name):
+    return (name.startswith(JOB_ENV_PREFIX) or name in JOB_ENV_VARS) and \
+        name not in SERVER_ENV_VARS
+
+
+def check_job_env(job_env):
+    '''
+    Return a list of the problems with the environment variables of a job, which are those which
+    differ from the server variables they may not change.
+    '''
+    problems = []
+    for name in SERVER_ENV_VARS:
+        if name not in job_env:
+            continue
+        server_value = os.environ.get(name)
+        if server_value is None or \
+                os.path.realpath(job_env[name]) != os.path.realpath(server_value):
+            problems.append('{}={} differs from the server\'s {}'.format(
+                name, job_env[name], server_value))
+    return problems
+
+
+@contextmanager
+def job_environment(job_env):
+    '''
+    Apply the environment variables of a job for the duration of the enclosed block, replacing
+    (or removing) those of the server, and restore the server's afterwards.
+    '''
+    server_env = {name: value for name, value in os.environ.items() if is_job_env_var(name)}
+    for name in server_env:
+        del os.environ[name]
+    os.environ.update({name: value for name, value in job_env.items() if is_job_env_var(name)})
+    try:
+        yield
+    finally:
+        for name in [name for name in os.environ if is_job_env_var(name)]:
+            del os.environ[name]
+        os.environ.update(server_env)
+
+
+def run_job(job_conn, request):
+    '''
+    Parse the options of a job in the current directory, and run it, streaming its log to the
+    client. Returns the return code, and the granule IDs of the run.
+    '''
+    from cspp_active_fire_noaa import run_afire
+
+    # The output of --help, --version and bad options is sent to the client.
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            args, work_dir, docleanup, cspp_afire_version, logfile = argument_parser(
+                request['argv'], configure_logging=False)
+    except SystemExit as err:
+        rc = err.code if isinstance(err.code, int) else 1
+        job_conn.send(stream='stdout' if rc == 0 else 'stderr', text=output.getvalue())
+        return rc, {}
+
+    if args.serve is not None:
+        job_conn.send(stream='stderr', text='A job cannot start another server.\n')
+        return 2, {}
+
+    # Write the log of the job to its log file in the work directory, and to the client.
+    level = log_level(args.verbosity)
+    job_handlers = [logging.FileHandler(filename=logfile), ClientLogHandler(job_conn)]
+    for handler in job_handlers:
+        log_common.add_log_handler(handler, level)
+
+    try:
+        LOG.info("Running the job of {} in {}".format(request['argv'], request['cwd']))
+        num_cpu = min(args.num_cpu, multiprocessing.cpu_count())
+        if num_cpu != shared_pool_size():
+            LOG.warning("The job asks for {} CPUs, but will run in the {} worker processes of"
+                        " the server".format(num_cpu, shared_pool_size()))
+        return run_afire(args, work_dir, docleanup, cspp_afire_version)
+    finally:
+        for handler in job_handlers:
+            log_common.remove_log_handler(handler)
+
+
+def handle_connection(conn):
+    '''
+    Read the job request of a client, run the job in the client's working directory, and send the
+    result to the client.
+    '''
+    job_conn = JobConnection(conn)
+    try:
+        with conn.makefile('rb') as file_obj:
+            request = json.loads(file_obj.readline().decode('utf-8'))
+        request['argv'] = [str(arg) for arg in request['argv']]
+        request['env'] = {str(name): str(value) for name, value in request['env'].items()}
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+        LOG.warning("Ignoring a bad job request: {}".format(err))
+        return
+
+    # Reject jobs which need a server with a different environment
+    problems = check_job_env(request['env'])
+    if problems:
+        LOG.warning("Rejecting the job of {}: {}".format(request['argv'], '; '.join(problems)))
+        job_conn.send(stream='stderr', text='This server cannot run the job, since its {}.\n'
+                      .format('; '.join(problems)))
+        job_conn.send(rc=2, runs={}, wall=0.)
+        return
+
+    start = time.monotonic()
+    current_dir = os.getcwd()
+    rc, runs = 1, {}
+    try:
+        os.chdir(request['cwd'])
+        with job_environment(request['env']):
+            rc, runs = run_job(job_conn, request)
+    except Exception:
+        LOG.error(traceback.format_exc())
+        job_conn.send(stream='stderr', text=traceback.format_exc())
+    finally:
+        os.chdir(current_dir)
+
+    wall = time.monotonic() - start
+    LOG.info("Finished the job of {} with rc = {} in {:.3f} seconds".format(
+        request['argv'], rc, wall))
+    job_conn.send(rc=rc, runs=runs, wall=wall)
+
+
+def serve(socket_path, args):
+    '''
+    Run the server: start the shared pool, and run the jobs of the clients which connect to the
+    socket, one at a time, until the server is interrupted or terminated. Returns the return code.
+    '''
+    socket_path = os.path.abspath(socket_path)
+    server_sock = bind_socket(socket_path)
+    if server_sock is None:
+        return 1
+
+    # Import the processing modules before forking the pool, so that the workers start with them
+    # loaded, and preload the resources used to generate the LWMs in each worker.
+    import active_fire_interface
+    from dispatcher import afire_pool_initializer
+    worker_options = {'afire_home': os.environ.get('CSPP_ACTIVE_FIRE_HOME', ''),
+                      'ancil_dir': os.environ.get('CSPP_ACTIVE_FIRE_STATIC_DIR', ''),
+                      'dem_chunk_cache': args.dem_chunk_cache}
+    processes = max(min(args.num_cpu, multiprocessing.cpu_count()), 1)
+    start_shared_pool(processes, initializer=afire_pool_initializer, initargs=(worker_options,))
+
+    # Stop cleanly when terminated, as when interrupted.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    LOG.info("Listening for jobs on {}".format(socket_path))
+    try:
+        while True:
+            conn, _ = server_sock.accept()
+            with conn:
+                handle_connection(conn)
+    except (KeyboardInterrupt, SystemExit):
+        LOG.info("Stopping the server")
+    finally:
+        server_sock.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        stop_shared_pool()
+
+    return 0
@@ -10,6 +10,7 @@ Copyright (c) 2013 University of Wisconsin SSEC. All rights reserved.
 Licensed under GNU GPLv3.
 """
 
+import os
 import logging
 from os import path
 from time import time
@@ -24,9 +25,166 @@ from netCDF4 import Dataset
 
 from .Utils import findDatelineCrossings
 from .Utils import index, find_lt, find_gt
+from .Utils import geoDatasetPath, geoDetectors
+from ..cdl import get_cdl_schema, schema_format, create_from_schema
 
 LOG = logging.getLogger('LandWaterMask')
 
+LWM_CDL_FILENAME = 'AF-LAND_MASK_NASA_1KM.cdl'
+
+# The global 30 arc-second DEM land water mask
+DEM_FILENAME = 'dem30ARC_Global_LandWater_compressed.h5'
+DEM_DSET = '/demGRID/Data Fields/LandWater'
+DEM_DLAT = 30. * (1. / 3600.)
+DEM_DLON = 30. * (1. / 3600.)
+DEM_NROWS = 21600
+DEM_NCOLS = 43200
+
+# The default size of the HDF5 chunk cache of the open DEM file, in MB
+DEM_CHUNK_CACHE_MB = 64.
+
+# The number of pixels granulated in each call to the C routine, which bounds the size of the
+# double buffers it requires (8 MB each).
+GRID2GRAN_CHUNK_PIXELS = 1024 * 1024
+
+# Per-process resources, which are loaded once (usually by the pool initializer) and then reused
+# by every granule processed in the process.
+_grid2gran_funcs = {}
+_dem_files = {}
+
+
+def getGrid2Gran(afire_home):
+    '''
+    Return the grid2gran_nearest() function of the gridding and granulation library, loading the
+    library and setting the function signature only on the first call in this process.
+    '''
+    libFile = path.join(afire_home, 'lib', 'libgriddingAndGranulation.so')
+    if libFile not in _grid2gran_funcs:
+        LOG.debug("Loading gridding and granulation library file: {}".format(libFile))
+        lib = ctypes.cdll.LoadLibrary(libFile)
+        grid2gran = lib.grid2gran_nearest
+        grid2gran.restype = None
+        grid2gran.argtypes = [
+            ndpointer(ctypes.c_double, ndim=1, flags='C_CONTIGUOUS'),
+            ndpointer(ctypes.c_double, ndim=1, flags='C_CONTIGUOUS'),
+            ndpointer(ctypes.c_double, ndim=1, flags='C_CONTIGUOUS'),
+            ctypes.c_int64,
+            ndpointer(ctypes.c_double, ndim=2, flags='C_CONTIGUOUS'),
+            ndpointer(ctypes.c_double, ndim=2, flags='C_CONTIGUOUS'),
+            ndpointer(ctypes.c_double, ndim=2, flags='C_CONTIGUOUS'),
+            ndpointer(ctypes.c_int64, ndim=1, flags='C_CONTIGUOUS'),
+            ctypes.c_int32,
+            ctypes.c_int32
+        ]
+        _grid2gran_funcs[libFile] = grid2gran
+
+    return _grid2gran_funcs[libFile]
+
+
+def getDEM(DEM_fileName, chunkCacheMB=DEM_CHUNK_CACHE_MB):
+    '''
+    Return the DEM file object, opened read-only with a chunk cache of chunkCacheMB, opening it
+    only on the first call in this process (or if the file has since changed).
+    '''
+    DEM_stat = os.stat(DEM_fileName)
+    DEM_version = (DEM_stat.st_size, DEM_stat.st_mtime)
+
+    if DEM_fileName in _dem_files:
+        DEMobj, version = _dem_files[DEM_fileName]
+        if version == DEM_version and DEMobj.id.valid:
+            return DEMobj
+        DEMobj.close()
+
+    LOG.debug("Opening DEM file {} with a {} MB chunk cache".format(DEM_fileName, chunkCacheMB))
+    DEMobj = h5py.File(DEM_fileName, 'r', rdcc_nbytes=int(chunkCacheMB * 1024 * 1024),
+                       rdcc_nslots=100003)
+    _dem_files[DEM_fileName] = (DEMobj, DEM_version)
+
+    return DEMobj
+
+# Storage options for the LWM file variables, if they are compressed
+LWM_STORAGE = {'zlib': True, 'complevel': 1, 'shuffle': True}
+
+
+def _read_float32(dset):
+    '''
+    Read an HDF5 dataset directly into a new float32 array.
+    '''
+    arr = np.empty(dset.shape, dtype=np.float32)
+    dset.read_direct(arr)
+    return arr
+
+
+def _valid_min_max(arr, valid):
+    '''
+    Return the min and max of the valid elements of an array, without a masked copy.
+    '''
+    return (np.min(arr, where=valid, initial=np.inf),
+            np.max(arr, where=valid, initial=-np.inf))
+
+
+class DemSubset():
+    '''
+    One or two rectangular windows of the global DEM, read once and held in memory, so that they
+    can be shared by the granulation of several granules, such as contiguous granules of an
+    orbit. A footprint crossing the dateline is held as the two windows either side of it. The
+    windows are only read on the first request for a block.
+    '''
+
+    def __init__(self, DEM_fileName, footprint, margin=0.5, chunkCacheMB=DEM_CHUNK_CACHE_MB):
+        self.DEM_fileName = DEM_fileName
+        self.chunkCacheMB = chunkCacheMB
+
+        rowStart = max(int(np.floor((90. - footprint['north'] - margin) / DEM_DLAT)), 0)
+        rowEnd = min(int(np.ceil((90. - footprint['south'] + margin) / DEM_DLAT)) + 1, DEM_NROWS)
+
+        def col(lon):
+            return min(max(int(np.floor((lon + 180.) / DEM_DLON)), 0), DEM_NCOLS)
+
+        west = footprint['west'] - margin
+        east = footprint['east'] + margin
+        if footprint['crossesDateline']:
+            colRanges = [(col(west), DEM_NCOLS), (0, col(east) + 1)]
+        elif west < -180. or east > 180.:
+            colRanges = [(0, DEM_NCOLS)]
+        else:
+            colRanges = [(col(west), col(east) + 1)]
+
+        self.windows = [(rowStart, rowEnd, colStart, colEnd) for colStart, colEnd in colRanges]
+        self.blocks = None
+
+    @property
+    def size(self):
+        '''
+        The number of DEM cells in the windows.
+        '''
+        return sum([(rowEnd - rowStart) * (colEnd - colStart)
+                    for rowStart, rowEnd, colStart, colEnd in self.windows])
+
+    def read(self):
+        '''
+        Read the DEM windows into memory.
+        '''
+        LOG.debug("Reading shared DEM subset windows {} from {}".format(self.windows,
+                                                                         self.DEM_fileName))
+        DEM_node = getDEM(self.DEM_fileName, self.chunkCacheMB)[DEM_DSET]
+        self.blocks = [DEM_node[rowStart:rowEnd, colStart:colEnd]
+                       for rowStart, rowEnd, colStart, colEnd in self.windows]
+
+    def block(self, rowStart, rowEnd, colStart, colEnd):
+        '''
+        Return a view of the DEM block [rowStart:rowEnd, colStart:colEnd], or None if the block is
+        not covered by one of the windows.
+        '''
+        for idx, (winRowStart, winRowEnd, winColStart, winColEnd) in enumerate(self.windows):
+            if (winRowStart <= rowStart and rowEnd <= winRowEnd and
+                    winColStart <= colStart and colEnd <= winColEnd):
+                if self.blocks is None:
+                    self.read()
+                return self.blocks[idx][rowStart - winRowStart:rowEnd - winRowStart,
+                                        colStart - winColStart:colEnd - winColStart]
+        return None
+
 
 class LandWaterMask():
 
@@ -38,6 +196,9 @@ class LandWaterMask():
         self.granule_dict = granule_dict
         self.afire_options = afire_options
 
+        # The geolocation the LWM is granulated to, GMTCO (750m) or GITCO (375m)
+        self.geo_prefix = afire_options.get('lwm_geo_prefix', 'GMTCO')
+
         # Digital Elevation Model (DEM) land sea mask types
         self.DEM_list = ['DEM_SHALLOW_OCEAN', 'DEM_LAND', 'DEM_COASTLINE',
                          'DEM_SHALLOW_INLAND_WATER', 'DEM_EPHEMERAL_WATER',
@@ -53,40 +214,33 @@ class LandWaterMask():
             'DEM_DEEP_OCEAN': 7
         }
 
-    def setGeolocationInfo(self):
+    def setGeolocationInfo(self, latitude=None, longitude=None):
         '''
-        Populate this class instance with the geolocation data for a single granule
+        Populate this class instance with the geolocation data for a single granule. The latitude
+        and longitude arrays are read from the geolocation file, unless they have already been
+        read by the caller.
         '''
 
+        geo_prefix = self.geo_prefix
+        geo_filename = self.granule_dict[geo_prefix]['file']
         try:
             # Open the geolocation file and get the latitude and longitude
-            geo_filename = self.granule_dict['GMTCO']['file']
             geo_file_obj = h5py.File(geo_filename, 'r')
 
             # Get scan_mode to find any bad scans
-            scanMode = geo_file_obj['/All_Data/VIIRS-MOD-GEO-TC_All/ModeScan'][:]
+            scanMode = geo_file_obj[geoDatasetPath(geo_prefix, 'ModeScan')][:]
             badScanIdx = np.where(scanMode == 254)[0]
             if badScanIdx.size != 0:
                 LOG.warning("Geolocation file {} has bad scans: {}".format(
                     geo_filename, badScanIdx))
                 LOG.debug("Geolocation file {} has scans: {}".format(geo_filename, scanMode))
 
-            # Detemine the min, max and range of the latitude and longitude,
-            # taking care to exclude any fill values.
-
-            latitude = geo_file_obj['/All_Data/VIIRS-MOD-GEO-TC_All/Latitude'][:]
-            longitude = geo_file_obj['/All_Data/VIIRS-MOD-GEO-TC_All/Longitude'][:]
-
-            latitude = ma.masked_less(latitude, -800.)
-            latMin, latMax = np.min(latitude), np.max(latitude)
-            latRange = latMax - latMin
-
-            longitude = ma.masked_less(longitude, -800.)
-            lonMin, lonMax = np.min(longitude), np.max(longitude)
-            lonRange = lonMax - lonMin
-
-            LOG.debug("min,max,range of latitide: {} {} {}".format(latMin, latMax, latRange))
-            LOG.debug("min,max,range of longitude: {} {} {}".format(lonMin, lonMax, lonRange))
+            if latitude is None or longitude is None:
+                latitude = _read_float32(geo_file_obj[geoDatasetPath(geo_prefix, 'Latitude')])
+                longitude = _read_float32(geo_file_obj[geoDatasetPath(geo_prefix, 'Longitude')])
+            else:
+                latitude = latitude.astype(np.float32, copy=False)
+                longitude = longitude.astype(np.float32, copy=False)
 
             geo_file_obj.close()
 
@@ -96,18 +250,22 @@ class LandWaterMask():
             geo_file_obj.close()
             return 1
 
-        # Determine the latitude and longitude fill masks, so we can restore the
-        # fill values after we have scaled...
-        latMask = latitude.mask
-        lonMask = longitude.mask
+        # Detemine the min, max and range of the latitude and longitude, taking care to exclude
+        # any fill values. The fill values are set to -999. in place, rather than via masked
+        # array copies.
+        latValid = np.greater_equal(latitude, -800.)
+        lonValid = np.greater_equal(longitude, -800.)
+        np.copyto(latitude, np.float32(-999.), where=~latValid)
+        np.copyto(longitude, np.float32(-999.), where=~lonValid)
 
-        # Restore fill values to masked pixels in geolocation
+        latMin, latMax = _valid_min_max(latitude, latValid)
+        latRange = latMax - latMin
 
-        latitude = ma.array(latitude, mask=latMask, fill_value=-999.)
-        self.latitude = latitude.filled()
+        lonMin, lonMax = _valid_min_max(longitude, lonValid)
+        lonRange = lonMax - lonMin
 
-        longitude = ma.array(longitude, mask=lonMask, fill_value=-999.)
-        self.longitude = longitude.filled()
+        LOG.debug("min,max,range of latitide: {} {} {}".format(latMin, latMax, latRange))
+        LOG.debug("min,max,range of longitude: {} {} {}".format(lonMin, lonMax, lonRange))
 
         # Shift the longitudes to be between -180 and 180 degrees
         if lonMax > 180.:
@@ -116,14 +274,13 @@ class LandWaterMask():
             dateLineIdx = np.where(longitude > 180.)
             LOG.debug("dateLineIdx = {}".format(dateLineIdx))
             longitude[dateLineIdx] -= 360.
-            lonMax = np.max(ma.array(longitude, mask=lonMask))
-            lonMin = np.min(ma.array(longitude, mask=lonMask))
+            lonMin, lonMax = _valid_min_max(longitude, lonValid)
             lonRange = lonMax - lonMin
             LOG.debug(
                 "\nFinal min,max,range of longitude: {} {} {}".format(lonMin, lonMax, lonRange))
 
         # Record the corners, taking care to exclude any bad scans...
-        nDetectors = 16
+        nDetectors = geoDetectors[geo_prefix]
         firstGoodScan = np.where(scanMode <= 2)[0][0]
         lastGoodScan = np.where(scanMode <= 2)[0][-1]
         firstGoodRow = firstGoodScan * nDetectors
@@ -154,30 +311,36 @@ class LandWaterMask():
 
         return 0
 
-    def subset(self):
-        '''Subsets the LSM dataset to cover the required geolocation range.'''
+    def subset(self, demSubset=None):
+        '''
+        Subsets the LSM dataset to cover the required geolocation range. If a shared DemSubset
+        is given, the DEM blocks are taken from it where it covers them, rather than read from the
+        DEM file.
+        '''
 
         # Get the subset of DEM global dataset.
 
-        DEM_dLat = 30. * (1. / 3600.)
-        DEM_dLon = 30. * (1. / 3600.)
+        DEM_dLat = DEM_DLAT
+        DEM_dLon = DEM_DLON
 
-        DEM_fileName = path.join(self.afire_options['ancil_dir'],
-                                 'dem30ARC_Global_LandWater_compressed.h5')
+        DEM_fileName = path.join(self.afire_options['ancil_dir'], DEM_FILENAME)
         self.sourceList.append(path.basename(DEM_fileName))
 
-        try:
-            # TODO : Use original HDF4 file which contains elevation and LWM.
-            DEMobj = h5py.File(DEM_fileName, 'r')
-            DEM_node = DEMobj['/demGRID/Data Fields/LandWater']
-        except Exception as err:
-            LOG.exception(err)
-            LOG.exception("Problem opening DEM file ({}), aborting.".format(DEM_fileName))
-            return 1
+        # The (per-process) DEM file is only used if a block is not covered by the shared subset.
+        def readBlock(rowStart, rowEnd, colStart, colEnd):
+            if demSubset is not None:
+                block = demSubset.block(rowStart, rowEnd, colStart, colEnd)
+                if block is not None:
+                    return block
+                LOG.debug("DEM block [{}:{}, {}:{}] is not in the shared subset".format(
+                    rowStart, rowEnd, colStart, colEnd))
+            DEMobj = getDEM(DEM_fileName,
+                            self.afire_options.get('dem_chunk_cache', DEM_CHUNK_CACHE_MB))
+            return DEMobj[DEM_DSET][rowStart:rowEnd, colStart:colEnd]
 
         try:
-            DEM_gridLats = -1. * (np.arange(21600.) * DEM_dLat - 90.)
-            DEM_gridLons = np.arange(43200.) * DEM_dLon - 180.
+            DEM_gridLats = -1. * (np.arange(float(DEM_NROWS)) * DEM_dLat - 90.)
+            DEM_gridLons = np.arange(float(DEM_NCOLS)) * DEM_dLon - 180.
 
             LOG.debug("min,max DEM Grid Latitude values : {},{}".format(DEM_gridLats[0],
                                                                         DEM_gridLats[-1]))
@@ -224,62 +387,57 @@ class LandWaterMask():
                 lon_subset = np.concatenate((posLons_subset, negLons_subset))
 
                 # Do the same with the DEM data
-                posBlock = DEM_node[DEM_latMinIdx:DEM_latMaxIdx + 1, posIdx:]
-                negBlock = DEM_node[DEM_latMinIdx:DEM_latMaxIdx + 1, :negIdx]
+                posBlock = readBlock(DEM_latMinIdx, DEM_latMaxIdx + 1, posIdx, DEM_NCOLS)
+                negBlock = readBlock(DEM_latMinIdx, DEM_latMaxIdx + 1, 0, negIdx)
                 DEM_subset = np.concatenate((posBlock, negBlock), axis=1)
 
             else:
 
-                DEM_subset = DEM_node[DEM_latMinIdx:DEM_latMaxIdx + 1,
-                                      DEM_lonMinIdx:DEM_lonMaxIdx + 1]
+                DEM_subset = readBlock(DEM_latMinIdx, DEM_latMaxIdx + 1,
+                                       DEM_lonMinIdx, DEM_lonMaxIdx + 1)
                 lon_subset = DEM_gridLons[DEM_lonMinIdx:DEM_lonMaxIdx + 1]
 
             self.gridLon = lon_subset
 
             # Copy DEM data to the GridIP object
-            self.gridData = DEM_subset.astype(self.dataType)
-
-            del(DEM_node)
-            DEMobj.close()
+            self.gridData = DEM_subset.astype(self.dataType, copy=False)
 
         except Exception as err:
 
             LOG.warning("EXCEPTION: {}".format(err))
-
-            del(DEM_node)
-            DEMobj.close()
+            LOG.warning("Problem subsetting DEM file ({}), aborting.".format(DEM_fileName))
             return 1
 
         return 0
 
-    def _grid2Gran(self, dataLat, dataLon, gridData, gridLat, gridLon):
-        '''Granulates a gridded dataset using an input geolocation'''
+    def _grid2Gran(self, dataLat, dataLon, gridData, gridLat, gridLon, out, keepIdx=False):
+        '''
+        Granulates a gridded dataset using an input geolocation, writing the result into the
+        preallocated array "out". The C routine requires double arrays, so the pixels are
+        granulated in chunks of GRID2GRAN_CHUNK_PIXELS, with only the geolocation and data of the
+        current chunk held as float64. The grid indices are only returned if keepIdx is set.
+        '''
 
-        nData = np.int64(dataLat.size)
+        nData = dataLat.size
         gridRows = np.int32(gridLat.shape[0])
         gridCols = np.int32(gridLat.shape[1])
 
-        data = np.ones(np.shape(dataLat), dtype=np.float64) * 254.
-        dataIdx = np.ones(np.shape(dataLat), dtype=np.int64) * -254
+        dataLat = dataLat.reshape(-1)
+        dataLon = dataLon.reshape(-1)
+        outData = out.reshape(-1)
 
-        libFile = path.join(self.afire_options['afire_home'],
-                            'lib', 'libgriddingAndGranulation.so')
-        LOG.debug("Gridding and granulation library file: {}".format(libFile))
-        lib = ctypes.cdll.LoadLibrary(libFile)
-        grid2gran = lib.grid2gran_nearest
-        grid2gran.restype = None
-        grid2gran.argtypes = [
-            ndpointer(ctypes.c_double, ndim=1, shape=(nData), flags='C_CONTIGUOUS'),
-            ndpointer(ctypes.c_double, ndim=1, shape=(nData), flags='C_CONTIGUOUS'),
-            ndpointer(ctypes.c_double, ndim=1, shape=(nData), flags='C_CONTIGUOUS'),
-            ctypes.c_int64,
-            ndpointer(ctypes.c_double, ndim=2, shape=(gridRows, gridCols), flags='C_CONTIGUOUS'),
-            ndpointer(ctypes.c_double, ndim=2, shape=(gridRows, gridCols), flags='C_CONTIGUOUS'),
-            ndpointer(ctypes.c_double, ndim=2, shape=(gridRows, gridCols), flags='C_CONTIGUOUS'),
-            ndpointer(ctypes.c_int64, ndim=1, shape=(nData), flags='C_CONTIGUOUS'),
-            ctypes.c_int32,
-            ctypes.c_int32
-        ]
+        # The double buffers of the current chunk, which are reused for every chunk
+        chunkPixels = max(min(nData, GRID2GRAN_CHUNK_PIXELS), 1)
+        chunkLat = np.empty(chunkPixels, dtype=np.float64)
+        chunkLon = np.empty(chunkPixels, dtype=np.float64)
+        chunkData = np.empty(chunkPixels, dtype=np.float64)
+        if keepIdx:
+            dataIdx = np.full(nData, -254, dtype=np.int64)
+        else:
+            # The C routine always writes the indices, but we don't need their initial value
+            chunkIdx = np.empty(chunkPixels, dtype=np.int64)
+
+        grid2gran = getGrid2Gran(self.afire_options['afire_home'])
 
         '''
         int snapGrid_ctypes(double *lat,
@@ -295,33 +453,50 @@ class LandWaterMask():
                         )
         '''
 
-        try:
-            LOG.debug("Calling C routine grid2gran()...")
-            retVal = grid2gran(dataLat.astype('float64'),
-                               dataLon.astype('float64'),
-                               data,
-                               nData,
-                               gridLat,
-                               gridLon,
-                               gridData,
-                               dataIdx,
-                               gridRows,
-                               gridCols)
-            LOG.debug("Returning from C routine grid2gran() with retVal {}".format(retVal))
-        except Exception as err:
-            LOG.debug("There was a problem running C routine grid2gran()")
-            LOG.warning("EXCEPTION: {}".format(err))
-
-        return data, dataIdx
+        LOG.debug("Calling C routine grid2gran() for {} points in chunks of {}...".format(
+            nData, chunkPixels))
+        retVal = None
+        for start in range(0, nData, chunkPixels):
+            end = min(start + chunkPixels, nData)
+            nChunk = end - start
+
+            np.copyto(chunkLat[:nChunk], dataLat[start:end])
+            np.copyto(chunkLon[:nChunk], dataLon[start:end])
+            chunkData[:nChunk] = 254.
+
+            try:
+                retVal = grid2gran(chunkLat[:nChunk],
+                                   chunkLon[:nChunk],
+                                   chunkData[:nChunk],
+                                   np.int64(nChunk),
+                                   gridLat,
+                                   gridLon,
+                                   gridData,
+                                   dataIdx[start:end] if keepIdx else chunkIdx[:nChunk],
+                                   gridRows,
+                                   gridCols)
+            except Exception as err:
+                LOG.debug("There was a problem running C routine grid2gran()")
+                LOG.warning("EXCEPTION: {}".format(err))
+
+            # Convert the granulated data of this chunk to the output type...
+            np.copyto(outData[start:end], chunkData[:nChunk], casting='unsafe')
+
+        LOG.debug("Returning from C routine grid2gran() with retVal {}".format(retVal))
+        del(chunkLat, chunkLon, chunkData)
+
+        return dataIdx if keepIdx else None
 
     def granulate(self):
         '''
         Granulates the GridIP DEM files.
         '''
 
-        # Generate the lat and lon grids, and flip them and the data over latitude
-        gridLon, gridLat = np.meshgrid(self.gridLon, self.gridLat[::-1])
-        gridData = self.gridData[::-1, :]
+        # Generate the lat and lon grids, and flip them and the data over latitude. These are the
+        # (contiguous float64) arrays passed to the C routine, so make them only once.
+        gridLon, gridLat = np.meshgrid(self.gridLon.astype(np.float64, copy=False),
+                                       self.gridLat[::-1].astype(np.float64, copy=False))
+        gridData = np.ascontiguousarray(self.gridData[::-1, :], dtype=np.float64)
 
         latitude = self.latitude
         longitude = self.longitude
@@ -329,10 +504,10 @@ class LandWaterMask():
         # If we have a dateline crossing, remove the longitude discontinuity
         # by adding 360 degrees to the negative longitudes.
         if self.num180Crossings == 2:
-            gridLonNegIdx = np.where(gridLon < 0.)
-            gridLon[gridLonNegIdx] += 360.
-            longitudeNegIdx = np.where(longitude < 0.)
-            longitude[longitudeNegIdx] += 360.
+            np.add(gridLon, 360., out=gridLon, where=gridLon < 0.)
+            # ...taking care not to shift the fill values.
+            np.add(longitude, np.float32(360.), out=longitude,
+                   where=np.logical_and(longitude < 0., longitude >= -800.))
 
         LOG.debug("Granulating {} ..." .format(self.collectionShortName))
         LOG.debug("latitide,longitude shapes: {}, {}".format(str(latitude.shape),
@@ -346,12 +521,13 @@ class LandWaterMask():
 
         t1 = time()
 
+        # Preallocate the granulated output in its final type
+        self.data = np.empty(latitude.shape, dtype=self.dataType)
+        keepIdx = self.afire_options.get('debug', False)
+
         try:
-            data, dataIdx = self._grid2Gran(np.ravel(latitude),
-                                            np.ravel(longitude),
-                                            gridData.astype(np.float64),
-                                            gridLat.astype(np.float64),
-                                            gridLon.astype(np.float64))
+            dataIdx = self._grid2Gran(latitude, longitude, gridData, gridLat, gridLon,
+                                      self.data, keepIdx=keepIdx)
         except Exception as err:
             LOG.debug("There was a problem running  _grid2gran()")
             LOG.warning("EXCEPTION: {}".format(err))
@@ -362,18 +538,18 @@ class LandWaterMask():
         LOG.debug("Granulation of {} took {} seconds for {} points".format(
             self.granule_dict['granule_id'], elapsedTime, latitude.size))
 
-        data = data.reshape(latitude.shape)
-        dataIdx = dataIdx.reshape(latitude.shape)
+        del(gridLon, gridLat, gridData)
 
         LOG.debug(
             "Shape of granulated {} data is {}".format(
-                self.collectionShortName, np.shape(data)))
-        LOG.debug(
-            "Shape of granulated {} dataIdx is {}".format(
-                self.collectionShortName, np.shape(dataIdx)))
+                self.collectionShortName, np.shape(self.data)))
 
-        # Convert granulated data back to original type...
-        self.data = data.astype(self.dataType)
+        # The grid indices are only retained for debugging
+        if keepIdx:
+            self.dataIdx = dataIdx.reshape(latitude.shape)
+            LOG.debug(
+                "Shape of granulated {} dataIdx is {}".format(
+                    self.collectionShortName, np.shape(self.dataIdx)))
 
         # Convert any "inland water" to "sea water"
         #shallowInlandWaterValue = self.DEM_dict['DEM_SHALLOW_INLAND_WATER']
@@ -394,33 +570,58 @@ class LandWaterMask():
 
     def shipOutToFile(self, lwm_file, afire_options):
         '''
-        Pass the current class instance to this Utils method to generate
-        a blob/asc file pair from the input ancillary data object.
+        Create the LWM file from the parsed CDL template, and write the granulated data to it,
+        in a single open/close of the file.
         '''
 
         # Get the geolocation fill values...
-        geo_mask = ma.masked_less(self.latitude, -800.).mask
+        geo_mask = np.less(self.latitude, -800.)
+        lon_mask = np.less(self.longitude, -800.)
 
         # Get the granule time
-        granule_dt = self.granule_dict['GMTCO']['dt']
+        granule_dt = self.granule_dict[self.geo_prefix]['dt']
+
+        # Get the LWM file schema, and size the dimensions to match the geolocation.
+        lwm_schema = get_cdl_schema(path.join(afire_options['ancil_dir'], LWM_CDL_FILENAME))
+        dim_sizes = dict(zip(lwm_schema['variables']['Latitude']['dimensions'],
+                             self.latitude.shape))
+
+        # Create the LWM file in the netCDF format of the CDL template, as ncgen did. If compression
+        # is requested, vfire reads each variable in its entirety, so store each as a single
+        # compressed chunk (which a netCDF-3 format can't hold).
+        file_format = schema_format(lwm_schema)
+        var_options = {}
+        if afire_options['lwm_compress']:
+            if file_format.startswith('NETCDF3'):
+                file_format = 'NETCDF4_CLASSIC'
+            var_options = {var_name: dict(LWM_STORAGE, chunksizes=self.latitude.shape)
+                           for var_name in ['Latitude', 'Longitude', 'LandMask']}
+
+        # Write the new data to the LWM file
+        LOG.debug("Creating {} LWM file {} for writing".format(file_format, lwm_file))
+        try:
+            file_obj = Dataset(lwm_file, "w", format=file_format)
+        except Exception as err:
+            LOG.error("Creating LWM file {} failed".format(lwm_file))
+            LOG.debug("EXCEPTION: {}".format(err))
+            return 1
 
-        # Write the new data to the LWM template file
-        LOG.debug("Opening LWM file {} for writing".format(lwm_file))
-        file_obj = Dataset(lwm_file, "a", format="NETCDF4")
         try:
+            create_from_schema(file_obj, lwm_schema, dim_sizes=dim_sizes,
+                               var_options=var_options)
+
             # Get the latitude
             latitude_obj = file_obj['Latitude']
-            latitude_obj[:] = self.latitude[:].astype('float32')
+            latitude_obj[:] = ma.masked_where(geo_mask, self.latitude, copy=False)
 
             # Get the longitude
             longitude_obj = file_obj['Longitude']
-            longitude_obj[:] = self.longitude[:].astype('float32')
+            longitude_obj[:] = ma.masked_where(lon_mask, self.longitude, copy=False)
 
             # Get the Land Water Mask.
             lwm_obj = file_obj['LandMask']
-            lwm_obj[:] = ma.array(self.data[:].astype('int8'), mask=geo_mask,
-                                  fill_value=self.DEM_dict['DEM_DEEP_OCEAN']).filled()
-                                  #fill_value=-128).filled()
+            np.copyto(self.data, np.int8(self.DEM_dict['DEM_DEEP_OCEAN']), where=geo_mask)
+            lwm_obj[:] = self.data
 
             # Set some global attributes
             setattr(file_obj, 'History', datetime.utcnow().strftime("%a %b %d %H:%M:%S %Y UTC"))
@@ -435,6 +636,7 @@ class LandWaterMask():
         except Exception as err:
             LOG.error("Writing to LWM file {} failed".format(lwm_file))
             LOG.debug("EXCEPTION: {}".format(err))
+            file_obj.close()
             return 1
 
         return 0
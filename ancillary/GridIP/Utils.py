@@ -15,9 +15,22 @@ import string
 import numpy as np
 from bisect import bisect_left, bisect_right
 
+import h5py
+
 # every module should have a LOG object
 LOG = logging.getLogger('Utils')
 
+# The geolocation collection short names, and the number of detectors in each scan
+geoCollections = {'GMTCO': 'VIIRS-MOD-GEO-TC', 'GITCO': 'VIIRS-IMG-GEO-TC'}
+geoDetectors = {'GMTCO': 16, 'GITCO': 32}
+
+
+def geoDatasetPath(geoPrefix, datasetName):
+    '''
+    Return the path of a dataset in a VIIRS geolocation file.
+    '''
+    return '/All_Data/{}_All/{}'.format(geoCollections[geoPrefix], datasetName)
+
 
 def index(a, x):
     '''Locate the leftmost value exactly equal to x'''
@@ -154,6 +167,98 @@ def findDatelineCrossings(latCrnList, lonCrnList):
     return num180Crossings_
 
 
+def getFootprint(geoFileName, geoPrefix='GMTCO'):
+    '''
+    Read the footprint of a geolocation granule from the granule metadata (the bounding
+    coordinates and the G-Ring), without reading the latitude and longitude datasets. The
+    footprint is approximate, and is intended for planning rather than granulation.
+    '''
+
+    collection = geoCollections[geoPrefix]
+    granGroupName = '/Data_Products/{0}/{0}_Gran_0'.format(collection)
+
+    geoFileObj = h5py.File(geoFileName, 'r')
+    try:
+        attrs = geoFileObj[granGroupName].attrs
+        footprint = {
+            'north': float(attrs['North_Bounding_Coordinate'][0][0]),
+            'south': float(attrs['South_Bounding_Coordinate'][0][0]),
+            'east': float(attrs['East_Bounding_Coordinate'][0][0]),
+            'west': float(attrs['West_Bounding_Coordinate'][0][0]),
+            'gRingLat': np.array(attrs['G-Ring_Latitude'], dtype=np.float64).ravel(),
+            'gRingLon': np.array(attrs['G-Ring_Longitude'], dtype=np.float64).ravel(),
+        }
+    finally:
+        geoFileObj.close()
+
+    # A western bound east of the eastern bound means the granule crosses the dateline.
+    footprint['crossesDateline'] = footprint['west'] > footprint['east']
+
+    LOG.debug("Footprint of {}: N={north}, S={south}, E={east}, W={west}".format(
+        geoFileName, **footprint))
+
+    return footprint
+
+
+def footprintLonRange(footprint):
+    '''
+    Return the longitude extent of a footprint in degrees, allowing for dateline crossings.
+    '''
+    lonRange = footprint['east'] - footprint['west']
+    return lonRange + 360. if footprint['crossesDateline'] else lonRange
+
+
+def footprintSubsetShape(footprint, dLat=30. / 3600., dLon=30. / 3600.):
+    '''
+    Estimate the shape of the DEM subset required to granulate a footprint. This is a useful
+    measure of the cost of granulating the footprint.
+    '''
+    nRows = int(np.ceil((footprint['north'] - footprint['south']) / dLat)) + 3
+    nCols = int(np.ceil(footprintLonRange(footprint) / dLon)) + 3
+    return nRows, nCols
+
+
+def footprintUnion(footprints):
+    '''
+    Return the smallest footprint covering all of the input footprints. The longitude extent is
+    the shortest arc of the circle covering every footprint, which crosses the dateline if that
+    is shorter.
+    '''
+    intervals = []
+    for footprint in footprints:
+        if footprint['crossesDateline']:
+            intervals += [[footprint['west'], 180.], [-180., footprint['east']]]
+        else:
+            intervals.append([footprint['west'], footprint['east']])
+
+    # Merge the overlapping longitude intervals
+    intervals.sort()
+    merged = [intervals[0]]
+    for west, east in intervals[1:]:
+        if west <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], east)
+        else:
+            merged.append([west, east])
+
+    # The union extent is the complement of the largest uncovered gap, which is either the gap
+    # across the dateline, or one between two of the merged intervals.
+    wrapGap = merged[0][0] + 360. - merged[-1][1]
+    gaps = [merged[idx + 1][0] - merged[idx][1] for idx in range(len(merged) - 1)]
+    if gaps and max(gaps) > wrapGap:
+        idx = int(np.argmax(gaps))
+        west, east = merged[idx + 1][0], merged[idx][1]
+    else:
+        west, east = merged[0][0], merged[-1][1]
+
+    return {
+        'north': max([footprint['north'] for footprint in footprints]),
+        'south': min([footprint['south'] for footprint in footprints]),
+        'west': west,
+        'east': east,
+        'crossesDateline': west > east,
+    }
+
+
 def plotArr(data, pngName, vmin=None, vmax=None):
     '''
     Plot the input array, with a colourbar.
@@ -11,4 +11,4 @@ Copyright (c) 2013 University of Wisconsin SSEC. All rights reserved.
 Licensed under GNU GPLv3.
 """
 
-from .LandWaterMask import LandWaterMask
+from .LandWaterMask import LandWaterMask, DemSubset, DEM_FILENAME, getGrid2Gran, getDEM
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+cdl.py
+
+ * DESCRIPTION: A minimal parser for the Common Data Language (CDL) templates of the ancillary
+ output files, and routines for creating NetCDF4 files directly from the parsed schema.
+
+ Only the subset of CDL used by the ancillary templates is supported: dimensions (including
+ UNLIMITED), variables with their attributes, the netCDF4 special attributes (_Storage,
+ _ChunkSizes, _DeflateLevel, _Shuffle, _Endianness, _Fletcher32), and global attributes. Any
+ "data:" section is ignored.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import re
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+LOG = logging.getLogger('cdl')
+
+# Parsed schemas, so that each template is only parsed once per process.
+_schema_cache = {}
+
+cdl_var_types = {
+    'char': 'S1',
+    'byte': 'i1',
+    'ubyte': 'u1',
+    'short': 'i2',
+    'ushort': 'u2',
+    'int': 'i4',
+    'long': 'i4',
+    'uint': 'u4',
+    'int64': 'i8',
+    'uint64': 'u8',
+    'float': 'f4',
+    'real': 'f4',
+    'double': 'f8',
+    'string': str,
+}
+
+# Attribute value suffixes, and the corresponding types (longest suffixes first)
+cdl_attr_suffixes = [
+    ('ull', 'u8'), ('ll', 'i8'), ('ub', 'u1'), ('us', 'u2'), ('u', 'u4'),
+    ('b', 'i1'), ('s', 'i2'), ('l', 'i4'), ('f', 'f4'), ('d', 'f8'),
+]
+
+cdl_special_attrs = ['_Storage', '_ChunkSizes', '_DeflateLevel', '_Shuffle', '_Endianness',
+                     '_Fletcher32', '_NoFill', '_Format']
+
+# The netCDF file formats named by the _Format attribute
+cdl_formats = {
+    'classic': 'NETCDF3_CLASSIC',
+    '64-bit offset': 'NETCDF3_64BIT_OFFSET',
+    '64-bit data': 'NETCDF3_64BIT_DATA',
+    'netcdf-4': 'NETCDF4',
+    'netcdf-4 classic model': 'NETCDF4_CLASSIC',
+}
+
+re_dimension = re.compile(r'^(?P<name>[^\s=]+)\s*=\s*(?P<size>\w+)$')
+re_variable = re.compile(
+    r'^(?P<type>[a-z0-9]+)\s+(?P<name>[^\s(]+)\s*(\((?P<dims>[^)]*)\))?$')
+re_attribute = re.compile(r'^(?P<var>[^\s:]*)\s*:\s*(?P<name>[^\s=]+)\s*=\s*(?P<value>.*)$',
+                          re.DOTALL)
+
+
+def _split_statements(text):
+    '''
+    Strip the comments from CDL text, and split it into ';'-terminated statements and section
+    labels, respecting quoted strings.
+    '''
+    statements = []
+    current = []
+    in_string = False
+    idx = 0
+    while idx < len(text):
+        char = text[idx]
+        if in_string:
+            current.append(char)
+            if char == '\\' and idx + 1 < len(text):
+                current.append(text[idx + 1])
+                idx += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            current.append(char)
+        elif text.startswith('//', idx):
+            while idx < len(text) and text[idx] != '\n':
+                idx += 1
+            continue
+        elif char == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        elif char == ':' and ''.join(current).strip() in ['dimensions', 'variables', 'data']:
+            statements.append(''.join(current).strip() + ':')
+            current = []
+        elif char in '{}':
+            statements.append(''.join(current).strip())
+            statements.append(char)
+            current = []
+        else:
+            current.append(char)
+        idx += 1
+
+    statements.append(''.join(current).strip())
+    return [stmt for stmt in statements if stmt != '']
+
+
+def _split_values(value_str):
+    '''
+    Split a comma-separated CDL attribute value list, respecting quoted strings.
+    '''
+    values = []
+    current = []
+    in_string = False
+    for char in value_str:
+        if char == '"':
+            in_string = not in_string
+        if char == ',' and not in_string:
+            values.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    values.append(''.join(current).strip())
+    return [value for value in values if value != '']
+
+
+def _parse_attr_value(value_str):
+    '''
+    Convert a CDL attribute value to a string or a typed numpy value/array.
+    '''
+    values = _split_values(value_str)
+
+    if values and values[0].startswith('"'):
+        strings = [bytes(value[1:-1], 'utf-8').decode('unicode_escape') for value in values]
+        return ''.join(strings)
+
+    attr_type = None
+    numbers = []
+    for value in values:
+        lower_value = value.lower()
+        value_type = None
+        is_hex = lower_value.lstrip('+-').startswith('0x')
+        for suffix, suffix_type in cdl_attr_suffixes:
+            # A trailing suffix letter marks the type of a (non-hex) number
+            if lower_value.endswith(suffix) and not is_hex:
+                number = lower_value[:-len(suffix)]
+                try:
+                    float(number)
+                except ValueError:
+                    continue
+                value_type = suffix_type
+                lower_value = number
+                break
+
+        if value_type is None:
+            if lower_value in ['nan', 'nanf', 'infinity', '-infinity', 'inf', '-inf']:
+                value_type = 'f4' if lower_value.endswith('f') else 'f8'
+                lower_value = lower_value.rstrip('f')
+            elif re.match(r'^[-+]?(0x[0-9a-f]+|\d+)$', lower_value):
+                value_type = 'i4'
+            else:
+                value_type = 'f8'
+
+        attr_type = value_type if attr_type is None else attr_type
+        if is_hex:
+            numbers.append(int(lower_value, 16))
+        else:
+            numbers.append(float(lower_value) if attr_type[0] == 'f' else int(float(lower_value)))
+
+    attr_value = np.array(numbers, dtype=attr_type)
+    return attr_value[0] if attr_value.size == 1 else attr_value
+
+
+def parse_cdl(cdl_text):
+    '''
+    Parse CDL text into a schema dictionary with "dimensions", "variables" and "attributes" keys.
+    '''
+    schema = {'name': None, 'dimensions': OrderedDict(), 'variables': OrderedDict(),
+              'attributes': OrderedDict()}
+
+    section = None
+    for stmt in _split_statements(cdl_text):
+
+        if stmt in ['{', '}']:
+            continue
+        elif stmt.startswith('netcdf '):
+            schema['name'] = stmt.split()[1]
+            continue
+        elif stmt in ['dimensions:', 'variables:', 'data:']:
+            section = stmt[:-1]
+            continue
+
+        if section == 'dimensions':
+            for dim_stmt in _split_values(stmt):
+                match = re_dimension.match(dim_stmt)
+                if match is None:
+                    raise ValueError('Invalid CDL dimension: "{}"'.format(dim_stmt))
+                size = match.group('size')
+                schema['dimensions'][match.group('name')] = \
+                    None if size.upper() == 'UNLIMITED' else int(size)
+
+        elif section == 'variables':
+            match = re_attribute.match(stmt)
+            if match is not None and (match.group('var') == '' or
+                                      match.group('var') in schema['variables']):
+                var_name = match.group('var')
+                attrs = schema['attributes'] if var_name == '' else \
+                    schema['variables'][var_name]['attributes']
+                attrs[match.group('name')] = _parse_attr_value(match.group('value'))
+                continue
+
+            match = re_variable.match(stmt)
+            if match is None or match.group('type') not in cdl_var_types:
+                raise ValueError('Invalid CDL variable: "{}"'.format(stmt))
+            dims = match.group('dims')
+            dims = [dim.strip() for dim in dims.split(',')] if dims else []
+            schema['variables'][match.group('name')] = {
+                'type': cdl_var_types[match.group('type')],
+                'dimensions': dims,
+                'attributes': OrderedDict()
+            }
+
+        elif section == 'data':
+            continue
+
+        else:
+            raise ValueError('Unexpected CDL statement: "{}"'.format(stmt))
+
+    return schema
+
+
+def get_cdl_schema(cdl_file):
+    '''
+    Return the parsed schema of a CDL file, parsing it only on the first call in this process.
+    '''
+    if cdl_file not in _schema_cache:
+        LOG.debug("Parsing CDL template {}".format(cdl_file))
+        with open(cdl_file, 'r') as file_obj:
+            _schema_cache[cdl_file] = parse_cdl(file_obj.read())
+
+    return _schema_cache[cdl_file]
+
+
+def schema_format(schema):
+    '''
+    Return the netCDF file format of a schema, as "ncgen -b" would choose it: the format named by
+    the _Format global attribute, otherwise netCDF-4 classic model if any variable has netCDF-4
+    storage attributes, otherwise netCDF classic.
+    '''
+    if '_Format' in schema['attributes']:
+        format_name = str(schema['attributes']['_Format']).lower()
+        if format_name not in cdl_formats:
+            raise ValueError('Unknown CDL _Format: "{}"'.format(schema['attributes']['_Format']))
+        return cdl_formats[format_name]
+
+    for var_dict in schema['variables'].values():
+        if any([attr in var_dict['attributes'] for attr in cdl_special_attrs]):
+            return 'NETCDF4_CLASSIC'
+
+    return 'NETCDF3_CLASSIC'
+
+
+def create_from_schema(file_obj, schema, dim_sizes=None, var_options=None):
+    '''
+    Create the dimensions, variables and global attributes of a schema in an open netCDF4
+    Dataset. Dimension sizes in the schema may be overridden with dim_sizes, and variable storage
+    options (e.g. zlib, chunksizes) may be set per variable with var_options, otherwise those in
+    the schema special attributes are used.
+    '''
+    dim_sizes = {} if dim_sizes is None else dim_sizes
+    var_options = {} if var_options is None else var_options
+
+    for dim_name, dim_size in schema['dimensions'].items():
+        file_obj.createDimension(dim_name, dim_sizes.get(dim_name, dim_size))
+
+    for var_name, var_dict in schema['variables'].items():
+        attrs = var_dict['attributes']
+
+        kwargs = {}
+        if '_FillValue' in attrs:
+            kwargs['fill_value'] = attrs['_FillValue']
+        if '_DeflateLevel' in attrs:
+            kwargs['zlib'] = True
+            kwargs['complevel'] = int(attrs['_DeflateLevel'])
+        if str(attrs.get('_Shuffle', '')).lower() == 'true':
+            kwargs['shuffle'] = True
+        if str(attrs.get('_Fletcher32', '')).lower() == 'true':
+            kwargs['fletcher32'] = True
+        if str(attrs.get('_Storage', '')).lower() == 'contiguous':
+            kwargs['contiguous'] = True
+        if '_ChunkSizes' in attrs:
+            kwargs['chunksizes'] = [int(size) for size in np.atleast_1d(attrs['_ChunkSizes'])]
+        if '_Endianness' in attrs:
+            kwargs['endian'] = str(attrs['_Endianness'])
+        kwargs.update(var_options.get(var_name, {}))
+
+        var_obj = file_obj.createVariable(var_name, var_dict['type'], var_dict['dimensions'],
+                                          **kwargs)
+        var_obj.setncatts({name: value for name, value in attrs.items()
+                           if name not in ['_FillValue'] + cdl_special_attrs})
+
+    file_obj.setncatts({name: value for name, value in schema['attributes'].items()
+                        if name not in cdl_special_attrs})
@@ -0,0 +1,694 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+lwm_cache.py
+
+ * DESCRIPTION: A content-addressed cache for granulated Land Water Mask (LWM) files. Cache entries
+ are keyed by a hash of the granule geolocation arrays and the DEM version, so that identical
+ geolocation is only ever granulated once, regardless of the granule timestamps. A manifest of the
+ file sizes, modification times and checksums is used to validate cache entries. The checksum is
+ only computed again if the size or modification time of a file no longer matches.
+
+ Optionally, entries are also indexed by their position in the orbit repeat cycle, so that the LWM
+ of a granule on a previously seen ground track can be reused if the nearest DEM cell of every
+ pixel is the same.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import re
+from os.path import basename, dirname, exists, isdir, isfile, join as pjoin
+import logging
+import hashlib
+import socket
+import sqlite3
+import time
+import fcntl
+
+import numpy as np
+import h5py
+
+from netCDF4 import Dataset
+
+from ancillary.GridIP.Utils import geoDatasetPath
+from ancillary.GridIP.LandWaterMask import DEM_FILENAME, DEM_DLAT, DEM_DLON, DEM_NCOLS
+
+LOG = logging.getLogger('lwm_cache')
+
+# Bump this whenever the content or layout of the granulated LWM files changes, so that existing
+# cache entries are no longer matched.
+LWM_FORMAT_VERSION = 2
+
+# The version of the manifest database schema
+MANIFEST_VERSION = 4
+
+# The number of orbits in the 16 day repeat cycle of the JPSS orbit
+REPEAT_CYCLE_ORBITS = 227
+
+# Old-style hourly cache dirs, e.g. "2018_08_07_219-20h"
+legacy_dir_pattern = re.compile(r'^\d{4}_\d{2}_\d{2}_\d{3}-\d{2}h$')
+
+# Temporary LWM files, e.g. ".AF-LAND_MASK_NASA_1KM_<key>.nc.<pid>.tmp"
+temp_file_pattern = re.compile(r'^\.\S+_([0-9a-f]{40})\.nc\.(\d+)\.tmp$')
+
+# The LWM filename prefix for each geolocation type. The geolocation type is also part of the
+# cache key, so the 750m and 375m LWMs are separate namespaces in the cache.
+lwm_file_prefixes = {
+    'GMTCO': 'AF-LAND_MASK_NASA_1KM',
+    'GITCO': 'AF-LAND_MASK_NASA_375M',
+}
+
+
+def dem_version(ancil_dir):
+    '''
+    Return a string identifying the version of the DEM used to granulate the LWM.
+    '''
+    dem_file = pjoin(ancil_dir, DEM_FILENAME)
+    dem_stat = os.stat(dem_file)
+    return '{}:{}:{}'.format(basename(dem_file), dem_stat.st_size, int(dem_stat.st_mtime))
+
+
+def read_geolocation(geo_file, geo_prefix='GMTCO'):
+    '''
+    Read the latitude and longitude arrays from a VIIRS geolocation file.
+    '''
+    geo_file_obj = h5py.File(geo_file, 'r')
+    try:
+        latitude = geo_file_obj[geoDatasetPath(geo_prefix, 'Latitude')][:].astype(
+            np.float32, copy=False)
+        longitude = geo_file_obj[geoDatasetPath(geo_prefix, 'Longitude')][:].astype(
+            np.float32, copy=False)
+    finally:
+        geo_file_obj.close()
+
+    return latitude, longitude
+
+
+def lwm_cache_key(latitude, longitude, dem_ver, geo_prefix='GMTCO', compressed=False):
+    '''
+    Compute the cache key of a granulated LWM from the geolocation arrays and the DEM version.
+    Compressed LWM files may have a different netCDF format, so they have different keys.
+    '''
+    key_hash = hashlib.sha1()
+    key_hash.update('{}:{}:{}{}'.format(LWM_FORMAT_VERSION, geo_prefix, dem_ver,
+                                        ':zlib' if compressed else '').encode())
+    for arr in [latitude, longitude]:
+        arr = np.ascontiguousarray(arr)
+        key_hash.update('{}:{}'.format(arr.dtype.str, arr.shape).encode())
+        key_hash.update(arr.data)
+
+    return key_hash.hexdigest()
+
+
+def orbit_track(orbit):
+    '''
+    Return the ground track number of an orbit within the repeat cycle.
+    '''
+    return int(orbit) % REPEAT_CYCLE_ORBITS
+
+
+def nearest_dem_cells(latitude, longitude):
+    '''
+    Return the flat index of the nearest DEM cell to each pixel, with -1 for fill values.
+    '''
+    valid = latitude >= -800.
+    rows = np.rint((90. - latitude) / DEM_DLAT).astype(np.int64)
+    cols = np.rint((longitude + 180.) / DEM_DLON).astype(np.int64) % DEM_NCOLS
+    cells = rows * DEM_NCOLS + cols
+    cells[~valid] = -1
+    return cells
+
+
+def match_dem_cells(lwm_file, latitude, longitude, min_agreement=1.):
+    '''
+    Compare the nearest DEM cells of the geolocation with those of the geolocation stored in an
+    existing LWM file. Returns the LandMask of the LWM file if the fraction of pixels with the
+    same nearest DEM cell is at least min_agreement, otherwise None.
+    '''
+    file_obj = Dataset(lwm_file, 'r')
+    try:
+        file_obj.set_auto_mask(False)
+        stored_latitude = file_obj['Latitude'][:]
+        stored_longitude = file_obj['Longitude'][:]
+        if stored_latitude.shape != latitude.shape:
+            return None
+
+        agreement = np.mean(nearest_dem_cells(latitude, longitude) ==
+                            nearest_dem_cells(stored_latitude, stored_longitude))
+        LOG.debug("Nearest DEM cell agreement with {}: {:.6f}".format(lwm_file, agreement))
+        if agreement < min_agreement:
+            return None
+
+        return file_obj['LandMask'][:]
+    finally:
+        file_obj.close()
+
+
+def file_checksum(filename, block_size=4 * 1024 * 1024):
+    '''
+    Compute the SHA-1 checksum of a file.
+    '''
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as file_obj:
+        while True:
+            block = file_obj.read(block_size)
+            if not block:
+                break
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def pid_exists(pid):
+    '''
+    Return whether a process with the given pid exists on this host.
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_same_file(file_obj, filename):
+    '''
+    Return whether an open file is still the file at filename, which may have been removed or
+    replaced since it was opened.
+    '''
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        return False
+    open_stat = os.fstat(file_obj.fileno())
+    return (file_stat.st_dev, file_stat.st_ino) == (open_stat.st_dev, open_stat.st_ino)
+
+
+class LwmCache():
+    '''
+    The LWM cache directory, and the manifest recording the checksum of every valid entry. The
+    manifest connection is kept open for the lifetime of the object (or until close()).
+    '''
+
+    def __init__(self, cache_dir, geo_prefix='GMTCO'):
+        self.cache_dir = cache_dir
+        self.file_prefix = lwm_file_prefixes[geo_prefix]
+        self.lwm_dir = pjoin(cache_dir, 'lwm')
+        self.manifest_file = pjoin(cache_dir, 'lwm_manifest.db')
+        self._conn = None
+
+    def _connect(self):
+        '''
+        Return the connection to the manifest database. The database is opened, and its schema
+        created or migrated if required, on the first call only.
+        '''
+        if self._conn is None:
+            conn = sqlite3.connect(self.manifest_file, timeout=60.)
+            try:
+                if conn.execute('PRAGMA user_version').fetchone()[0] < MANIFEST_VERSION:
+                    self._create_schema(conn)
+            except Exception:
+                conn.close()
+                raise
+            self._conn = conn
+
+        return self._conn
+
+    def _create_schema(self, conn):
+        '''
+        Create the manifest tables, or migrate those of an older manifest version. This is done in
+        a single write transaction, so that concurrent processes don't migrate it twice.
+        '''
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= MANIFEST_VERSION:
+                return
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS lwm (
+                             key TEXT PRIMARY KEY,
+                             file TEXT NOT NULL,
+                             checksum TEXT NOT NULL,
+                             size INTEGER NOT NULL,
+                             granule_id TEXT,
+                             created REAL NOT NULL,
+                             accessed REAL NOT NULL DEFAULT 0,
+                             mtime REAL NOT NULL DEFAULT 0)''')
+
+            # The repeat cycle index, with the first scan corners of each entry's geolocation
+            conn.execute('''CREATE TABLE IF NOT EXISTS lwm_track (
+                             key TEXT PRIMARY KEY,
+                             geo_prefix TEXT NOT NULL,
+                             dem_version TEXT NOT NULL,
+                             track INTEGER NOT NULL,
+                             rows INTEGER NOT NULL,
+                             cols INTEGER NOT NULL,
+                             lat0 REAL, lat1 REAL, lat2 REAL, lat3 REAL,
+                             lon0 REAL, lon1 REAL, lon2 REAL, lon3 REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS lwm_track_idx ON lwm_track '
+                         '(track, rows, cols)')
+
+            # Manifests written before access times were recorded lack the "accessed" column,
+            # and those written before modification times were recorded lack the "mtime" column.
+            # The entries of the latter are checksummed (and their mtime recorded) on their next
+            # lookup.
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(lwm)')]
+            if 'accessed' not in columns:
+                conn.execute('ALTER TABLE lwm ADD COLUMN accessed REAL NOT NULL DEFAULT 0')
+                conn.execute('UPDATE lwm SET accessed = created')
+            if 'mtime' not in columns:
+                conn.execute('ALTER TABLE lwm ADD COLUMN mtime REAL NOT NULL DEFAULT 0')
+
+            # The temporary LWM files of the producers, and the keys with producer lock files, so
+            # that the files a producer leaves behind can be found without scanning the cache.
+            # Those already in a cache written before they were recorded are found once, here.
+            conn.execute('''CREATE TABLE IF NOT EXISTS lwm_temp (
+                             file TEXT PRIMARY KEY,
+                             key TEXT NOT NULL,
+                             host TEXT NOT NULL,
+                             pid INTEGER NOT NULL,
+                             created REAL NOT NULL)''')
+            conn.execute('CREATE TABLE IF NOT EXISTS lwm_lock (key TEXT PRIMARY KEY)')
+            if isdir(self.lwm_dir):
+                for dir_name in os.listdir(self.lwm_dir):
+                    entry_dir = pjoin(self.lwm_dir, dir_name)
+                    for file_name in os.listdir(entry_dir):
+                        match = temp_file_pattern.match(file_name)
+                        if match is not None:
+                            temp_file = pjoin(entry_dir, file_name)
+                            conn.execute('INSERT OR IGNORE INTO lwm_temp VALUES (?, ?, ?, ?, ?)',
+                                         (os.path.relpath(temp_file, self.cache_dir),
+                                          match.group(1), '', int(match.group(2)),
+                                          os.stat(temp_file).st_mtime))
+                        elif file_name.endswith('.lock'):
+                            conn.execute('INSERT OR IGNORE INTO lwm_lock VALUES (?)',
+                                         (file_name[:-len('.lock')],))
+
+            conn.execute('PRAGMA user_version = {}'.format(MANIFEST_VERSION))
+
+    def close(self):
+        '''
+        Close the connection to the manifest database, if it is open.
+        '''
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def entry_path(self, key):
+        '''
+        Return the path of the LWM file for the cache key, creating the parent dir if required.
+        '''
+        entry_dir = pjoin(self.lwm_dir, key[:2])
+        if not exists(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+
+        return pjoin(entry_dir, '{}_{}.nc'.format(self.file_prefix, key))
+
+    def lock_path(self, key):
+        '''
+        Return the path of the producer lock file for the cache key.
+        '''
+        return pjoin(dirname(self.entry_path(key)), '{}.lock'.format(key))
+
+    def temp_path(self, key):
+        '''
+        Return a process-unique temporary path in the entry dir, which is renamed to the entry
+        path once the LWM file is complete. The path is recorded in the manifest until it is
+        committed or discarded, so that sweep_dirs() can remove it if this process dies first.
+        '''
+        lwm_file = self.entry_path(key)
+        temp_file = pjoin(dirname(lwm_file), '.{}.{}.tmp'.format(basename(lwm_file),
+                                                                 os.getpid()))
+
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO lwm_temp VALUES (?, ?, ?, ?, ?)',
+                         (os.path.relpath(temp_file, self.cache_dir), key, socket.gethostname(),
+                          os.getpid(), time.time()))
+
+        return temp_file
+
+    def discard_temp(self, temp_file):
+        '''
+        Remove a temporary LWM file which was not committed, and its manifest record.
+        '''
+        if exists(temp_file):
+            LOG.debug("Removing uncommitted LWM file {}".format(temp_file))
+            os.remove(temp_file)
+
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM lwm_temp WHERE file = ?',
+                         (os.path.relpath(temp_file, self.cache_dir),))
+
+    def lock(self, key, timeout=600., poll_interval=0.5):
+        '''
+        Take the exclusive producer lock for a cache entry. If another process holds the lock it is
+        granulating this LWM, so we wait for it to finish (up to timeout seconds). Returns the
+        locked file object, or None if the lock could not be obtained. The key of the lock file is
+        recorded in the manifest, so that sweep_dirs() can find it.
+        '''
+        lock_file = self.lock_path(key)
+        lock_obj = open(lock_file, 'a')
+
+        start_time = time.time()
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(lock_obj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                if timeout <= 0.:
+                    lock_obj.close()
+                    return None
+                if not waiting:
+                    LOG.info("\tWaiting for another process to produce LWM {}...".format(key))
+                    waiting = True
+                if time.time() - start_time > timeout:
+                    LOG.warning("Timed out after {} seconds waiting for lock {}".format(
+                        timeout, lock_file))
+                    lock_obj.close()
+                    return None
+                time.sleep(poll_interval)
+                continue
+
+            # The lock file may have been removed by sweep_dirs() while we waited for it, in which
+            # case we hold the lock of a deleted file, and must lock the current one instead.
+            if is_same_file(lock_obj, lock_file):
+                if waiting:
+                    LOG.debug("Obtained lock {} after {:.1f} seconds".format(
+                        lock_file, time.time() - start_time))
+                try:
+                    conn = self._connect()
+                    with conn:
+                        conn.execute('INSERT OR IGNORE INTO lwm_lock VALUES (?)', (key,))
+                except Exception:
+                    self.unlock(lock_obj)
+                    raise
+                return lock_obj
+            fcntl.flock(lock_obj.fileno(), fcntl.LOCK_UN)
+            lock_obj.close()
+            lock_file = self.lock_path(key)
+            lock_obj = open(lock_file, 'a')
+
+    def unlock(self, lock_obj):
+        '''
+        Release a producer lock obtained from lock().
+        '''
+        if lock_obj is not None:
+            fcntl.flock(lock_obj.fileno(), fcntl.LOCK_UN)
+            lock_obj.close()
+
+    def commit(self, key, temp_file, granule_id=None):
+        '''
+        Atomically move a completed LWM file into place, and record it in the manifest.
+        '''
+        lwm_file = self.entry_path(key)
+        os.rename(temp_file, lwm_file)
+        self.insert(key, lwm_file, granule_id, temp_file=temp_file)
+        return lwm_file
+
+    def lookup(self, key):
+        '''
+        Return the LWM file for the cache key if there is a valid cache entry, otherwise None.
+        Invalid entries are removed from the cache. An entry whose file has the recorded size and
+        modification time is valid, otherwise the file is checksummed.
+        '''
+        conn = self._connect()
+        row = conn.execute('SELECT file, checksum, size, mtime FROM lwm WHERE key = ?',
+                           (key,)).fetchone()
+
+        if row is None:
+            LOG.debug("No LWM cache entry for key {}".format(key))
+            return None
+
+        lwm_file = pjoin(self.cache_dir, row[0])
+        checksum, size, mtime = row[1], row[2], row[3]
+
+        if not isfile(lwm_file):
+            LOG.warning("LWM cache file {} is missing, removing entry.".format(lwm_file))
+            self.remove(key)
+            return None
+
+        file_stat = os.stat(lwm_file)
+        if file_stat.st_size != size:
+            LOG.warning("LWM cache file {} has the wrong size, removing.".format(lwm_file))
+            self.remove(key)
+            return None
+
+        if file_stat.st_mtime != mtime:
+            if file_checksum(lwm_file) != checksum:
+                LOG.warning("LWM cache file {} fails the checksum, removing.".format(lwm_file))
+                self.remove(key)
+                return None
+            LOG.debug("LWM cache file {} passes the checksum, updating its mtime.".format(
+                lwm_file))
+
+        self.touch(key, file_stat.st_mtime)
+
+        LOG.debug("Found valid LWM cache file {} for key {}".format(lwm_file, key))
+        return lwm_file
+
+    def touch(self, key, mtime):
+        '''
+        Update the access time of a cache entry, and the modification time of its validated file.
+        '''
+        conn = self._connect()
+        with conn:
+            conn.execute('UPDATE lwm SET accessed = ?, mtime = ? WHERE key = ?',
+                         (time.time(), mtime, key))
+
+    def insert(self, key, lwm_file, granule_id=None, temp_file=None):
+        '''
+        Record the checksum of a newly created LWM file in the manifest, and forget the temporary
+        file it was renamed from.
+        '''
+        file_stat = os.stat(lwm_file)
+        size = file_stat.st_size
+        checksum = file_checksum(lwm_file)
+        rel_file = os.path.relpath(lwm_file, self.cache_dir)
+
+        conn = self._connect()
+        with conn:
+            now = time.time()
+            conn.execute('INSERT OR REPLACE INTO lwm VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (key, rel_file, checksum, size, granule_id, now, now,
+                          file_stat.st_mtime))
+            if temp_file is not None:
+                conn.execute('DELETE FROM lwm_temp WHERE file = ?',
+                             (os.path.relpath(temp_file, self.cache_dir),))
+
+        LOG.debug("Added LWM cache entry {} ({} bytes, sha1 {})".format(rel_file, size, checksum))
+
+    def remove(self, key):
+        '''
+        Remove a cache entry, and its LWM file.
+        '''
+        conn = self._connect()
+        with conn:
+            row = conn.execute('SELECT file FROM lwm WHERE key = ?', (key,)).fetchone()
+            conn.execute('DELETE FROM lwm WHERE key = ?', (key,))
+            conn.execute('DELETE FROM lwm_track WHERE key = ?', (key,))
+
+        if row is None:
+            return
+        lwm_file = pjoin(self.cache_dir, row[0])
+        if isfile(lwm_file):
+            LOG.debug("Removing LWM cache file {}".format(lwm_file))
+            os.remove(lwm_file)
+
+    def insert_track(self, key, geo_prefix, dem_ver, track, shape, lat_corners, lon_corners):
+        '''
+        Index a cache entry by its ground track in the repeat cycle, and its first scan corners.
+        '''
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO lwm_track VALUES '
+                         '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         [key, geo_prefix, dem_ver, track, shape[0], shape[1]] +
+                         [float(x) for x in lat_corners] + [float(x) for x in lon_corners])
+
+    def find_track(self, geo_prefix, dem_ver, track, shape, lat_corners, lon_corners,
+                   tolerance):
+        '''
+        Return the keys of the cache entries on the same ground track whose first scan corners
+        are all within tolerance degrees of those given, closest first.
+        '''
+        conditions = []
+        condition_args = []
+        distance = []
+        distance_args = []
+        for idx, (lat, lon) in enumerate(zip(lat_corners, lon_corners)):
+            conditions.append('ABS(lat{0} - ?) <= ? AND ABS(lon{0} - ?) <= ?'.format(idx))
+            condition_args += [float(lat), tolerance, float(lon), tolerance]
+            distance.append('ABS(lat{0} - ?) + ABS(lon{0} - ?)'.format(idx))
+            distance_args += [float(lat), float(lon)]
+
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT lwm_track.key FROM lwm_track JOIN lwm ON lwm.key = lwm_track.key '
+            'WHERE geo_prefix = ? AND dem_version = ? AND track = ? AND rows = ? AND cols = ? '
+            'AND {} ORDER BY {}'.format(' AND '.join(conditions), ' + '.join(distance)),
+            [geo_prefix, dem_ver, track, shape[0], shape[1]] + condition_args + distance_args
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    def size(self):
+        '''
+        Return the number of entries and the total size in bytes of the cache, from the manifest.
+        '''
+        conn = self._connect()
+        num_entries, total_size = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM lwm').fetchone()
+
+        return num_entries, total_size
+
+    def evict(self, max_bytes=None, max_idle_hours=None, min_idle_seconds=600.):
+        '''
+        Evict least recently used entries until the cache is no larger than max_bytes, and evict
+        any entries which have not been accessed in max_idle_hours. Entries accessed in the last
+        min_idle_seconds, or which are locked by a producer, are never evicted, since a
+        concurrent run may be about to use them. Returns the number of bytes freed.
+        '''
+        now = time.time()
+        num_entries, total_size = self.size()
+        LOG.debug("LWM cache has {} entries, {} bytes".format(num_entries, total_size))
+
+        conn = self._connect()
+        rows = conn.execute('SELECT key, size, accessed FROM lwm ORDER BY accessed ASC'
+                            ).fetchall()
+
+        freed_bytes = 0
+        for key, size, accessed in rows:
+            over_budget = max_bytes is not None and total_size - freed_bytes > max_bytes
+            too_idle = max_idle_hours is not None and now - accessed > max_idle_hours * 3600.
+            if not (over_budget or too_idle):
+                # Rows are ordered by access time, so the remaining entries are all newer.
+                break
+            if now - accessed < min_idle_seconds:
+                LOG.debug("LWM cache entry {} was recently used, not evicting.".format(key))
+                break
+
+            lock_obj = self.lock(key, timeout=0.)
+            if lock_obj is None:
+                LOG.debug("LWM cache entry {} is locked, not evicting.".format(key))
+                continue
+            try:
+                LOG.debug("Evicting LWM cache entry {} ({} bytes, idle {:.1f} hours)".format(
+                    key, size, (now - accessed) / 3600.))
+                self.remove(key)
+                freed_bytes += size
+            finally:
+                self.unlock(lock_obj)
+
+        return freed_bytes
+
+    def sweep_temp(self, temp_timeout=600.):
+        '''
+        Remove the temporary LWM files of producers which died before committing or removing
+        them. A file is removed if its process no longer exists on this host, or if it is older
+        than temp_timeout seconds, and only while we hold the producer lock of its key.
+        '''
+        conn = self._connect()
+        rows = conn.execute('SELECT file, key, host, pid, created FROM lwm_temp').fetchall()
+
+        now = time.time()
+        host = socket.gethostname()
+        for rel_file, key, temp_host, pid, created in rows:
+            if now - created <= temp_timeout and (temp_host != host or pid_exists(pid)):
+                continue
+
+            lock_obj = self.lock(key, timeout=0.)
+            if lock_obj is None:
+                LOG.debug("LWM cache entry {} is locked, not removing {}.".format(key, rel_file))
+                continue
+            try:
+                LOG.debug("Removing the orphaned temporary LWM file {}".format(rel_file))
+                self.discard_temp(pjoin(self.cache_dir, rel_file))
+            finally:
+                self.unlock(lock_obj)
+
+    def sweep_dirs(self, purge_legacy=False):
+        '''
+        Remove the unused producer lock files, and the entry dirs they leave empty, and empty
+        old-style hourly cache dirs. The lock files are found from the manifest rather than by
+        scanning the cache. The LWM files in the old-style dirs are not part of the cache, so they
+        are only removed (allowing their dirs to be removed) if purge_legacy is set.
+        '''
+        for dir_name in sorted(os.listdir(self.cache_dir)):
+            legacy_dir = pjoin(self.cache_dir, dir_name)
+            if legacy_dir_pattern.match(dir_name) and isdir(legacy_dir):
+                if purge_legacy:
+                    for legacy_file in os.listdir(legacy_dir):
+                        if legacy_file.startswith(tuple(lwm_file_prefixes.values()) +
+                                                  ('GRLWM_',)):
+                            LOG.debug("Removing old cache file {}".format(legacy_file))
+                            os.remove(pjoin(legacy_dir, legacy_file))
+                try:
+                    os.rmdir(legacy_dir)
+                    LOG.debug("Removed old cache dir {}".format(legacy_dir))
+                except OSError:
+                    LOG.debug("Old cache dir {} is not empty, leaving.".format(legacy_dir))
+
+        # Only the lock files of the keys which no longer have a cache entry can be removed
+        conn = self._connect()
+        keys = [row[0] for row in conn.execute(
+            'SELECT key FROM lwm_lock WHERE key NOT IN (SELECT key FROM lwm)').fetchall()]
+        for key in keys:
+            if self.remove_lock(key):
+                try:
+                    os.rmdir(pjoin(self.lwm_dir, key[:2]))
+                except OSError:
+                    pass
+
+    def remove_lock(self, key):
+        '''
+        Remove the producer lock file of a key which has no cache entry, unless it is in use.
+        Returns whether it was removed. The file is removed while we hold its lock, so that lock()
+        in another process, which may already have it open, notices the removal and locks the new
+        file. The key is removed from the manifest first, so that it is recorded again by that
+        lock().
+        '''
+        lock_obj = self.lock(key, timeout=0.)
+        if lock_obj is None:
+            return False
+        try:
+            conn = self._connect()
+            with conn:
+                if conn.execute('SELECT key FROM lwm WHERE key = ?', (key,)).fetchone() is not None:
+                    return False
+                conn.execute('DELETE FROM lwm_lock WHERE key = ?', (key,))
+            LOG.debug("Removing unused LWM lock file {}".format(lock_obj.name))
+            os.remove(lock_obj.name)
+            return True
+        finally:
+            self.unlock(lock_obj)
+
+
+def clean_cache(cache_dir, cache_size, cache_window=None, purge_legacy=False, temp_timeout=600.):
+    '''
+    Evict least recently used LWM files until the cache is no larger than cache_size GB, and
+    any which have not been used in the last cache_window hours. The temporary LWM files of dead
+    producers, or older than temp_timeout seconds, are removed. The LWM files of the old-style
+    hourly cache dirs are only removed if purge_legacy is set.
+    '''
+    lwm_cache = LwmCache(cache_dir)
+    try:
+        max_bytes = None if cache_size is None else int(cache_size * 1024 ** 3)
+        freed_bytes = lwm_cache.evict(max_bytes=max_bytes, max_idle_hours=cache_window)
+        lwm_cache.sweep_temp(temp_timeout=temp_timeout)
+        lwm_cache.sweep_dirs(purge_legacy=purge_legacy)
+        num_entries, total_size = lwm_cache.size()
+    finally:
+        lwm_cache.close()
+
+    if freed_bytes > 0:
+        LOG.info("Removed {:.1f} MB of old files from the ancillary cache {}".format(
+            freed_bytes / 1024. ** 2, cache_dir))
+    else:
+        LOG.info("No old files need to be removed from the ancillary cache {}".format(cache_dir))
+    LOG.info("Ancillary cache has {} LWM files, {:.1f} MB".format(
+        num_entries, total_size / 1024. ** 2))
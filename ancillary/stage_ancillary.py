@@ -11,139 +11,322 @@ Licensed under GNU GPLv3.
 """
 
 import os
-from os.path import basename, dirname, curdir, abspath, isdir, isfile, exists, splitext, join as pjoin
+from os.path import basename, dirname, curdir, abspath, splitext, join as pjoin
 import logging
-import shutil
 import traceback
-import fcntl
-from subprocess import call, check_call, CalledProcessError
+from datetime import timedelta
 
-from utils import create_dir, execute_binary_captured_inject_io
+from utils import current_rss_mb, peak_rss_mb
 
 import ancillary.GridIP as GridIP
+from ancillary.GridIP.LandWaterMask import LWM_CDL_FILENAME, DEM_CHUNK_CACHE_MB
+from ancillary.GridIP.Utils import getFootprint, footprintSubsetShape, footprintUnion
+from ancillary.lwm_cache import LwmCache, dem_version, read_geolocation, lwm_cache_key
+from ancillary.lwm_cache import orbit_track, match_dem_cells
+from ancillary.cdl import get_cdl_schema
+from timing import Timer
+from profiling import profile_calls
 
 LOG = logging.getLogger('stage_ancillary')
 
-def nc_from_cdl(afire_options, granule_dict, lwm_file):
+# Granules of a batch must start within this time of the previous granule (about two VIIRS
+# granules), and the shared DEM subset of a batch is limited to this many cells.
+LWM_BATCH_MAX_GAP = timedelta(seconds=180.)
+LWM_BATCH_MAX_CELLS = 200000000
+
+def init_lwm_worker(afire_options):
     '''
-    Creates an empty output netCDF4 file from a CDL file.
+    Load the resources used to generate every LWM, once per worker process: the gridding and
+    granulation library, the DEM file (opened read-only with a tuned chunk cache), and the LWM CDL
+    template. Any failure here is only logged, since it will recur (and be reported) when the
+    resource is used for a granule.
     '''
-    env_vars = {}
-    lwm_cdl_file = pjoin(afire_options['ancil_dir'],
-                                     'AF-LAND_MASK_NASA_1KM.cdl')
+    try:
+        GridIP.getGrid2Gran(afire_options['afire_home'])
+    except Exception as err:
+        LOG.debug("Unable to preload the gridding and granulation library: {}".format(err))
 
-    ncgen_bin = pjoin(afire_options['afire_home'], 'vendor/ShellB3/bin', 'ncgen')
-    cmd = '{} -b {} -o {}'.format(ncgen_bin,
-                                  lwm_cdl_file,
-                                  lwm_file)
-    LOG.debug("cmd = {}".format(cmd))
+    try:
+        GridIP.getDEM(pjoin(afire_options['ancil_dir'], GridIP.DEM_FILENAME),
+                      afire_options.get('dem_chunk_cache', DEM_CHUNK_CACHE_MB))
+    except Exception as err:
+        LOG.debug("Unable to preload the DEM file: {}".format(err))
 
     try:
-        LOG.debug("cmd = \\\n\t{}".format(cmd.replace(' ',' \\\n\t')))
-        rc = check_call([cmd], shell=True, env={})
-        LOG.debug('check_call() return value: {}'.format(rc))
-    except CalledProcessError as err:
-        rc = err.returncode
-        LOG.error("ncgen returned a value of {}".format(rc))
-        return rc
+        get_cdl_schema(pjoin(afire_options['ancil_dir'], LWM_CDL_FILENAME))
+    except Exception as err:
+        LOG.debug("Unable to preload the LWM CDL template: {}".format(err))
 
-    return rc
 
-def get_lwm(afire_options, granule_dict):
+def get_lwm_footprint(afire_options, granule_dict):
     '''
-    Generate a granulated Land Water Mask (LWM) from the VIIRS GMTCO geolocation, and a global 0.5 degree
-    grid of the Land Water Mask.
+    Read the footprint of the LWM geolocation from the granule metadata, and estimate the cost of
+    granulating the LWM as the number of cells in the required DEM subset. Returns None for the
+    footprint and zero cost if the metadata cannot be read.
     '''
+    geo_prefix = afire_options['lwm_geo_prefix']
+    try:
+        footprint = getFootprint(granule_dict[geo_prefix]['file'], geo_prefix)
+        n_rows, n_cols = footprintSubsetShape(footprint)
+        return footprint, n_rows * n_cols
+    except Exception as err:
+        LOG.debug("Unable to read the footprint for granule {}: {}".format(
+            granule_dict['granule_id'], err))
+        return None, 0
+
+
+def get_lwm_batches(afire_data_dict, afire_options, max_batch_size):
+    '''
+    Group the granules into batches of contiguous granules from the same orbit, so that the LWMs
+    of each batch can be granulated from a single shared DEM subset. Returns a list of
+    (granule_id_list, footprint) tuples, where footprint is the union footprint of the batch, or
+    None for granules with no usable footprint.
+    '''
+    geo_prefix = afire_options['lwm_geo_prefix']
+
+    def batch_key(granule_id):
+        geo_dict = afire_data_dict[granule_id][geo_prefix]
+        return (geo_dict['sat'], geo_dict['dt'])
+
+    batches = []
+    batch = []
+    for granule_id in sorted(afire_data_dict.keys(), key=batch_key):
+        granule_dict = afire_data_dict[granule_id]
+        footprint = granule_dict.get('footprint')
+
+        if footprint is None:
+            batches.append(([granule_id], None))
+            continue
+
+        # Start a new batch if this granule isn't contiguous with the current one, or if the
+        # batch is full or its DEM subset would become too large.
+        if batch:
+            last_dict = afire_data_dict[batch[-1]]
+            union = footprintUnion([afire_data_dict[gran_id]['footprint']
+                                    for gran_id in batch] + [footprint])
+            n_rows, n_cols = footprintSubsetShape(union)
+            contiguous = (
+                granule_dict[geo_prefix]['sat'] == last_dict[geo_prefix]['sat'] and
+                granule_dict[geo_prefix]['orbit'] == last_dict[geo_prefix]['orbit'] and
+                granule_dict[geo_prefix]['dt'] - last_dict[geo_prefix]['dt'] <= LWM_BATCH_MAX_GAP)
+            if (not contiguous or len(batch) >= max_batch_size or
+                    n_rows * n_cols > LWM_BATCH_MAX_CELLS):
+                batches.append((batch, footprintUnion([afire_data_dict[gran_id]['footprint']
+                                                       for gran_id in batch])))
+                batch = []
+
+        batch.append(granule_id)
+
+    if batch:
+        batches.append((batch, footprintUnion([afire_data_dict[gran_id]['footprint']
+                                               for gran_id in batch])))
+
+    for granule_ids, footprint in batches:
+        LOG.debug("LWM batch of {} granules: {}".format(len(granule_ids), granule_ids))
+
+    return batches
+
+
+def get_lwm_batch(afire_options, granule_dicts, footprint, timer=None):
+    '''
+    Generate the LWMs of a batch of granules, reading the union DEM subset of the batch only
+    once. Returns a list of the get_lwm() return values, with None for any granule which raised
+    an exception.
+    '''
+    timer = Timer('lwm_batch') if timer is None else timer
+    dem_subset = None
+    if footprint is not None:
+        dem_subset = GridIP.DemSubset(pjoin(afire_options['ancil_dir'], GridIP.DEM_FILENAME),
+                                      footprint, chunkCacheMB=afire_options.get(
+                                          'dem_chunk_cache', DEM_CHUNK_CACHE_MB))
+        LOG.debug("Shared DEM subset of {} cells for {} granules".format(dem_subset.size,
+                                                                        len(granule_dicts)))
+
+    results = []
+    for granule_dict in granule_dicts:
+        try:
+            results.append(get_lwm(afire_options, granule_dict, dem_subset=dem_subset,
+                                   timer=timer))
+        except Exception as err:
+            LOG.warn('\tProblem generating LWM for granule_id {}'.format(
+                granule_dict['granule_id']))
+            LOG.error(err)
+            LOG.debug(traceback.format_exc())
+            results.append(None)
+
+    del(dem_subset)
+
+    return results
+
+
+def find_repeat_lwm(afire_options, lwm_cache, LandWaterMask, dem_ver):
+    '''
+    Look in the repeat cycle index of the LWM cache for the LWM of a previous granule on the same
+    ground track, with first scan corners within the reuse tolerance, and the same nearest DEM
+    cell for (at least the required fraction of) every pixel. Returns the LandMask of the first
+    matching LWM, or None.
+    '''
+    geo_prefix = afire_options['lwm_geo_prefix']
+    track = orbit_track(LandWaterMask.granule_dict[geo_prefix]['orbit'])
+
+    candidate_keys = lwm_cache.find_track(
+        geo_prefix, dem_ver, track, LandWaterMask.latitude.shape, LandWaterMask.latCrnList,
+        LandWaterMask.lonCrnList, afire_options['lwm_reuse_tolerance'])
+    LOG.debug("There are {} candidate LWMs on track {}".format(len(candidate_keys), track))
+
+    for candidate_key in candidate_keys:
+        candidate_file = lwm_cache.lookup(candidate_key)
+        if candidate_file is None:
+            continue
+        land_mask = match_dem_cells(candidate_file, LandWaterMask.latitude,
+                                    LandWaterMask.longitude,
+                                    afire_options['lwm_reuse_agreement'])
+        if land_mask is not None:
+            LOG.info("\tReusing the land mask of repeat cycle LWM file {}".format(candidate_file))
+            return land_mask
+
+    return None
+
+
+@profile_calls('lwm', lambda afire_options, granule_dict, *args, **kwargs:
+               (afire_options, granule_dict['granule_id']))
+def get_lwm(afire_options, granule_dict, dem_subset=None, timer=None):
+    '''
+    Generate a granulated Land Water Mask (LWM) from the VIIRS GMTCO (or optionally, for the
+    I-band, the GITCO) geolocation, and a global 0.5 degree grid of the Land Water Mask. The LWM
+    files are cached, keyed by the geolocation and DEM version. If a shared DEM subset is given,
+    the DEM is read from it where possible. The stages are timed with the given Timer.
+
+    The outcome of the cache lookup is returned as rc_dict['cache']: 'hit' if the LWM was in the
+    cache, 'reuse' if the land mask of a previous repeat cycle was reused, 'miss' if the LWM was
+    granulated, or 'failed' if it could not be created.
+    '''
+    timer = Timer(granule_dict['granule_id']) if timer is None else timer
 
     try:
 
         rc = 0
         geo_rc, subset_rc, granulate_rc, shipout_rc = 0, 0, 0, 0
+        cache_result = 'hit'
         rc_dict = {'geo': geo_rc, 'subset': subset_rc, 'granulate': granulate_rc,
-                   'shipout': shipout_rc}
-
-        # Check that the required cache dir already exists...
-        #geo_prefix = 'GITCO' if afire_options['i_band'] else 'GMTCO' # FUTURE
-        geo_prefix = 'GMTCO'
-        anc_dir = granule_dict[geo_prefix]['dt'].strftime('%Y_%m_%d_%j-%Hh')
-        lwm_dir = pjoin(afire_options['cache_dir'], anc_dir)
-        if not isdir(lwm_dir):
-            LOG.error("LWM dir {} is not considered a valid directory, aborting.".format(lwm_dir))
-            return 1, rc_dict, None
+                   'shipout': shipout_rc, 'cache': cache_result}
 
-        # Construct the name of the output GRLWM file
-        lwm_file = pjoin(lwm_dir, granule_dict['GRLWM']['file'])
-        LOG.debug("Candidate LWM filename: {}".format(lwm_file))
+        geo_prefix = afire_options['lwm_geo_prefix']
+        geo_file = granule_dict[geo_prefix]['file']
 
-        lwm_required = False
+        # Compute the cache key from the geolocation and the DEM version
+        with timer.span('lwm_key', io=True):
+            latitude, longitude = read_geolocation(geo_file, geo_prefix)
+            dem_ver = dem_version(afire_options['ancil_dir'])
+            lwm_key = lwm_cache_key(latitude, longitude, dem_ver, geo_prefix,
+                                    compressed=afire_options['lwm_compress'])
+        LOG.debug("LWM cache key for {}: {}".format(basename(geo_file), lwm_key))
 
-        # Check whether the GRLWM file exists...
-        if exists(lwm_file):
+        lwm_cache = LwmCache(afire_options['cache_dir'], geo_prefix)
 
-            LOG.debug("LWM file {} exists...".format(lwm_file))
+        # Check whether there is a valid LWM file for this geolocation...
+        lwm_file = lwm_cache.lookup(lwm_key)
+        lwm_lock = None
 
-            if not isfile(lwm_file):
-                LOG.warning("{} is not a regular file, removing...".format(lwm_file))
-                os.remove(lwm_file)
-                lwm_required = True
-            else:
-                LOG.debug("{} is a regular file, checking size...".format(lwm_file))
-                min_lwm_size_mb = 20.
-                lwm_size = float(os.stat(lwm_file).st_size) / (1024. * 1024.)
-                LOG.debug("lwm_file {} has size {} Mb".format(lwm_file, lwm_size))
-                if lwm_size < min_lwm_size_mb:
-                    LOG.warning("Size of lwm_file {} < minimum of 20 Mb".format(lwm_file))
-                    os.remove(lwm_file)
-                    lwm_required = True
-        else:
-            LOG.debug("LWM file {} doesn't exist...".format(lwm_file))
-            lwm_required = True
-
-        LOG.debug("lwm_required =  {}".format(lwm_required))
+        if lwm_file is None:
+            # Take the producer lock for this entry, waiting on any other process which is
+            # currently granulating the same geolocation, then check again.
+            with timer.span('lwm_lock'):
+                lwm_lock = lwm_cache.lock(lwm_key, timeout=afire_options['lwm_lock_timeout'])
+                lwm_file = lwm_cache.lookup(lwm_key)
 
-        # We need a new LWM file, create it
-        if lwm_required:
+            # The temporary file is unique to this process, so producing the LWM without the lock
+            # is safe, but may duplicate the work of the process which holds it.
+            if lwm_lock is None and lwm_file is None:
+                LOG.warning("Unable to take the producer lock for LWM {}, granulating it for"
+                            " granule {} anyway.".format(lwm_key, granule_dict['granule_id']))
 
-            # Copy the LWM template file to the cache LWM file for this geolocation
-            try:
-                _ = nc_from_cdl(afire_options, granule_dict, lwm_file)
-                #shutil.copyfile(lwm_template_file, lwm_file)
-            except Exception as err:
-                LOG.error("Unable to copy the LWM template file {} to the cache file {}, aborting."
-                          .format(lwm_template_file, lwm_file))
-                LOG.error(err)
-                rc_dict = {'geo': geo_rc, 'subset': subset_rc, 'granulate': granulate_rc,
-                           'shipout': shipout_rc}
-                return 1, rc_dict, None
+        lwm_required = lwm_file is None
+        temp_lwm_file = None
 
-            # Get the Land Water Mask object
-            LandWaterMask = GridIP.LandWaterMask(granule_dict, afire_options)
-
-            # Get the geolocation
-            geo_rc = LandWaterMask.setGeolocationInfo()
-
-            # Subset the gridded data for this ancillary object to cover the required lat/lon range.
-            subset_rc = LandWaterMask.subset()
-
-            # Granulate the gridded data in this ancillary object for the current granule...
-            granulate_rc = LandWaterMask.granulate()
+        LOG.debug("lwm_required =  {}".format(lwm_required))
 
-            # Write the new data to the LWM template file
-            shipout_rc = LandWaterMask.shipOutToFile(lwm_file, afire_options)
+        try:
+            # We need a new LWM file, create it
+            if lwm_required:
+
+                start_rss = current_rss_mb()
+
+                # Write to a temporary file, which is only renamed into the cache when complete
+                temp_lwm_file = lwm_cache.temp_path(lwm_key)
+                LOG.debug("Temporary LWM filename: {}".format(temp_lwm_file))
+
+                # Get the Land Water Mask object
+                LandWaterMask = GridIP.LandWaterMask(granule_dict, afire_options)
+
+                # Get the geolocation, reusing the arrays we have already read
+                with timer.span('lwm_geo'):
+                    geo_rc = LandWaterMask.setGeolocationInfo(latitude, longitude)
+
+                # If this ground track has been seen in a previous repeat cycle, we may be able to
+                # reuse its land mask.
+                land_mask = None
+                if afire_options['lwm_reuse'] and geo_rc == 0:
+                    with timer.span('lwm_reuse'):
+                        land_mask = find_repeat_lwm(afire_options, lwm_cache, LandWaterMask,
+                                                    dem_ver)
+
+                if land_mask is not None:
+                    LandWaterMask.data = land_mask.astype(LandWaterMask.dataType, copy=False)
+                else:
+                    # Subset the gridded data for this ancillary object to cover the required
+                    # lat/lon range.
+                    with timer.span('lwm_subset', io=True):
+                        subset_rc = LandWaterMask.subset(dem_subset)
+
+                    # Granulate the gridded data in this ancillary object for the current
+                    # granule...
+                    with timer.span('lwm_granulate'):
+                        granulate_rc = LandWaterMask.granulate()
+
+                # Create the LWM file from the CDL template, and write the new data to it
+                with timer.span('lwm_shipout', io=True):
+                    shipout_rc = LandWaterMask.shipOutToFile(temp_lwm_file, afire_options)
+
+                lat_corners = LandWaterMask.latCrnList if geo_rc == 0 else None
+                lon_corners = LandWaterMask.lonCrnList if geo_rc == 0 else None
+                end_rss = current_rss_mb()
+                del(LandWaterMask)
+                LOG.info("\tRSS before/after LWM generation for granule {}: {:.1f}/{:.1f} MB"
+                         " (lifetime peak of this process {:.1f} MB)".format(
+                             granule_dict['granule_id'], start_rss, end_rss, peak_rss_mb()))
+
+                # Only move complete LWM files into the cache
+                if geo_rc or subset_rc or granulate_rc or shipout_rc:
+                    LOG.warning("Granulation of LWM file {} failed, removing.".format(
+                        temp_lwm_file))
+                    lwm_file = None
+                    cache_result = 'failed'
+                else:
+                    with timer.span('lwm_commit'):
+                        lwm_file = lwm_cache.commit(lwm_key, temp_lwm_file,
+                                                    granule_dict['granule_id'])
+                        if afire_options['lwm_reuse']:
+                            lwm_cache.insert_track(lwm_key, geo_prefix, dem_ver,
+                                                   orbit_track(granule_dict[geo_prefix]['orbit']),
+                                                   latitude.shape, lat_corners, lon_corners)
+                    cache_result = 'miss' if land_mask is None else 'reuse'
 
-            min_lwm_size_mb = 20.
-            lwm_size = float(os.stat(lwm_file).st_size) / (1024. * 1024.)
-            LOG.debug("lwm_file {} has size {} Mb".format(lwm_file, lwm_size))
-            if lwm_size < min_lwm_size_mb:
-                LOG.warning("Size of lwm_file {} < minimum of 20 Mb".format(lwm_file))
-                shipout_rc = 1
+            else:
+                LOG.info("\tUsing cached LWM file {}".format(lwm_file))
+                geo_rc, subset_rc, granulate_rc, shipout_rc = 0, 0, 0, 0
 
-        else:
-            geo_rc, subset_rc, granulate_rc, shipout_rc = 0, 0, 0, 0
+        finally:
+            # Remove the temporary LWM file if it wasn't moved into the cache
+            if temp_lwm_file is not None and lwm_file is None:
+                lwm_cache.discard_temp(temp_lwm_file)
+            lwm_cache.unlock(lwm_lock)
+            lwm_cache.close()
+            del(latitude, longitude)
 
         rc = int(bool(geo_rc) or bool(subset_rc) or bool(granulate_rc) or bool(shipout_rc))
         rc_dict = {'geo': geo_rc, 'subset': subset_rc, 'granulate': granulate_rc,
-                   'shipout': shipout_rc}
+                   'shipout': shipout_rc, 'cache': cache_result}
 
     except Exception:
         LOG.warn(traceback.format_exc())
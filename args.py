@@ -23,27 +23,103 @@ from utils import check_and_convert_path, create_dir
 LOG = logging.getLogger(__name__)
 
 
-def argument_parser():
+def log_level(verbosity):
     '''
-    Method to encapsulate the option parsing and various setup tasks.
+    Return the logging level of the verbosity option.
     '''
+    levels = [logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG]
+    return levels[verbosity if verbosity < 4 else 3]
+
+
+def argument_parser(argv=None, configure_logging=True):
+    '''
+    Method to encapsulate the option parsing and various setup tasks. The options are parsed from
+    argv if given (as for the jobs of a server), or else from the command line. Unless
+    configure_logging is False, the logging is set up to write to the log file of this run in the
+    work directory.
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
 
     help_strings = {}
     help_strings['inputs'] = '''One or more input files or directories.'''
     help_strings['i_band'] = '''Process inputs using the 750m M-band algorithm, otherwise ''' \
         '''use the 375m I-band algorithm.'''
+    help_strings['native_lwm'] = '''Granulate the I-band land water mask from the 375m GITCO''' \
+        ''' geolocation, so that\nthe M-band GMTCO geolocation is not required.''' \
+        ''' [default: %(default)s]'''
     help_strings['work_dir'] = '''The work directory.'''
     help_strings['cache_dir'] = '''The directory where the granulated land water mask files are''' \
         ''' kept. Can also be specified\nby setting the CSPP_ACTIVE_FIRE_CACHE_DIR''' \
         ''' environment variable, otherwise defaults to\n"cspp_active_fire_cache_dir" in the'''\
         ''' current directory.'''
-    help_strings['cache_window'] = '''Limit ancillary cache to hold no more than this number of''' \
-        ''' hours preceding\nthe target time. [default: %(default)s hours]'''
+    help_strings['cache_size'] = '''Limit the ancillary cache to this size, removing the least''' \
+        ''' recently used\nfiles first. [default: %(default)s GB]'''
+    help_strings['cache_window'] = '''Remove files from the ancillary cache which have not been''' \
+        ''' used in this\nnumber of hours. [default: %(default)s hours]'''
     help_strings['preserve_cache'] = '''Do not flush old files from the ancillary cache.''' \
         ''' [default: %(default)s]'''
+    help_strings['purge_legacy_cache'] = '''Remove the land water mask files of the old''' \
+        ''' hourly cache directories\n(e.g. "2018_08_07_219-20h"), which are not used by''' \
+        ''' this version.\n[default: %(default)s]'''
+    help_strings['lwm_lock_timeout'] = '''Maximum time to wait for another process which is''' \
+        ''' granulating the same\nland water mask. [default: %(default)s seconds]'''
+    help_strings['lwm_batch_size'] = '''Granulate the land water masks of up to this many''' \
+        ''' contiguous granules\nfrom a shared DEM subset, before running Active Fires. A''' \
+        ''' value of 1\ndisables the batched stage. [default: %(default)s]'''
+    help_strings['lwm_reuse'] = '''Reuse the land water mask of a granule on the same ground''' \
+        ''' track in a\nprevious orbit repeat cycle, if the nearest DEM cells of the pixels''' \
+        ''' agree.\n[default: %(default)s]'''
+    help_strings['lwm_reuse_tolerance'] = '''The maximum difference between the first scan''' \
+        ''' corners of granules\nwhose land water masks may be reused.''' \
+        ''' [default: %(default)s degrees]'''
+    help_strings['lwm_reuse_agreement'] = '''The minimum fraction of pixels with the same''' \
+        ''' nearest DEM cell, for\na land water mask to be reused. [default: %(default)s]'''
+    help_strings['lwm_compress'] = '''Compress the variables of the land water mask files''' \
+        ''' with zlib,\nwriting netCDF-4 classic model files if the CDL template is of a''' \
+        ''' netCDF-3\nformat. vfire must be linked to a netCDF-4 library to read them.''' \
+        ''' [default: %(default)s]'''
+    help_strings['dem_chunk_cache'] = '''The size of the HDF5 chunk cache of the DEM file in''' \
+        ''' each worker\nprocess. [default: %(default)s MB]'''
     help_strings['ancillary_only'] = '''Only process ancillary data, don't run Active Fires.''' \
         ''' [default: %(default)s]'''
     help_strings['num_cpu'] = '''The number of CPUs to try and use. [default: %(default)s]'''
+    help_strings['fire_store'] = '''Append the fire pixels of every granule to a single''' \
+        ''' indexed NetCDF4\nfire store in the work directory. [default: %(default)s]'''
+    help_strings['fire_dedup'] = '''Merge the duplicate fire pixels in the consolidated fire''' \
+        ''' store (implies\n--fire-store). [default: %(default)s]'''
+    help_strings['dedup_distance'] = '''The maximum distance between duplicate fire pixels.''' \
+        ''' [default: %(default)s km]'''
+    help_strings['dedup_time_window'] = '''The maximum time between duplicate fire pixels, or''' \
+        ''' 0 for no limit.\n[default: %(default)s minutes]'''
+    help_strings['timing_report'] = '''Write a JSON lines report of the time spent in each''' \
+        ''' processing stage,\nfor each granule and the whole run, to the work directory.''' \
+        ''' [default: %(default)s]'''
+    help_strings['trace'] = '''Write a Chrome trace of the processing stages of every''' \
+        ''' process to the work\ndirectory, which can be opened in Perfetto.''' \
+        ''' [default: %(default)s]'''
+    help_strings['num_io_threads'] = '''The number of threads used to post-process the Active''' \
+        ''' Fires outputs\n(update attributes, write the text files and move the outputs).''' \
+        ''' [default: %(default)s]'''
+    help_strings['vfire_timeout'] = '''Kill an Active Fires process which has run for longer''' \
+        ''' than this, or 0\nfor no limit. [default: %(default)s seconds]'''
+    help_strings['profile'] = '''Profile the run, and each granule, LWM and nagg task, with''' \
+        ''' cProfile,\nwriting a .pstats file for each to the "profiles" directory of the''' \
+        ''' work\ndirectory. [default: %(default)s]'''
+    help_strings['profile_memory'] = '''Trace the memory allocations of the run and of each''' \
+        ''' task with\ntracemalloc, writing the peak and top allocations of each to the''' \
+        ''' "profiles"\ndirectory of the work directory. [default: %(default)s]'''
+    help_strings['metrics_file'] = '''Write Prometheus metrics of the processing to this''' \
+        ''' node-exporter\ntextfile, which is replaced atomically during and at the end of''' \
+        ''' the run. The\ncounters accumulate across runs. [default: %(default)s]'''
+    help_strings['metrics_port'] = '''Serve Prometheus metrics of the processing on''' \
+        ''' http://127.0.0.1:PORT/metrics\nfor the duration of the run. [default:''' \
+        ''' %(default)s]'''
+    help_strings['granule_logs'] = '''Write the log of each granule (and nagg and LWM batch''' \
+        ''' task) to its own\nfile in the work directory, passing only warnings and errors''' \
+        ''' to the main log.\n[default: %(default)s]'''
+    help_strings['serve'] = '''Run as a server, accepting jobs from''' \
+        ''' cspp_active_fire_noaa_client.py on\nthis Unix domain socket, and running them in''' \
+        ''' a pool of NUM_CPU warm worker\nprocesses. [default: %(default)s]'''
     help_strings['debug'] = '''Always retain intermediate files. [default: %(default)s]'''
     help_strings['verbosity'] = '''Each occurrence increases verbosity 1 level from''' \
         ''' ERROR: -v=WARNING, -vv=INFO, -vvv=DEBUG [default: %(default)s]'''
@@ -52,13 +128,13 @@ def argument_parser():
     help_strings['expert'] = '''Display all help options, including the expert ones.'''
 
     is_expert = False
-    if '--expert' in sys.argv:
-        expert_index = sys.argv.index('--expert')
-        sys.argv[expert_index] = '--help'
+    if '--expert' in argv:
+        expert_index = argv.index('--expert')
+        argv[expert_index] = '--help'
         is_expert = True
-    elif '-x' in sys.argv:
-        expert_index = sys.argv.index('-x')
-        sys.argv[expert_index] = '--help'
+    elif '-x' in argv:
+        expert_index = argv.index('-x')
+        argv[expert_index] = '--help'
         is_expert = True
     else:
         pass
@@ -93,6 +169,13 @@ def argument_parser():
                         help=help_strings['i_band']
                         )
 
+    parser.add_argument('--native-lwm',
+                        dest='native_lwm',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['native_lwm'] if is_expert else argparse.SUPPRESS
+                        )
+
     parser.add_argument('-W', '--work-dir',
                         dest='work_dir',
                         metavar='work_dir',
@@ -106,6 +189,14 @@ def argument_parser():
                         help=help_strings['cache_dir']
                         )
 
+    parser.add_argument('--cache-size',
+                        dest='cache_size',
+                        action="store",
+                        type=float,
+                        default='10.',
+                        help=help_strings['cache_size'] if is_expert else argparse.SUPPRESS
+                        )
+
     parser.add_argument('--cache-window',
                         dest='cache_window',
                         action="store",
@@ -121,6 +212,67 @@ def argument_parser():
                         help=help_strings['preserve_cache'] if is_expert else argparse.SUPPRESS
                         )
 
+    parser.add_argument('--purge-legacy-cache',
+                        dest='purge_legacy_cache',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['purge_legacy_cache'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-lock-timeout',
+                        dest='lwm_lock_timeout',
+                        action="store",
+                        type=float,
+                        default='600.',
+                        help=help_strings['lwm_lock_timeout'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-batch-size',
+                        dest='lwm_batch_size',
+                        action="store",
+                        type=int,
+                        default=1,
+                        help=help_strings['lwm_batch_size'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-reuse',
+                        dest='lwm_reuse',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['lwm_reuse'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-reuse-tolerance',
+                        dest='lwm_reuse_tolerance',
+                        action="store",
+                        type=float,
+                        default='0.005',
+                        help=help_strings['lwm_reuse_tolerance'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-reuse-agreement',
+                        dest='lwm_reuse_agreement',
+                        action="store",
+                        type=float,
+                        default='1.',
+                        help=help_strings['lwm_reuse_agreement'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--lwm-compress',
+                        dest='lwm_compress',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['lwm_compress'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--dem-chunk-cache',
+                        dest='dem_chunk_cache',
+                        action="store",
+                        type=float,
+                        default='64.',
+                        help=help_strings['dem_chunk_cache'] if is_expert else argparse.SUPPRESS
+                        )
+
     parser.add_argument('--ancillary-only',
                         dest='ancillary_only',
                         action="store_true",
@@ -137,6 +289,118 @@ def argument_parser():
                         help=help_strings['num_cpu'] if is_expert else argparse.SUPPRESS
                         )
 
+    parser.add_argument('--fire-store',
+                        dest='fire_store',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['fire_store'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--fire-dedup',
+                        dest='fire_dedup',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['fire_dedup'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--dedup-distance',
+                        action="store",
+                        dest="dedup_distance",
+                        type=float,
+                        default=1.,
+                        metavar=('KM'),
+                        help=help_strings['dedup_distance'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--dedup-time-window',
+                        action="store",
+                        dest="dedup_time_window",
+                        type=float,
+                        default=120.,
+                        metavar=('MINUTES'),
+                        help=help_strings['dedup_time_window'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--num-io-threads',
+                        action="store",
+                        dest="num_io_threads",
+                        type=int,
+                        default=2,
+                        metavar=('NUM_IO_THREADS'),
+                        help=help_strings['num_io_threads'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--vfire-timeout',
+                        dest='vfire_timeout',
+                        action="store",
+                        type=float,
+                        default=0.,
+                        metavar=('SECONDS'),
+                        help=help_strings['vfire_timeout'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--timing-report',
+                        dest='timing_report',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['timing_report'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--trace',
+                        dest='trace',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['trace'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--profile',
+                        dest='profile',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['profile'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--profile-memory',
+                        dest='profile_memory',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['profile_memory'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--granule-logs',
+                        dest='granule_logs',
+                        action="store_true",
+                        default=False,
+                        help=help_strings['granule_logs'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--metrics-file',
+                        dest='metrics_file',
+                        action="store",
+                        type=str,
+                        default=None,
+                        metavar=('PATH'),
+                        help=help_strings['metrics_file'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--metrics-port',
+                        dest='metrics_port',
+                        action="store",
+                        type=int,
+                        default=None,
+                        metavar=('PORT'),
+                        help=help_strings['metrics_port'] if is_expert else argparse.SUPPRESS
+                        )
+
+    parser.add_argument('--serve',
+                        dest='serve',
+                        action="store",
+                        type=str,
+                        default=None,
+                        metavar=('SOCKET'),
+                        help=help_strings['serve'] if is_expert else argparse.SUPPRESS
+                        )
+
     parser.add_argument('-d', '--debug',
                         action="store_true",
                         default=False,
@@ -168,11 +432,10 @@ def argument_parser():
                         help=help_strings['expert']
                         )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Set up the logging
-    levels = [logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG]
-    level = levels[args.verbosity if args.verbosity < 4 else 3]
+    level = log_level(args.verbosity)
 
     # Create the work directory if it doesn't exist
     work_dir = os.path.abspath(os.path.expanduser(args.work_dir))
@@ -183,7 +446,8 @@ def argument_parser():
     timestamp = dt.isoformat()
     logname = "cspp_active_fire_noaa." + timestamp + ".log"
     logfile = os.path.join(work_dir, logname)
-    log_common.configure_logging(level, FILE=logfile)
+    if configure_logging:
+        log_common.configure_logging(level, FILE=logfile, queued=True)
 
     LOG.debug('work directory : {}'.format(work_dir))
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_fire_dedup.py
+
+ * DESCRIPTION: Benchmark of the duplicate fire pixel merging, on a synthetic day of detections:
+ clusters of fires seen on several passes, with jittered positions, including clusters on the
+ dateline and near the poles. For the smaller sizes, the duplicate groups are checked against a
+ brute force search of every pair of detections.
+
+ Usage: python benchmarks/bench_fire_dedup.py [-n 1000 100000 1000000] [-d 1.0] [-t 7200]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import argparse
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fire_dedup import cartesian, connected_components, find_duplicates, merge_duplicates
+
+# The largest number of detections checked against the brute force search
+BRUTE_FORCE_MAX = 4000
+
+
+def make_fires(nfire, seed=0):
+    '''
+    Generate a synthetic day of fire detections, as a dictionary of fire store columns.
+    '''
+    rng = np.random.default_rng(seed)
+    nsite = max(nfire // 4, 1)
+    site_lat = rng.uniform(-70., 70., nsite)
+    site_lon = rng.uniform(-180., 180., nsite)
+    site_lat[:nsite // 20] = rng.uniform(85., 90., nsite // 20)
+    site_lon[nsite // 20:nsite // 10] = rng.choice([-179.999, 179.999], nsite // 10 - nsite // 20)
+
+    site = rng.integers(0, nsite, nfire)
+    jitter = rng.normal(0., 0.004, (2, nfire))
+    longitude = np.mod(site_lon[site] + jitter[1] + 180., 360.) - 180.
+    latitude = np.clip(site_lat[site] + jitter[0], -90., 90.)
+
+    # A pass every ~100 minutes, with the granules of each pass 85 seconds apart
+    times = rng.integers(0, 14, nfire) * 6080. + rng.integers(0, 4, nfire) * 85.
+    return {
+        'latitude': latitude.astype(np.float32),
+        'longitude': longitude.astype(np.float32),
+        'brightness_temperature': rng.uniform(300., 400., nfire).astype(np.float32),
+        'confidence': rng.integers(7, 10, nfire).astype(np.int16),
+        'power': rng.exponential(20., nfire).astype(np.float32),
+        'time': times,
+        'granule_id': np.array(['d{:06.0f}'.format(t) for t in times], dtype=object),
+    }
+
+
+def brute_force_duplicates(fires, distance_km, time_window):
+    '''
+    The duplicate groups from a comparison of every pair of detections.
+    '''
+    coords = cartesian(fires['latitude'], fires['longitude'])
+    dist = np.sqrt(np.sum((coords[:, np.newaxis, :] - coords[np.newaxis, :, :]) ** 2, axis=2))
+    linked = dist <= distance_km
+    if time_window is not None:
+        linked &= np.abs(fires['time'][:, np.newaxis] - fires['time'][np.newaxis, :]) \
+            <= time_window
+    first, second = np.nonzero(np.triu(linked, 1))
+    return connected_components(len(fires['latitude']), first, second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the duplicate fire pixel merging.')
+    parser.add_argument('-n', '--nfire', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='The numbers of fire pixels.')
+    parser.add_argument('-d', '--distance', type=float, default=1.,
+                        help='The duplicate distance threshold (km).')
+    parser.add_argument('-t', '--time-window', type=float, default=7200.,
+                        help='The duplicate time window (s), or 0 for no limit.')
+    args = parser.parse_args()
+    time_window = args.time_window if args.time_window > 0. else None
+
+    failed = False
+    print('{:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+        'nfire', 'merged', 'find (s)', 'merge (s)', 'checked'))
+    for nfire in args.nfire:
+        fires = make_fires(nfire)
+
+        start = time.perf_counter()
+        labels = find_duplicates(fires['latitude'], fires['longitude'], fires['time'],
+                                 args.distance, time_window)
+        find_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        merged = merge_duplicates(fires, labels)
+        merge_time = time.perf_counter() - start
+
+        checked = '-'
+        if nfire <= BRUTE_FORCE_MAX:
+            same = np.array_equal(labels, brute_force_duplicates(fires, args.distance,
+                                                                 time_window))
+            checked = str(same)
+            failed = failed or not same
+
+        print('{:>9} {:>9} {:>10.4f} {:>10.4f} {:>10}'.format(
+            nfire, merged['latitude'].size, find_time, merge_time, checked))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
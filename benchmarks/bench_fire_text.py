@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_fire_text.py
+
+ * DESCRIPTION: Microbenchmark of the fire pixel text writer, against the original row-at-a-time
+ loop. The output of both writers is checked to be byte-identical for each number of fire pixels.
+
+ Usage: python benchmarks/bench_fire_text.py [-n 10 1000 50000] [-r 5]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fire_text import fire_text_header, fire_text_bands, write_fire_text
+
+
+def legacy_write_fire_text(output_txt_file, band, source, history, nfire, fire_data):
+    '''
+    The original fire pixel text writer, formatting and writing a row at a time.
+    '''
+    fire_pixel_res = fire_text_bands[band]['pixel_res']
+    format_str = '''{0:13.8f}, {1:13.8f}, {2:13.8f}, {5:6.3f}, {6:6.3f},''' \
+        ''' {3:4d}, {4:13.8f}'''
+    txt_file_header = fire_text_header(band, source, history, nfire)
+
+    txt_file_obj = open(output_txt_file, 'x')
+    txt_file_obj.write(txt_file_header + "\n")
+    for FP_latitude, FP_longitude, FP_T, FP_confidence, FP_power in zip(*fire_data):
+        fire_vars = [FP_latitude, FP_longitude, FP_T, FP_confidence, FP_power]
+        line = format_str.format(*(fire_vars + fire_pixel_res))
+        txt_file_obj.write(line + "\n")
+    txt_file_obj.close()
+
+
+def make_fire_data(nfire, band, seed=0):
+    '''
+    Generate synthetic fire pixel arrays, of the types found in the I-band (HDF5) and M-band
+    (NetCDF4, masked) outputs.
+    '''
+    rng = np.random.default_rng(seed)
+    latitude = rng.uniform(-90., 90., nfire).astype(np.float32)
+    longitude = rng.uniform(-180., 180., nfire).astype(np.float32)
+    temperature = rng.uniform(300., 400., nfire).astype(np.float32)
+    power = rng.exponential(20., nfire).astype(np.float32)
+    if band == 'I':
+        confidence = rng.integers(7, 10, nfire).astype(np.int8)
+        return [latitude, longitude, temperature, confidence, power]
+
+    confidence = rng.integers(0, 101, nfire).astype(np.int32)
+    return [np.ma.masked_array(arr) for arr in
+            [latitude, longitude, temperature, confidence, power]]
+
+
+def time_writer(writer, fire_data, band, work_dir, repeats):
+    '''
+    Return the best time of the writer over the repeats, and the bytes it wrote.
+    '''
+    best = np.inf
+    for idx in range(repeats):
+        txt_file = os.path.join(work_dir, '{}_{}.txt'.format(writer.__name__, idx))
+        start = time.perf_counter()
+        writer(txt_file, band, 'AFMOD_test.nc', 'CSPP Active Fires version: test',
+               len(fire_data[0]), fire_data)
+        best = min(best, time.perf_counter() - start)
+        with open(txt_file, 'rb') as file_obj:
+            contents = file_obj.read()
+        os.remove(txt_file)
+    return best, contents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fire pixel text writer.')
+    parser.add_argument('-n', '--nfire', type=int, nargs='+', default=[10, 1000, 10000, 50000],
+                        help='The numbers of fire pixels.')
+    parser.add_argument('-r', '--repeats', type=int, default=5,
+                        help='The number of repeats of each timing.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_fire_text_')
+    failed = False
+
+    print('{:>4} {:>8} {:>12} {:>12} {:>8} {:>10}'.format(
+        'band', 'nfire', 'legacy (s)', 'new (s)', 'speedup', 'identical'))
+    for band in ['I', 'M']:
+        for nfire in args.nfire:
+            fire_data = make_fire_data(nfire, band)
+            legacy_time, legacy_bytes = time_writer(legacy_write_fire_text, fire_data, band,
+                                                    work_dir, args.repeats)
+            new_time, new_bytes = time_writer(write_fire_text, fire_data, band, work_dir,
+                                              args.repeats)
+            identical = legacy_bytes == new_bytes
+            failed = failed or not identical
+            print('{:>4} {:>8} {:>12.6f} {:>12.6f} {:>8.2f} {:>10}'.format(
+                band, nfire, legacy_time, new_time, legacy_time / new_time, str(identical)))
+
+    os.rmdir(work_dir)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
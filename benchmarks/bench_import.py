@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_import.py
+
+ * DESCRIPTION: Benchmark of the startup cost of cspp_active_fire_noaa. The main script is imported
+ in a fresh interpreter with "python -X importtime", several times, and the best cumulative import
+ time is compared with a budget. The heavy packages (numpy, h5py, netCDF4, cffi and the GridIP
+ package) should only be imported by the processing stages which need them, so the benchmark also
+ fails if any of them is imported at startup. The slowest modules of the import, and the wall time
+ of "cspp_active_fire_noaa.py --version", are reported to help find the cause of a regression.
+
+ Usage: python benchmarks/bench_import.py [-r 5] [--budget 100]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+MAIN_MODULE = 'cspp_active_fire_noaa'
+
+# The packages which must not be imported at startup
+DEFERRED_MODULES = ['numpy', 'h5py', 'netCDF4', 'cffi', 'ancillary.GridIP']
+
+# Matches a line of the -X importtime output: the self and cumulative times (us), and the module,
+# indented by its depth in the import tree.
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def import_times(env):
+    '''
+    Import the main module in a new interpreter, and return a list of the self and cumulative
+    times (us) of each module it imported.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import {}'.format(MAIN_MODULE)],
+                            cwd=REPO_DIR, env=env, stderr=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+
+    # Only keep the modules imported by the main module, not those of the interpreter's startup
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        times.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+        if module == MAIN_MODULE and len(indent) == 0:
+            break
+    start = max([idx for idx, (module, self_us, cumulative_us, depth) in enumerate(times[:-1])
+                 if depth == 0] + [-1]) + 1
+    return times[start:]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the import time of cspp_active_fire_noaa against a budget.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='The number of timed imports, of which the best is used.')
+    parser.add_argument('--budget', type=float, default=100.,
+                        help='The import time budget (ms).')
+    parser.add_argument('-t', '--top', type=int, default=10,
+                        help='The number of the slowest modules to show.')
+    args = parser.parse_args()
+
+    # The first import writes the bytecode of any modified modules, so that it isn't compiled
+    # again in the timed imports.
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    import_times(env)
+
+    best = None
+    for idx in range(args.repeat):
+        times = import_times(env)
+        if best is None or times[-1][2] < best[-1][2]:
+            best = times
+
+    total_ms = best[-1][2] / 1000.
+    modules = set([module for module, self_us, cumulative_us, depth in best])
+    deferred = [module for module in DEFERRED_MODULES if module in modules]
+
+    print('Import of {}: {:.1f} ms (best of {}), budget {:.1f} ms, {} modules'.format(
+        MAIN_MODULE, total_ms, args.repeat, args.budget, len(best)))
+    print('Slowest modules (self ms, cumulative ms):')
+    for module, self_us, cumulative_us, depth in sorted(best, key=lambda x: x[1],
+                                                        reverse=True)[:args.top]:
+        print('    {:<40} {:8.2f} {:8.2f}'.format(module, self_us / 1000.,
+                                                  cumulative_us / 1000.))
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, '{}.py'.format(MAIN_MODULE)),
+                    '--version'], cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=False)
+    print('Wall time of "{}.py --version": {:.1f} ms'.format(
+        MAIN_MODULE, (time.perf_counter() - start) * 1000.))
+
+    failed = False
+    if deferred:
+        print('FAIL: {} imported at startup'.format(', '.join(deferred)))
+        failed = True
+    if total_ms > args.budget:
+        print('FAIL: import time {:.1f} ms is over the budget of {:.1f} ms'.format(
+            total_ms, args.budget))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_pipeline.py
+
+ * DESCRIPTION: Benchmark of the whole active fire pipeline on synthetic VIIRS granules, with
+ stub nagg and vfire executables, so it runs offline on any Linux box (see synthetic_viirs.py).
+ For each number of granules, cspp_active_fire_noaa is run in a fresh process with a timing
+ report, from which the time of each part of the pipeline is reported: the input inventory
+ (including the de-aggregation of aggregated inputs), the LWM staging and vfire time in the
+ workers, the post-processing in the parent, and the dispatch overhead (the part of the dispatch
+ wall time the workers were not busy). The throughput is the number of granules per second of the
+ run, and the peak memory is the maximum RSS of the parent, and of any of its children.
+
+ Usage: python benchmarks/bench_pipeline.py [-n 1 10 100 1000] [-b M] [-a 4] [-p 4] [--warm]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import argparse
+import json
+import resource
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from glob import glob
+from os.path import join as pjoin
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_viirs import make_afire_home, make_inputs, install_grid2gran
+
+# The granule stages run in the pool workers, and those run in the parent's post-processing
+# threads.
+POST_STAGES = ['attributes', 'fire_text', 'move', 'cleanup']
+
+
+def run_child(config_file):
+    '''
+    Run cspp_active_fire_noaa in this process, as described by the config file, and write the
+    return code and peak memory to the result file.
+    '''
+    with open(config_file) as file_obj:
+        config = json.load(file_obj)
+
+    os.environ['CSPP_ACTIVE_FIRE_HOME'] = config['afire_home']
+    os.environ['CSPP_ACTIVE_FIRE_STATIC_DIR'] = pjoin(config['afire_home'], 'static_ancillary')
+    sys.path.insert(0, REPO_DIR)
+    install_grid2gran(config['afire_home'])
+
+    import cspp_active_fire_noaa
+    sys.argv = ['cspp_active_fire_noaa.py', config['inputs'], '-W', config['work_dir'],
+                '--cache-dir', config['cache_dir'], '--num-cpu', str(config['num_cpu']),
+                '--timing-report'] + (['-M'] if config['band'] == 'M' else []) + config['args']
+    rc = cspp_active_fire_noaa.main()
+
+    with open(config['result_file'], 'w') as file_obj:
+        json.dump({'rc': rc,
+                   'maxrss_self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   'maxrss_children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss},
+                  file_obj)
+    return rc
+
+
+def read_timing_report(work_dir):
+    '''
+    Return the records of the timing report in work_dir, and its summary.
+    '''
+    report_file = sorted(glob(pjoin(work_dir, 'cspp_afire_timing_*.json')))[-1]
+    with open(report_file) as file_obj:
+        records = [json.loads(line) for line in file_obj]
+    return records[:-1], records[-1]
+
+
+def stage_wall(records, kind, stages=None, exclude=()):
+    '''
+    Return the total wall time of the stages of the records of a kind (by default all of their
+    stages, less any excluded).
+    '''
+    return sum([total['wall'] for record in records if record['record'] == kind
+                for stage, total in record['stages'].items()
+                if (stages is None or stage in stages) and stage not in exclude])
+
+
+def summarize(records, summary, result, num_cpu, wall):
+    '''
+    Return the row of the results table for a run.
+    '''
+    granules = [record for record in records if record['record'] == 'granule']
+    run = [record for record in records if record['record'] == 'run'][0]['stages']
+    succeeded = len([record for record in granules
+                     if record['rc_exe'] == 0 and record['rc_problem'] == 0])
+
+    worker_busy = stage_wall(records, 'granule', exclude=POST_STAGES) + \
+        stage_wall(records, 'lwm_batch')
+    dispatch = run.get('dispatch', {}).get('wall', 0.)
+    workers = max(min(num_cpu, len(granules)), 1)
+    lwm = sum([total['wall'] for stage, total in summary['stages'].items()
+               if stage.split('.')[-1].startswith('lwm')])
+
+    return {
+        'granules': len(granules),
+        'succeeded': succeeded,
+        'wall': wall,
+        'rate': len(granules) / summary['wall'] if summary['wall'] > 0. else 0.,
+        'inventory': run.get('inventory', {}).get('wall', 0.),
+        'nagg': stage_wall(records, 'nagg', ['nagg']),
+        'lwm': lwm,
+        'vfire': stage_wall(records, 'granule', ['vfire']),
+        'post': stage_wall(records, 'granule', POST_STAGES),
+        'overhead': max(dispatch - worker_busy / workers, 0.),
+        'rss_parent': result['maxrss_self'] / 1024.,
+        'rss_child': result['maxrss_children'] / 1024.,
+    }
+
+
+def launch_pipeline(root, label, afire_home, inputs, cache_dir, args):
+    '''
+    Run the pipeline on the inputs in a new process, in the work directory root/work_<label>.
+    Returns the timing report records and summary, the return code and peak memory, and the wall
+    time of the process.
+    '''
+    work_dir = pjoin(root, 'work_{}'.format(label))
+    os.makedirs(work_dir)
+    config_file = pjoin(work_dir, 'bench_config.json')
+    result_file = pjoin(work_dir, 'bench_result.json')
+    with open(config_file, 'w') as file_obj:
+        json.dump({'afire_home': afire_home, 'inputs': inputs, 'work_dir': work_dir,
+                   'cache_dir': cache_dir, 'num_cpu': args.num_cpu, 'band': args.band,
+                   'args': shlex.split(args.afire_args), 'result_file': result_file}, file_obj)
+
+    env = dict(os.environ, AFIRE_STUB_FIRES=str(args.fires),
+               AFIRE_STUB_SLEEP=str(args.vfire_sleep))
+    output = None if args.verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', config_file],
+                   env=env, cwd=work_dir, stdout=output, stderr=output, check=False)
+    wall = time.perf_counter() - start
+
+    with open(result_file) as file_obj:
+        result = json.load(file_obj)
+    records, summary = read_timing_report(work_dir)
+    return records, summary, result, wall
+
+
+def run_pipeline(root, label, afire_home, inputs, cache_dir, args):
+    '''
+    Run the pipeline on the inputs in a new process, returning the row of the results table.
+    '''
+    records, summary, result, wall = launch_pipeline(root, label, afire_home, inputs, cache_dir,
+                                                     args)
+    return summarize(records, summary, result, args.num_cpu, wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the active fire pipeline on synthetic granules.')
+    parser.add_argument('-n', '--granules', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='The numbers of granules.')
+    parser.add_argument('-b', '--band', choices=['M', 'I'], default='M',
+                        help='Run the M-band or I-band active fires.')
+    parser.add_argument('-a', '--granules-per-file', type=int, default=1,
+                        help='Aggregate this many granules in each input file.')
+    parser.add_argument('-s', '--scans', type=int, default=4,
+                        help='The number of scans in each granule.')
+    parser.add_argument('-c', '--columns', type=int, default=400,
+                        help='The number of M-band columns in each granule.')
+    parser.add_argument('-p', '--num-cpu', type=int, default=min(os.cpu_count() or 1, 4),
+                        help='The number of CPUs used by the pipeline.')
+    parser.add_argument('-f', '--fires', type=float, default=20.,
+                        help='The mean number of fire pixels in each granule.')
+    parser.add_argument('--vfire-sleep', type=float, default=0.,
+                        help='The time (s) each stub vfire sleeps.')
+    parser.add_argument('--warm', action='store_true',
+                        help='Also rerun each size with the LWM cache of the first run.')
+    parser.add_argument('--afire-args', default='',
+                        help='Further options for cspp_active_fire_noaa.')
+    parser.add_argument('-w', '--work-root',
+                        help='The directory for the fixtures and runs [default: a temp dir].')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='Keep the fixtures and run directories.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show the output of the pipeline runs.')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return run_child(args.child)
+
+    root = tempfile.mkdtemp(prefix='bench_pipeline_', dir=args.work_root)
+    afire_home = pjoin(root, 'afire_home')
+
+    start = time.perf_counter()
+    make_afire_home(afire_home)
+    all_inputs = pjoin(root, 'inputs')
+    os.makedirs(all_inputs)
+    input_files = make_inputs(all_inputs, max(args.granules), args.band, args.scans, args.columns,
+                              args.granules_per_file)
+    print('Generated {} input files of {} {}-band granules in {:.1f} s, in {}'.format(
+        len(input_files), max(args.granules), args.band, time.perf_counter() - start, root))
+
+    failed = False
+    header = '{:>6} {:>5} {:>8} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'
+    row = '{:>6} {:>5} {granules:>8} {wall:>8.2f} {rate:>9.2f} {inventory:>8.2f} {nagg:>8.2f}' \
+        ' {lwm:>8.2f} {vfire:>8.2f} {post:>8.2f} {overhead:>8.2f} {rss:>8}'
+    print(header.format('size', 'cache', 'granules', 'wall (s)', 'gran/s', 'inv (s)', 'nagg (s)',
+                        'lwm (s)', 'vfire (s)', 'post (s)', 'ovhd (s)', 'rss (MB)'))
+    for num_granules in args.granules:
+        # The inputs of the first num_granules granules (or the whole files holding them)
+        inputs = pjoin(root, 'inputs_{}'.format(num_granules))
+        os.makedirs(inputs)
+        for first, last, filename in input_files:
+            if first < num_granules:
+                os.symlink(filename, pjoin(inputs, os.path.basename(filename)))
+
+        cache_dir = pjoin(root, 'cache_{}'.format(num_granules))
+        for cache in ['cold', 'warm'] if args.warm else ['cold']:
+            result = run_pipeline(root, '{}_{}'.format(num_granules, cache), afire_home, inputs,
+                                  cache_dir, args)
+            failed = failed or result['succeeded'] < result['granules']
+            print(row.format(num_granules, cache,
+                             rss='{:.0f}/{:.0f}'.format(result['rss_parent'],
+                                                        result['rss_child']),
+                             **result))
+
+    print('lwm, vfire: total time in the workers; post: total time in the parent threads;'
+          ' rss: parent/largest child')
+    if not args.keep:
+        shutil.rmtree(root)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_server.py
+
+ * DESCRIPTION: Benchmark of the per-batch overhead of running cspp_active_fire_noaa as a new
+ process for each batch of granules, and of submitting each batch to a server
+ ("cspp_active_fire_noaa.py --serve") with cspp_active_fire_noaa_client.py, using the synthetic
+ granules and stub executables of synthetic_viirs.py. The LWM cache is warmed first, and the
+ batches of the two modes are interleaved. For each batch the wall time seen by the caller is
+ split into the time of the processing stages of the run (from its timing report), which includes
+ the pool startup of a new process, and the remaining overhead (the interpreter startup, imports
+ and option parsing of a new process, or the client and socket of the server).
+
+ Usage: python benchmarks/bench_server.py [-n 4] [-r 5] [-b M] [-p 2]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+from os.path import join as pjoin
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_viirs import make_afire_home, make_inputs, install_grid2gran
+from bench_pipeline import launch_pipeline, read_timing_report
+
+
+def run_server(config_file):
+    '''
+    Run the server in this process, as described by the config file.
+    '''
+    with open(config_file) as file_obj:
+        config = json.load(file_obj)
+
+    os.environ['CSPP_ACTIVE_FIRE_HOME'] = config['afire_home']
+    os.environ['CSPP_ACTIVE_FIRE_STATIC_DIR'] = pjoin(config['afire_home'], 'static_ancillary')
+    sys.path.insert(0, REPO_DIR)
+    install_grid2gran(config['afire_home'])
+
+    import cspp_active_fire_noaa
+    sys.argv = ['cspp_active_fire_noaa.py', '--serve', config['socket'], '-W', config['work_dir'],
+                '--num-cpu', str(config['num_cpu'])]
+    return cspp_active_fire_noaa.main()
+
+
+def launch_client(root, label, socket_path, inputs, cache_dir, args):
+    '''
+    Submit the inputs to the server with the client, in the work directory root/work_<label>.
+    Returns the timing report records and summary, and the wall time of the client.
+    '''
+    work_dir = pjoin(root, 'work_{}'.format(label))
+    os.makedirs(work_dir)
+    cmd = [sys.executable, pjoin(REPO_DIR, 'cspp_active_fire_noaa_client.py'), '--socket',
+           socket_path, inputs, '-W', work_dir, '--cache-dir', cache_dir, '--num-cpu',
+           str(args.num_cpu), '--timing-report'] + (['-M'] if args.band == 'M' else [])
+    output = None if args.verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=work_dir, stdout=output, stderr=output, check=False)
+    wall = time.perf_counter() - start
+
+    records, summary = read_timing_report(work_dir)
+    return records, summary, wall
+
+
+def run_wall(records):
+    '''
+    Return the total wall time of the processing stages of the run, and of its dispatch stage.
+    '''
+    run = [record for record in records if record['record'] == 'run'][0]
+    return run['wall'], run['stages'].get('dispatch', {}).get('wall', 0.)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the per-batch overhead of a new process and of the server.')
+    parser.add_argument('-n', '--granules', type=int, default=4,
+                        help='The number of granules in each batch.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='The number of batches run in each mode.')
+    parser.add_argument('-b', '--band', choices=['M', 'I'], default='M',
+                        help='Run the M-band or I-band active fires.')
+    parser.add_argument('-p', '--num-cpu', type=int, default=min(os.cpu_count() or 1, 4),
+                        help='The number of CPUs used by the pipeline and the server.')
+    parser.add_argument('-f', '--fires', type=float, default=20.,
+                        help='The mean number of fire pixels in each granule.')
+    parser.add_argument('-w', '--work-root',
+                        help='The directory for the fixtures and runs [default: a temp dir].')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='Keep the fixtures and run directories.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show the output of the pipeline runs and the server.')
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.server is not None:
+        return run_server(args.server)
+
+    # The options used by bench_pipeline.launch_pipeline()
+    args.vfire_sleep = 0.
+    args.afire_args = ''
+    os.environ.update({'AFIRE_STUB_FIRES': str(args.fires), 'AFIRE_STUB_SLEEP': '0'})
+
+    root = tempfile.mkdtemp(prefix='bench_server_', dir=args.work_root)
+    afire_home = pjoin(root, 'afire_home')
+    make_afire_home(afire_home)
+    inputs = pjoin(root, 'inputs')
+    os.makedirs(inputs)
+    make_inputs(inputs, args.granules, args.band)
+    cache_dir = pjoin(root, 'cache')
+
+    # Start the server, and wait for its socket
+    socket_path = pjoin(root, 'afire.sock')
+    server_dir = pjoin(root, 'server')
+    os.makedirs(server_dir)
+    config_file = pjoin(server_dir, 'server_config.json')
+    with open(config_file, 'w') as file_obj:
+        json.dump({'afire_home': afire_home, 'socket': socket_path, 'work_dir': server_dir,
+                   'num_cpu': args.num_cpu}, file_obj)
+    output = None if args.verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--server', config_file],
+                              cwd=server_dir, stdout=output, stderr=output)
+    while not os.path.exists(socket_path):
+        if server.poll() is not None:
+            print('The server failed to start')
+            return 1
+        time.sleep(0.01)
+    print('Server started in {:.2f} s'.format(time.perf_counter() - start))
+
+    try:
+        # Warm the LWM cache, so that every batch does the same work
+        launch_pipeline(root, 'warmup', afire_home, inputs, cache_dir, args)
+
+        results = {'process': [], 'server': []}
+        for idx in range(args.repeat):
+            records, summary, result, wall = launch_pipeline(
+                root, 'process_{}'.format(idx), afire_home, inputs, cache_dir, args)
+            results['process'].append((wall,) + run_wall(records))
+            records, summary, wall = launch_client(root, 'server_{}'.format(idx), socket_path,
+                                                   inputs, cache_dir, args)
+            results['server'].append((wall,) + run_wall(records))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print('{} batches of {} {}-band granules in each mode, median times (s):'.format(
+        args.repeat, args.granules, args.band))
+    print('{:>8} {:>8} {:>8} {:>8} {:>9}'.format('mode', 'wall', 'stages', 'dispatch',
+                                                'overhead'))
+    for mode, times in results.items():
+        wall, stages, dispatch = np.median(np.array(times), axis=0)
+        overhead = np.median([time_wall - time_stages for time_wall, time_stages, time_dispatch
+                              in times])
+        print('{:>8} {:8.3f} {:8.3f} {:8.3f} {:9.3f}'.format(mode, wall, stages, dispatch,
+                                                             overhead))
+    print('stages: the processing stages of the run; overhead: the rest of the wall time')
+
+    if not args.keep:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
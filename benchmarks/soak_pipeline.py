@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+soak_pipeline.py
+
+ * DESCRIPTION: Soak (load) test of the active fire pipeline, emulating a direct broadcast feed.
+ Synthetic granules (see synthetic_viirs.py) arrive in an incoming directory as a Poisson process,
+ optionally in bursts of contiguous granules as for a pass, and cspp_active_fire_noaa is run in
+ cycles, as it is by a direct broadcast processing script: each cycle takes every granule that
+ has arrived, and processes it with the shared LWM cache.
+
+ The stub vfire sleeps and allocates memory according to log-normal runtime and RSS
+ distributions, and occasionally hangs (until the pipeline's --vfire-timeout kills it) or crashes
+ with a segmentation fault, so this exercises the dispatcher and the external process handling
+ under sustained load. At the end the driver reports the latency from the arrival of each granule
+ to its output, the queue depth (the granules which have arrived but not yet been processed,
+ sampled every second), the worker utilization, and the number of crashed and killed granules.
+
+ Usage: python benchmarks/soak_pipeline.py [-d 60] [-r 6] [--runtime 5,0.3] [--rss 200,0.3]
+                                           [--hang 0.01] [--segfault 0.01] [--vfire-timeout 60]
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import re
+import sys
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+from glob import glob
+from os.path import basename, join as pjoin
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_viirs import make_afire_home, make_inputs
+from bench_pipeline import launch_pipeline, stage_wall, POST_STAGES
+
+# Matches the granule start date and time in the input and output filenames
+GRANULE_TIME_RE = re.compile(r'_d(\d+)_t(\d+)_')
+
+# The return codes of a vfire killed by the timeout, or by a segmentation fault (signalled, or
+# reported by the shell).
+KILLED_RC = (-9, 137)
+SEGFAULT_RC = (-11, 139)
+
+
+def granule_key(filename):
+    return GRANULE_TIME_RE.search(basename(filename)).groups()
+
+
+def percentiles(values, points=(50, 90, 99, 100)):
+    if len(values) == 0:
+        return [float('nan')] * len(points)
+    return list(np.percentile(values, points))
+
+
+class Feed():
+    '''
+    Moves the files of pre-generated granules into the incoming directory at their arrival
+    times, recording the arrival time of each granule.
+    '''
+
+    def __init__(self, granule_files, incoming_dir, arrival_offsets, burst):
+        self.granule_files = granule_files
+        self.incoming_dir = incoming_dir
+        self.arrival_offsets = arrival_offsets
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.arrivals = {}
+        self.done = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        start = time.time()
+        granules = iter(sorted(self.granule_files.keys()))
+        for offset in self.arrival_offsets:
+            time.sleep(max(start + offset - time.time(), 0.))
+            with self.lock:
+                for granule in [next(granules, None) for idx in range(self.burst)]:
+                    if granule is None:
+                        break
+                    for filename in self.granule_files[granule]:
+                        os.rename(filename, pjoin(self.incoming_dir, basename(filename)))
+                    self.arrivals[granule_key(self.granule_files[granule][0])] = time.time()
+        self.done = True
+
+    def take(self, inputs_dir):
+        '''
+        Move the granules which have arrived to inputs_dir, returning their number.
+        '''
+        with self.lock:
+            filenames = glob(pjoin(self.incoming_dir, '*.h5'))
+            for filename in filenames:
+                os.rename(filename, pjoin(inputs_dir, basename(filename)))
+        return len(set([granule_key(filename) for filename in filenames]))
+
+
+def monitor_queue(feed, state, samples, interval=1.):
+    '''
+    Sample the number of granules which have arrived but not been processed, until the feed and
+    processing are finished.
+    '''
+    while not state['finished']:
+        outputs = len(glob(pjoin(state['work_dir'], 'AF*.nc'))) if state['work_dir'] else 0
+        with feed.lock:
+            arrived = len(feed.arrivals)
+        samples.append(arrived - state['processed'] - outputs)
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Soak test the active fire pipeline with a synthetic direct broadcast feed.')
+    parser.add_argument('-d', '--duration', type=float, default=10.,
+                        help='The duration of the feed (minutes).')
+    parser.add_argument('-r', '--rate', type=float, default=6.,
+                        help='The mean granule arrival rate (granules per minute).')
+    parser.add_argument('--burst', type=int, default=1,
+                        help='The number of contiguous granules in each arrival.')
+    parser.add_argument('--runtime', default='5,0.3',
+                        help='The median (s) and sigma of the log-normal vfire runtime.')
+    parser.add_argument('--rss', default='200,0.3',
+                        help='The median (MB) and sigma of the log-normal vfire memory.')
+    parser.add_argument('--hang', type=float, default=0.01,
+                        help='The probability that a vfire hangs.')
+    parser.add_argument('--segfault', type=float, default=0.01,
+                        help='The probability that a vfire crashes.')
+    parser.add_argument('--vfire-timeout', type=float, default=60.,
+                        help='The time (s) after which the pipeline kills a vfire.')
+    parser.add_argument('--poll', type=float, default=5.,
+                        help='The time (s) to wait for new granules between cycles.')
+    parser.add_argument('-b', '--band', choices=['M', 'I'], default='M',
+                        help='Run the M-band or I-band active fires.')
+    parser.add_argument('-s', '--scans', type=int, default=4,
+                        help='The number of scans in each granule.')
+    parser.add_argument('-c', '--columns', type=int, default=400,
+                        help='The number of M-band columns in each granule.')
+    parser.add_argument('-p', '--num-cpu', type=int, default=min(os.cpu_count() or 1, 4),
+                        help='The number of CPUs used by the pipeline.')
+    parser.add_argument('-f', '--fires', type=float, default=20.,
+                        help='The mean number of fire pixels in each granule.')
+    parser.add_argument('--afire-args', default='',
+                        help='Further options for cspp_active_fire_noaa.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the arrival times.')
+    parser.add_argument('-w', '--work-root',
+                        help='The directory for the fixtures and runs [default: a temp dir].')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='Keep the fixtures and run directories.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show the output of the pipeline runs.')
+    args = parser.parse_args()
+
+    # The options used by bench_pipeline.launch_pipeline()
+    args.vfire_sleep = 0.
+    args.afire_args = '--vfire-timeout {} {}'.format(args.vfire_timeout, args.afire_args)
+    os.environ.update({'AFIRE_STUB_RUNTIME': args.runtime, 'AFIRE_STUB_RSS': args.rss,
+                       'AFIRE_STUB_HANG': str(args.hang),
+                       'AFIRE_STUB_SEGFAULT': str(args.segfault)})
+
+    # The arrival times, and the granules which arrive
+    rng = np.random.default_rng(args.seed)
+    duration = args.duration * 60.
+    arrival_offsets = np.cumsum(rng.exponential(60. * args.burst / args.rate,
+                                                int(2 * duration * args.rate / 60. + 10)))
+    arrival_offsets = arrival_offsets[arrival_offsets < duration]
+    num_granules = arrival_offsets.size * args.burst
+
+    root = tempfile.mkdtemp(prefix='soak_pipeline_', dir=args.work_root)
+    afire_home = pjoin(root, 'afire_home')
+    make_afire_home(afire_home)
+    pool_dir = pjoin(root, 'pool')
+    incoming_dir = pjoin(root, 'incoming')
+    cache_dir = pjoin(root, 'cache')
+    for dirname in [pool_dir, incoming_dir]:
+        os.makedirs(dirname)
+
+    start = time.perf_counter()
+    granule_files = {}
+    for first, last, filename in make_inputs(pool_dir, num_granules, args.band, args.scans,
+                                             args.columns):
+        granule_files.setdefault(first, []).append(filename)
+    print('Generated {} {}-band granules in {:.1f} s, in {}'.format(
+        num_granules, args.band, time.perf_counter() - start, root))
+    print('Feeding {} granules over {:.1f} minutes'.format(num_granules, args.duration))
+
+    feed = Feed(granule_files, incoming_dir, arrival_offsets, args.burst)
+    state = {'finished': False, 'processed': 0, 'work_dir': None}
+    queue_samples = []
+    monitor = threading.Thread(target=monitor_queue, args=(feed, state, queue_samples),
+                               daemon=True)
+
+    soak_start = time.time()
+    feed.thread.start()
+    monitor.start()
+
+    latencies = []
+    outcomes = {'completed': 0, 'problem': 0, 'killed': 0, 'segfault': 0, 'crashed': 0}
+    worker_busy = 0.
+    dispatch_wall = 0.
+    max_rss = [0., 0.]
+    cycle = 0
+    while True:
+        inputs_dir = pjoin(root, 'inputs_{:04d}'.format(cycle))
+        os.makedirs(inputs_dir)
+        feed_done = feed.done
+        num_taken = feed.take(inputs_dir)
+        if num_taken == 0:
+            os.rmdir(inputs_dir)
+            if feed_done:
+                break
+            time.sleep(args.poll)
+            continue
+
+        label = 'cycle_{:04d}'.format(cycle)
+        state['work_dir'] = pjoin(root, 'work_{}'.format(label))
+        records, summary, result, wall = launch_pipeline(root, label, afire_home, inputs_dir,
+                                                         cache_dir, args)
+
+        # The latency of each output, from the arrival of its granule
+        for output_file in glob(pjoin(state['work_dir'], 'AF*.nc')):
+            latencies.append(os.stat(output_file).st_mtime - feed.arrivals[granule_key(
+                output_file)])
+
+        for record in [record for record in records if record['record'] == 'granule']:
+            rc_exe = record.get('vfire', {}).get('rc', record['rc_exe'])
+            if record['rc_exe'] == 0:
+                outcomes['completed' if record['rc_problem'] == 0 else 'problem'] += 1
+            elif rc_exe in KILLED_RC:
+                outcomes['killed'] += 1
+            elif rc_exe in SEGFAULT_RC:
+                outcomes['segfault'] += 1
+            else:
+                outcomes['crashed'] += 1
+
+        cycle_busy = stage_wall(records, 'granule', exclude=POST_STAGES) + \
+            stage_wall(records, 'lwm_batch')
+        run = [record for record in records if record['record'] == 'run'][0]['stages']
+        worker_busy += cycle_busy
+        dispatch_wall += run.get('dispatch', {}).get('wall', 0.)
+        max_rss = [max(max_rss[0], result['maxrss_self'] / 1024.),
+                   max(max_rss[1], result['maxrss_children'] / 1024.)]
+        state['processed'] += num_taken
+        state['work_dir'] = None
+
+        print('cycle {:4d}: {:4d} granules in {:7.1f} s, {:5d} waiting, elapsed {:7.1f} s'.format(
+            cycle, num_taken, wall, len(feed.arrivals) - state['processed'],
+            time.time() - soak_start))
+        cycle += 1
+
+    elapsed = time.time() - soak_start
+    state['finished'] = True
+    monitor.join()
+
+    print('')
+    print('{} granules arrived in {:.1f} s ({:.2f}/min), processed in {} cycles'.format(
+        len(feed.arrivals), elapsed, 60. * len(feed.arrivals) / elapsed, cycle))
+    print('outcomes: ' + ', '.join(['{} {}'.format(value, key) for key, value in
+                                     outcomes.items()]))
+    print('latency, arrival to output (s):  p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+        *percentiles(latencies)))
+    print('queue depth (granules):          p50 {:.0f}  p90 {:.0f}  p99 {:.0f}  max {:.0f}'.format(
+        *percentiles(queue_samples)))
+    print('worker utilization:              {:.1%} of the soak, {:.1%} of the dispatch'.format(
+        worker_busy / (args.num_cpu * elapsed),
+        worker_busy / (args.num_cpu * dispatch_wall) if dispatch_wall > 0. else 0.))
+    print('peak RSS (MB):                   {:.0f} parent, {:.0f} largest child'.format(*max_rss))
+
+    if not args.keep:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
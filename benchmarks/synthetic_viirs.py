@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+synthetic_viirs.py
+
+ * DESCRIPTION: Synthetic fixtures for running the whole active fire pipeline offline: small VIIRS
+ SDR and geolocation granules with the CDFCB /Data_Products and /All_Data layout (unaggregated,
+ or aggregated several granules to a file), a CSPP_ACTIVE_FIRE_HOME with stub "nagg" and "vfire"
+ executables, and the static ancillary files (the leap second table, a sparse global DEM and the
+ LWM CDL template).
+
+ The granules are laid out along synthetic orbits over a band of land in the DEM, with an orbit
+ crossing the dateline every few dozen orbits. The stub nagg splits aggregated files into
+ single granule files, and the stub vfire reads its geolocation and LWM inputs and writes an
+ output file in the M-band (NetCDF4) or I-band (HDF5) format, with a few fire pixels on land.
+ The behaviour of the stub vfire is set with environment variables:
+
+   AFIRE_STUB_FIRES     the mean number of fire pixels [20]
+   AFIRE_STUB_SLEEP     the time it sleeps, in seconds [0]
+   AFIRE_STUB_RUNTIME   "MEDIAN,SIGMA" of a log-normal distribution of the time it sleeps
+   AFIRE_STUB_RSS       "MEDIAN,SIGMA" of a log-normal distribution of the memory (MB) it
+                        allocates, and holds while it sleeps
+   AFIRE_STUB_HANG      the probability it hangs, until it is killed [0]
+   AFIRE_STUB_SEGFAULT  the probability it crashes with a segmentation fault, half way through
+                        its sleep [0]
+
+ The samples are seeded by the output filename.
+
+ The gridding and granulation library is not part of this tree, so grid2gran_nearest() is a
+ numpy stand-in for its nearest neighbour granulation of the (regular) DEM grid, which is
+ installed in place of the library with install_grid2gran().
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import argparse
+import importlib
+import signal
+import stat
+import time
+import zlib
+from datetime import datetime, timedelta
+from os.path import basename, join as pjoin
+
+import numpy as np
+import h5py
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAT = 'npp'
+
+# The granule ID scheme (see utils.get_granule_ID), and the leap seconds of the synthetic dates
+GRANULE_USEC = 85350000
+GRANULE_ID_BASETIME = 1698019234000000
+IET_EPOCH = datetime(1958, 1, 1)
+LEAP_SECONDS = 37
+FIRST_GRANULE = (int(((datetime(2024, 6, 1) - IET_EPOCH).total_seconds() + LEAP_SECONDS) * 1e6)
+                 - GRANULE_ID_BASETIME) // GRANULE_USEC + 1
+FIRST_ORBIT = 65000
+
+# Each synthetic orbit holds this many contiguous granules, each a degree of latitude long and
+# SWATH_WIDTH degrees of longitude wide, starting at SOUTH. Successive orbits are ORBIT_STEP
+# degrees of longitude apart.
+GRANULES_PER_ORBIT = 20
+SOUTH = -30.
+SWATH_WIDTH = 8.
+ORBIT_STEP = 7.3
+
+# The collection short names, the number of detectors, and the dataset written to /All_Data for
+# each input prefix.
+COLLECTIONS = {
+    'GMTCO': ('VIIRS-MOD-GEO-TC', 16, None),
+    'GITCO': ('VIIRS-IMG-GEO-TC', 32, None),
+    'IVCDB': ('VIIRS-DualGain-Cal-IP', 16, 'DualGainCal'),
+}
+COLLECTIONS.update({'SVM{:02d}'.format(band): ('VIIRS-M{}-SDR'.format(band), 16, 'Radiance')
+                    for band in range(1, 17)})
+COLLECTIONS.update({'SVI{:02d}'.format(band): ('VIIRS-I{}-SDR'.format(band), 32, 'Radiance')
+                    for band in range(1, 6)})
+
+INPUT_PREFIXES = {
+    'M': ['GMTCO', 'SVM05', 'SVM07', 'SVM11', 'SVM13', 'SVM15', 'SVM16'],
+    'I': ['GMTCO', 'GITCO', 'SVI01', 'SVI02', 'SVI03', 'SVI04', 'SVI05', 'SVM13', 'IVCDB'],
+}
+
+# The DEM file layout, see ancillary.GridIP.LandWaterMask
+DEM_FILENAME = 'dem30ARC_Global_LandWater_compressed.h5'
+DEM_DSET = '/demGRID/Data Fields/LandWater'
+DEM_SHAPE = (21600, 43200)
+DEM_CHUNKS = (240, 480)
+DEM_LAND = 1
+DEM_DEEP_OCEAN = 7
+
+LEAPSEC_TABLE = '''\
+ 1972 JAN  1 =JD 2441317.5  TAI-UTC=  10.0       S + (MJD - 41317.) X 0.0      S
+ 2012 JUL  1 =JD 2456109.5  TAI-UTC=  35.0       S + (MJD - 41317.) X 0.0      S
+ 2015 JUL  1 =JD 2457204.5  TAI-UTC=  36.0       S + (MJD - 41317.) X 0.0      S
+ 2017 JAN  1 =JD 2457754.5  TAI-UTC=  37.0       S + (MJD - 41317.) X 0.0      S
+'''
+
+LWM_CDL = '''\
+netcdf AF-LAND_MASK_NASA_1KM {
+dimensions:
+	Along_Track = 768 ;
+	Along_Scan = 3200 ;
+variables:
+	float Latitude(Along_Track, Along_Scan) ;
+		Latitude:long_name = "Latitude; degrees" ;
+		Latitude:units = "degrees_north" ;
+		Latitude:_FillValue = -999.f ;
+		Latitude:valid_range = -90.f, 90.f ;
+	float Longitude(Along_Track, Along_Scan) ;
+		Longitude:long_name = "Longitude; degrees" ;
+		Longitude:units = "degrees_east" ;
+		Longitude:_FillValue = -999.f ;
+		Longitude:valid_range = -180.f, 180.f ;
+	byte LandMask(Along_Track, Along_Scan) ;
+		LandMask:_FillValue = -128b ;
+		LandMask:flag_values = 0b, 1b, 2b, 3b, 4b, 5b, 6b, 7b ;
+
+// global attributes:
+		:Conventions = "CF-1.5" ;
+		:History = "" ;
+}
+'''
+
+STUB_SCRIPT = '''\
+#!{python}
+import sys
+sys.path.insert(0, {bench_dir!r})
+from synthetic_viirs import {entry_point}
+sys.exit({entry_point}(sys.argv))
+'''
+
+
+def wrap_longitude(lon):
+    return np.mod(lon + 180., 360.) - 180.
+
+
+def granule_times(idx):
+    '''
+    Return the granule ID, IET and the start and end datetimes of the synthetic granule idx.
+    '''
+    granule_number = FIRST_GRANULE + idx
+    iet = GRANULE_ID_BASETIME + granule_number * GRANULE_USEC
+    start_dt = IET_EPOCH + timedelta(microseconds=iet - LEAP_SECONDS * 1000000)
+    end_dt = start_dt + timedelta(microseconds=GRANULE_USEC - 1500000)
+    granule_id = 'NPP{0:0>12d}'.format(granule_number * GRANULE_USEC // 100000)
+    return granule_id, iet, start_dt, end_dt
+
+
+def granule_orbit(idx):
+    return FIRST_ORBIT + idx // GRANULES_PER_ORBIT
+
+
+def granule_bounds(idx):
+    '''
+    Return the south, north, west and east edges of the synthetic granule idx. The western edge
+    is east of the eastern edge for granules crossing the dateline.
+    '''
+    south = SOUTH + idx % GRANULES_PER_ORBIT
+    west = float(wrap_longitude(-170. + (idx // GRANULES_PER_ORBIT) * ORBIT_STEP))
+    return south, south + 1., west, float(wrap_longitude(west + SWATH_WIDTH))
+
+
+def granule_geolocation(idx, rows, cols):
+    '''
+    Return the latitude and longitude of the synthetic granule idx, on a rows x cols swath.
+    '''
+    south, north, west, east = granule_bounds(idx)
+    lat, lon = np.meshgrid(np.linspace(south, north, rows), np.linspace(0., SWATH_WIDTH, cols),
+                           indexing='ij')
+    return lat.astype(np.float32), wrap_longitude(west + lon).astype(np.float32)
+
+
+def viirs_filename(prefix, start_dt, end_dt, orbit, created_dt=None):
+    '''
+    Return a CDFCB style filename, which is matched by active_fire_interface.get_file_info().
+    '''
+    created_dt = datetime.utcnow() if created_dt is None else created_dt
+    return '{}_{}_d{}_t{}{}_e{}{}_b{:05d}_c{}_cspp_dev.h5'.format(
+        prefix, SAT, start_dt.strftime('%Y%m%d'),
+        start_dt.strftime('%H%M%S'), start_dt.microsecond // 100000,
+        end_dt.strftime('%H%M%S'), end_dt.microsecond // 100000,
+        orbit, created_dt.strftime('%Y%m%d%H%M%S%f'))
+
+
+def granule_attrs(prefix, idx):
+    '''
+    Return the attributes of the _Gran_ group of the synthetic granule idx.
+    '''
+    granule_id, iet, start_dt, end_dt = granule_times(idx)
+    attrs = {
+        'N_Granule_ID': np.array([[granule_id.encode()]]),
+        'N_Beginning_Time_IET': np.array([[iet]], dtype=np.uint64),
+        'N_Ending_Time_IET': np.array([[iet + GRANULE_USEC]], dtype=np.uint64),
+        'N_Beginning_Orbit_Number': np.array([[granule_orbit(idx)]], dtype=np.uint64),
+        'Beginning_Date': np.array([[start_dt.strftime('%Y%m%d').encode()]]),
+        'Beginning_Time': np.array([[start_dt.strftime('%H%M%S.%fZ').encode()]]),
+        'Ending_Date': np.array([[end_dt.strftime('%Y%m%d').encode()]]),
+        'Ending_Time': np.array([[end_dt.strftime('%H%M%S.%fZ').encode()]]),
+    }
+    if COLLECTIONS[prefix][2] is None:
+        south, north, west, east = granule_bounds(idx)
+        attrs.update({
+            'North_Bounding_Coordinate': np.array([[north]], dtype=np.float32),
+            'South_Bounding_Coordinate': np.array([[south]], dtype=np.float32),
+            'East_Bounding_Coordinate': np.array([[east]], dtype=np.float32),
+            'West_Bounding_Coordinate': np.array([[west]], dtype=np.float32),
+            'G-Ring_Latitude': np.array([[south], [south], [north], [north]], dtype=np.float32),
+            'G-Ring_Longitude': np.array([[west], [east], [east], [west]], dtype=np.float32),
+        })
+    return attrs
+
+
+def granule_datasets(prefix, idx, nscan, ncol, rng):
+    '''
+    Return the /All_Data datasets of the synthetic granule idx. The SDR datasets are uniform
+    noise, so that the file sizes scale with the swath.
+    '''
+    detectors = COLLECTIONS[prefix][1]
+    rows, cols = nscan * detectors, ncol * detectors // 16
+    dset_name = COLLECTIONS[prefix][2]
+    if dset_name is None:
+        latitude, longitude = granule_geolocation(idx, rows, cols)
+        return {'Latitude': latitude, 'Longitude': longitude,
+                'ModeScan': np.ones(nscan, dtype=np.uint8)}
+    return {dset_name: rng.integers(0, 65528, (rows, cols), dtype=np.uint16)}
+
+
+def write_viirs_file(filename, prefix, gran_attrs, gran_datasets):
+    '''
+    Write a VIIRS file holding one or more granules (aggregated along track), given the attributes
+    and /All_Data datasets of each granule.
+    '''
+    collection = COLLECTIONS[prefix][0]
+    file_obj = h5py.File(filename, 'w')
+    try:
+        product = file_obj.create_group('/Data_Products/{}'.format(collection))
+        aggr = product.create_group('{}_Aggr'.format(collection))
+        aggr.attrs['AggregateNumberGranules'] = np.array([[len(gran_attrs)]], dtype=np.uint64)
+        aggr.attrs['AggregateBeginningGranuleID'] = gran_attrs[0]['N_Granule_ID']
+        aggr.attrs['AggregateEndingGranuleID'] = gran_attrs[-1]['N_Granule_ID']
+        aggr.attrs['AggregateBeginningOrbitNumber'] = gran_attrs[0]['N_Beginning_Orbit_Number']
+        for gran_idx, attrs in enumerate(gran_attrs):
+            gran = product.create_group('{}_Gran_{}'.format(collection, gran_idx))
+            for key, value in attrs.items():
+                gran.attrs[key] = value
+
+        all_data = file_obj.create_group('/All_Data/{}_All'.format(collection))
+        for dset_name in gran_datasets[0].keys():
+            all_data[dset_name] = np.concatenate([datasets[dset_name]
+                                                  for datasets in gran_datasets])
+    finally:
+        file_obj.close()
+
+
+def make_inputs(input_dir, num_granules, band='M', nscan=4, ncol=400, granules_per_file=1,
+                seed=0):
+    '''
+    Write the input files of num_granules synthetic granules to input_dir, with granules_per_file
+    granules in each file. Returns a list of (first granule, last granule, filename) of the files.
+    '''
+    rng = np.random.default_rng(seed)
+    created_dt = datetime.utcnow()
+    files = []
+    for first in range(0, num_granules, granules_per_file):
+        granules = range(first, min(first + granules_per_file, num_granules))
+        for prefix in INPUT_PREFIXES[band]:
+            start_dt = granule_times(granules[0])[2]
+            end_dt = granule_times(granules[-1])[3]
+            filename = pjoin(input_dir, viirs_filename(prefix, start_dt, end_dt,
+                                                       granule_orbit(granules[0]), created_dt))
+            write_viirs_file(filename, prefix,
+                             [granule_attrs(prefix, idx) for idx in granules],
+                             [granule_datasets(prefix, idx, nscan, ncol, rng) for idx in granules])
+            files.append((granules[0], granules[-1], filename))
+    return files
+
+
+def make_dem(dem_file, south, north):
+    '''
+    Write a global DEM of deep ocean, with a checkerboard of land chunks between the latitudes
+    south and north. The DEM is chunked and compressed, so it is small on disk.
+    '''
+    dlat = 180. / DEM_SHAPE[0]
+    row_start = int(np.floor((90. - north) / dlat / DEM_CHUNKS[0])) * DEM_CHUNKS[0]
+    row_end = int(np.ceil((90. - south) / dlat / DEM_CHUNKS[0])) * DEM_CHUNKS[0]
+    land = np.full(DEM_CHUNKS, DEM_LAND, dtype=np.uint8)
+
+    file_obj = h5py.File(dem_file, 'w')
+    try:
+        dset = file_obj.create_dataset(DEM_DSET, shape=DEM_SHAPE, dtype=np.uint8,
+                                       chunks=DEM_CHUNKS, compression='gzip',
+                                       fillvalue=DEM_DEEP_OCEAN)
+        for row in range(row_start, row_end, DEM_CHUNKS[0]):
+            for col in range(0, DEM_SHAPE[1], DEM_CHUNKS[1]):
+                if (row // DEM_CHUNKS[0] + col // DEM_CHUNKS[1]) % 2 == 0:
+                    dset[row:row + DEM_CHUNKS[0], col:col + DEM_CHUNKS[1]] = land
+    finally:
+        file_obj.close()
+
+
+def make_ancillary(ancil_dir):
+    '''
+    Write the static ancillary files: the leap second table, the DEM and the LWM CDL template.
+    '''
+    os.makedirs(ancil_dir, exist_ok=True)
+    with open(pjoin(ancil_dir, 'IETTime.dat'), 'w') as file_obj:
+        file_obj.write(LEAPSEC_TABLE)
+    with open(pjoin(ancil_dir, 'AF-LAND_MASK_NASA_1KM.cdl'), 'w') as file_obj:
+        file_obj.write(LWM_CDL)
+    make_dem(pjoin(ancil_dir, DEM_FILENAME), SOUTH - 1., SOUTH + GRANULES_PER_ORBIT + 1.)
+
+
+def make_afire_home(afire_home):
+    '''
+    Create a CSPP_ACTIVE_FIRE_HOME with the stub executables, and the static ancillary files in
+    its static_ancillary directory. Returns the static ancillary directory.
+    '''
+    vendor_dir = pjoin(afire_home, 'vendor')
+    os.makedirs(vendor_dir, exist_ok=True)
+    os.makedirs(pjoin(afire_home, 'lib'), exist_ok=True)
+    for exe_name, entry_point in [('nagg', 'nagg_main'), ('vfire750_static', 'vfire_main'),
+                                  ('vfire375_static', 'vfire_main')]:
+        exe_file = pjoin(vendor_dir, exe_name)
+        with open(exe_file, 'w') as file_obj:
+            file_obj.write(STUB_SCRIPT.format(python=sys.executable, bench_dir=BENCH_DIR,
+                                              entry_point=entry_point))
+        os.chmod(exe_file, os.stat(exe_file).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    ancil_dir = pjoin(afire_home, 'static_ancillary')
+    make_ancillary(ancil_dir)
+    return ancil_dir
+
+
+def grid2gran_nearest(lat, lon, data, nData, gridLat, gridLon, gridData, dataIdx, rows, cols):
+    '''
+    A numpy stand-in for grid2gran_nearest() of the gridding and granulation library, for the
+    regular grids of the DEM: the latitude grid ascends along the rows, and the longitude grid
+    along the columns.
+    '''
+    lat0, lon0 = gridLat[0, 0], gridLon[0, 0]
+    dlat = (gridLat[-1, 0] - lat0) / max(rows - 1, 1)
+    dlon = (gridLon[0, -1] - lon0) / max(cols - 1, 1)
+    row = np.rint((lat - lat0) / dlat)
+    col = np.rint((lon - lon0) / dlon)
+    valid = (lat >= -800.) & (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    idx = np.where(valid, row * cols + col, -254).astype(np.int64)
+    dataIdx[:] = idx
+    data[valid] = gridData.ravel()[idx[valid]]
+
+
+def install_grid2gran(afire_home):
+    '''
+    Install grid2gran_nearest() as the granulation function for afire_home, in this process and
+    any pool workers forked from it.
+    '''
+    lwm_module = importlib.import_module('ancillary.GridIP.LandWaterMask')
+    lib_file = pjoin(afire_home, 'lib', 'libgriddingAndGranulation.so')
+    lwm_module._grid2gran_funcs[lib_file] = grid2gran_nearest
+
+
+def split_aggregated(agg_file, out_dir):
+    '''
+    Write each granule of an aggregated file to its own file in out_dir. Returns the number of
+    granules.
+    '''
+    prefix = basename(agg_file).split('_')[0]
+    collection = COLLECTIONS[prefix][0]
+    file_obj = h5py.File(agg_file, 'r')
+    try:
+        product = file_obj['/Data_Products/{}'.format(collection)]
+        num_grans = int(product['{}_Aggr'.format(collection)].attrs['AggregateNumberGranules'][0][0])
+        all_data = file_obj['/All_Data/{}_All'.format(collection)]
+        created_dt = datetime.utcnow()
+        for gran_idx in range(num_grans):
+            attrs = dict(product['{}_Gran_{}'.format(collection, gran_idx)].attrs.items())
+            datasets = {}
+            for dset_name, dset in all_data.items():
+                rows = dset.shape[0] // num_grans
+                datasets[dset_name] = dset[gran_idx * rows:(gran_idx + 1) * rows]
+
+            def attr_dt(date_key, time_key):
+                return datetime.strptime(attrs[date_key][0][0].decode() +
+                                         attrs[time_key][0][0].decode(), '%Y%m%d%H%M%S.%fZ')
+
+            filename = viirs_filename(prefix, attr_dt('Beginning_Date', 'Beginning_Time'),
+                                      attr_dt('Ending_Date', 'Ending_Time'),
+                                      int(attrs['N_Beginning_Orbit_Number'][0][0]), created_dt)
+            write_viirs_file(pjoin(out_dir, filename), prefix, [attrs], [datasets])
+    finally:
+        file_obj.close()
+    return num_grans
+
+
+def nagg_main(argv):
+    '''
+    The stub nagg: split the aggregated input files into single granule files.
+    '''
+    parser = argparse.ArgumentParser(prog='nagg')
+    for flag in ['-t', '-g', '-n', '-O', '-D']:
+        parser.add_argument(flag)
+    parser.add_argument('-S', action='store_true')
+    parser.add_argument('-d', dest='out_dir', default=os.curdir)
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv[1:])
+
+    for agg_file in args.files:
+        num_grans = split_aggregated(agg_file, args.out_dir)
+        print('nagg: wrote {} granules from {}'.format(num_grans, basename(agg_file)))
+    return 0
+
+
+def sample_lognormal(rng, spec, default=0.):
+    '''
+    Return a sample of the log-normal distribution given as "MEDIAN,SIGMA", or the default if
+    there is no distribution.
+    '''
+    if not spec:
+        return default
+    median, sigma = [float(value) for value in spec.split(',')]
+    return median * np.exp(sigma * rng.standard_normal())
+
+
+def vfire_main(argv):
+    '''
+    The stub vfire: read the geolocation and LWM, and write an output file with a few fire pixels
+    on land. The inputs are given in the order of construct_cmd_invocations().
+    '''
+    i_band = len(argv) > 1 and argv[1] == '-ndv'
+    args = argv[2:] if i_band else argv[1:]
+    geo_file, lwm_file, output_file = (args[7], args[8], args[10]) if i_band else \
+        (args[6], args[7], args[8])
+
+    rng = np.random.default_rng(zlib.crc32(output_file.encode()))
+    runtime = sample_lognormal(rng, os.environ.get('AFIRE_STUB_RUNTIME'),
+                               float(os.environ.get('AFIRE_STUB_SLEEP', 0.)))
+    rss_mb = sample_lognormal(rng, os.environ.get('AFIRE_STUB_RSS'))
+    fault = rng.random()
+    hang = fault < float(os.environ.get('AFIRE_STUB_HANG', 0.))
+    segfault = not hang and \
+        fault < float(os.environ.get('AFIRE_STUB_HANG', 0.)) + \
+        float(os.environ.get('AFIRE_STUB_SEGFAULT', 0.))
+
+    # Touch every page of the allocation, so that it is resident
+    ballast = np.ones(int(rss_mb * 1024 * 1024), dtype=np.uint8)
+
+    if hang:
+        print('vfire: hanging on {}'.format(output_file))
+        sys.stdout.flush()
+        while True:
+            time.sleep(3600.)
+    if segfault:
+        time.sleep(runtime / 2.)
+        sys.stdout.flush()
+        os.kill(os.getpid(), signal.SIGSEGV)
+    time.sleep(runtime)
+    del(ballast)
+
+    geo_prefix = 'GITCO' if i_band else 'GMTCO'
+    collection = COLLECTIONS[geo_prefix][0]
+    with h5py.File(geo_file, 'r') as file_obj:
+        latitude = file_obj['/All_Data/{}_All/Latitude'.format(collection)][:]
+        longitude = file_obj['/All_Data/{}_All/Longitude'.format(collection)][:]
+    # Read the LWM through the netCDF library, as vfire does, so that any netCDF format may be used
+    from netCDF4 import Dataset
+    with Dataset(lwm_file, 'r') as file_obj:
+        file_obj.set_auto_mask(False)
+        land_mask = file_obj['LandMask'][:]
+
+    # The LWM may be at a coarser resolution than the geolocation (the default for the I-band)
+    land_mask = land_mask.repeat(latitude.shape[0] // land_mask.shape[0], axis=0) \
+        .repeat(latitude.shape[1] // land_mask.shape[1], axis=1)
+    land = np.flatnonzero(land_mask == DEM_LAND)
+    nfire = min(rng.poisson(float(os.environ.get('AFIRE_STUB_FIRES', 20.))), land.size)
+    fire_idx = np.sort(rng.choice(land, nfire, replace=False))
+    fire_mask = np.zeros(latitude.shape, dtype=np.int8)
+    fire_mask.ravel()[fire_idx] = 9
+
+    columns = {
+        'FP_latitude': latitude.ravel()[fire_idx],
+        'FP_longitude': longitude.ravel()[fire_idx],
+        'FP_T4' if i_band else 'FP_T13': rng.uniform(300., 400., nfire).astype(np.float32),
+        'FP_confidence': rng.integers(7, 10, nfire).astype(np.int8) if i_band else
+                         rng.integers(0, 101, nfire).astype(np.int32),
+        'FP_power': rng.exponential(20., nfire).astype(np.float32),
+    }
+
+    if i_band:
+        with h5py.File(output_file, 'w') as file_obj:
+            file_obj.attrs['FirePix'] = np.array([nfire], dtype=np.int32)
+            file_obj.create_dataset('Fire mask', data=fire_mask, compression='gzip')
+            for dset_name, values in columns.items():
+                file_obj[dset_name] = values
+    else:
+        file_obj = Dataset(output_file, 'w', format='NETCDF4')
+        try:
+            file_obj.createDimension('Along_Track', fire_mask.shape[0])
+            file_obj.createDimension('Along_Scan', fire_mask.shape[1])
+            file_obj.createVariable('Fire mask', 'i1', ('Along_Track', 'Along_Scan'),
+                                    zlib=True)[:] = fire_mask
+            group = file_obj.createGroup('Fire Pixels')
+            group.createDimension('nfire', nfire)
+            for var_name, values in columns.items():
+                group.createVariable(var_name, values.dtype, ('nfire',))[:] = values
+        finally:
+            file_obj.close()
+
+    print('vfire: wrote {} fire pixels to {}'.format(nfire, output_file))
+    return 0
@@ -15,26 +15,32 @@ import os
 import sys
 import logging
 import traceback
-from cffi import FFI
+from datetime import datetime
 
 from args import argument_parser
-from active_fire_interface import get_afire_inputs, construct_cmd_invocations
-from dispatcher import afire_dispatcher
-from utils import create_dir, setup_cache_dir, clean_cache, cleanup, CsppEnvironment
+from utils import create_dir, setup_cache_dir, cleanup, CsppEnvironment
 from utils import check_and_convert_path, check_and_convert_env_var
+from timing import Timer, report_timer, open_report, close_report, open_trace, close_trace
+from profiling import profiled
+from metrics import open_metrics, count_granules, close_metrics
 
 os.environ['TZ'] = 'UTC'
-ffi = FFI()
 
 LOG = logging.getLogger(__name__)
 
 
-def process_afire_inputs(work_dir, afire_options):
+def process_afire_inputs(work_dir, afire_options, timer=None):
     """
     Construct dictionaries of valid input files and options, manage the ancillary cache, granulate
     the required ancillary data, and construct a series of command line invocations, which are then
-    executed, returning the return codes for each valid input.
+    executed, returning the return codes for each valid input. The stages are timed with the given
+    Timer.
+
+    The modules of each stage (and the numpy, h5py, netCDF4 and GridIP packages they use) are
+    imported when the stage is reached, so that runs which stop early don't pay for them.
     """
+    from active_fire_interface import get_afire_inputs, construct_cmd_invocations
+    timer = Timer('run') if timer is None else timer
 
     #ret_val = 0
     afire_home = afire_options['afire_home']
@@ -50,7 +56,9 @@ def process_afire_inputs(work_dir, afire_options):
     LOG.info('')
 
     # Create a dictionary containing valid inputs and related metadata
-    afire_data_dict, granule_id_list = get_afire_inputs(afire_options['inputs'], afire_options)
+    with timer.span('inventory', io=True):
+        afire_data_dict, granule_id_list = get_afire_inputs(afire_options['inputs'],
+                                                            afire_options)
 
     for gran_key in afire_data_dict.keys():
         for file_key in afire_data_dict[gran_key].keys():
@@ -62,7 +70,8 @@ def process_afire_inputs(work_dir, afire_options):
         return [],[],[],[]
 
     # Add the required command line invocations to the input dict...
-    afire_data_dict = construct_cmd_invocations(afire_data_dict, afire_options)
+    with timer.span('commands'):
+        afire_data_dict = construct_cmd_invocations(afire_data_dict, afire_options)
 
     LOG.info('')
     LOG.info('>>> Input Files')
@@ -73,34 +82,40 @@ def process_afire_inputs(work_dir, afire_options):
         LOG.info(label_format_str.format(granule_id,
                                          str(afire_data_dict[granule_id][geo_prefix]['dt'])))
 
+    from ancillary.lwm_cache import clean_cache
+    from dispatcher import afire_dispatcher
+
     # Clean out product cache files that are too old.
     LOG.info('')
     if not afire_options['preserve_cache']:
-        LOG.info(">>> Cleaning the ancillary cache back {} hours...".format(
-            afire_options['cache_window']))
-        first_dt = afire_data_dict[granule_id_list[0]][geo_prefix]['dt']
-        clean_cache(afire_options['cache_dir'], afire_options['cache_window'], first_dt)
-
-    # Create the required cache dirs
-    for granule_id in granule_id_list:
-        anc_dir = afire_data_dict[granule_id][geo_prefix]['dt'].strftime('%Y_%m_%d_%j-%Hh')
-        lwm_dir = os.path.join(afire_options['cache_dir'], anc_dir)
-        lwm_dir = create_dir(lwm_dir)
-        if lwm_dir is None:
-            LOG.warn("Unable to create cache dir {} for granule {}".format(lwm_dir, granule_id))
+        LOG.info(">>> Cleaning the ancillary cache to {} GB, and files unused for {} hours...".format(
+            afire_options['cache_size'], afire_options['cache_window']))
+        with timer.span('clean_cache', io=True):
+            clean_cache(afire_options['cache_dir'], afire_options['cache_size'],
+                        afire_options['cache_window'],
+                        purge_legacy=afire_options['purge_legacy_cache'],
+                        temp_timeout=afire_options['lwm_lock_timeout'])
+
+    # Create the LWM cache dir
+    lwm_dir = create_dir(os.path.join(afire_options['cache_dir'], 'lwm'))
+    if lwm_dir is None:
+        LOG.warn("Unable to create the LWM cache dir in {}".format(afire_options['cache_dir']))
 
     # Run the dispatcher
     LOG.info('')
     LOG.info('>>> Running Active Fires')
     LOG.info('')
-    rc_exe_dict, rc_problem_dict = afire_dispatcher(afire_home, afire_data_dict, afire_options)
+    with timer.span('dispatch', io=True):
+        rc_exe_dict, rc_problem_dict = afire_dispatcher(afire_home, afire_data_dict,
+                                                        afire_options)
     LOG.debug("rc_exe_dict = {}".format(rc_exe_dict))
     LOG.debug("rc_problem_dict = {}".format(rc_problem_dict))
 
     # Unless directed not to, cleanup the unaggregated inputs dir
     if afire_options['docleanup']:
         unagg_inputs_dir = os.path.join(work_dir, 'unaggregated_inputs')
-        cleanup([unagg_inputs_dir])
+        with timer.span('cleanup', io=True):
+            cleanup([unagg_inputs_dir])
 
     # Populate the diagnostic granule ID lists
     for granule_id in granule_id_list:
@@ -120,17 +135,18 @@ def process_afire_inputs(work_dir, afire_options):
     crashed_runs = sorted(list(set(crashed_runs)))
     problem_runs = sorted(list(set(problem_runs)))
 
+    count_granules(attempted_runs, successful_runs, crashed_runs, problem_runs)
+
     return attempted_runs, successful_runs, crashed_runs, problem_runs
 
 
-def main():
+def run_afire(args, work_dir, docleanup, cspp_afire_version):
     """
-    The main method, which checks environment vars and collects all of the required input options.
-    Returns 0 on success
+    Check the environment vars, collect all of the required input options from the parsed command
+    line, and process the inputs. Returns the return code (0 on success), and a dictionary of the
+    attempted, successful, problem and crashed granule IDs.
     """
-
-    # Read in the command line options
-    args, work_dir, docleanup, cspp_afire_version, logfile = argument_parser()
+    runs = {'attempted': [], 'successful': [], 'problem': [], 'crashed': []}
 
     # Check various paths and environment variables that are "must haves".
     try:
@@ -144,38 +160,100 @@ def main():
     except CsppEnvironment as e:
         LOG.error(e.value)
         LOG.error('Installation error, Make sure all software components were installed.')
-        return 2
+        return 2, runs
 
     afire_options = {}
     afire_options['inputs'] = args.inputs
     afire_options['afire_home'] = os.path.abspath(afire_home)
     afire_options['i_band'] = args.i_band
+    afire_options['lwm_geo_prefix'] = 'GITCO' if (args.i_band and args.native_lwm) else 'GMTCO'
     afire_options['work_dir'] = os.path.abspath(args.work_dir)
     afire_options['ancil_dir'] = afire_ancil_path
     afire_options['cache_dir'] = setup_cache_dir(args.cache_dir, afire_options['work_dir'],
                                                  'CSPP_ACTIVE_FIRE_CACHE_DIR')
     afire_options['ancillary_only'] = args.ancillary_only
+    afire_options['cache_size'] = args.cache_size
     afire_options['cache_window'] = args.cache_window
     afire_options['preserve_cache'] = args.preserve_cache
+    afire_options['purge_legacy_cache'] = args.purge_legacy_cache
+    afire_options['lwm_lock_timeout'] = args.lwm_lock_timeout
+    afire_options['lwm_batch_size'] = args.lwm_batch_size
+    afire_options['dem_chunk_cache'] = args.dem_chunk_cache
+    afire_options['lwm_reuse'] = args.lwm_reuse
+    afire_options['lwm_reuse_tolerance'] = args.lwm_reuse_tolerance
+    afire_options['lwm_reuse_agreement'] = args.lwm_reuse_agreement
+    afire_options['lwm_compress'] = args.lwm_compress
     afire_options['num_cpu'] = args.num_cpu
+    afire_options['num_io_threads'] = max(args.num_io_threads, 1)
+    afire_options['fire_store'] = args.fire_store or args.fire_dedup
+    afire_options['fire_dedup'] = args.fire_dedup
+    afire_options['dedup_distance'] = args.dedup_distance
+    afire_options['dedup_time_window'] = \
+        args.dedup_time_window * 60. if args.dedup_time_window > 0. else None
+    afire_options['vfire_timeout'] = args.vfire_timeout if args.vfire_timeout > 0. else None
+    afire_options['timing_report'] = args.timing_report
+    afire_options['profile'] = args.profile
+    afire_options['profile_memory'] = args.profile_memory
+    afire_options['trace'] = args.trace
+    afire_options['granule_logs'] = args.granule_logs
+    afire_options['metrics_file'] = args.metrics_file
+    afire_options['metrics_port'] = args.metrics_port
     afire_options['docleanup'] = docleanup
+    afire_options['debug'] = args.debug
     afire_options['version'] = cspp_afire_version
 
+    # Optionally write a report of the timing of each stage, for each granule and the whole run,
+    # and a Chrome trace of the stages of every process.
+    run_timer = Timer('run')
+    run_dt = datetime.utcnow()
+    if afire_options['timing_report']:
+        open_report(afire_options['work_dir'], run_dt)
+    if afire_options['trace']:
+        open_trace(afire_options['work_dir'], run_dt)
+    open_metrics(afire_options)
+
     rc = 0
     try:
 
-        attempted_runs, successful_runs, crashed_runs, problem_runs = process_afire_inputs(
-            work_dir, afire_options)
+        # Optionally profile the parent (the pool workers profile each of their tasks)
+        with profiled(afire_options, 'run', run_dt.strftime('%Y%m%d%H%M%S')):
+            attempted_runs, successful_runs, crashed_runs, problem_runs = process_afire_inputs(
+                work_dir, afire_options, run_timer)
 
         LOG.info('attempted_runs    {}'.format(attempted_runs))
         LOG.info('successful_runs   {}'.format(successful_runs))
         LOG.info('problem_runs      {}'.format(problem_runs))
         LOG.info('crashed_runs      {}'.format(crashed_runs))
+        runs = {'attempted': attempted_runs, 'successful': successful_runs,
+                'problem': problem_runs, 'crashed': crashed_runs}
 
     except Exception:
         LOG.error(traceback.format_exc())
         rc = 1
 
+    finally:
+        report_timer(run_timer, 'run')
+        close_report()
+        close_trace()
+        close_metrics(rc, sum([total['wall'] for total in run_timer.totals().values()]))
+
+    return rc, runs
+
+
+def main():
+    """
+    The main method, which reads the command line options, and either processes the inputs, or
+    runs a server which processes the inputs of the jobs sent to it. Returns 0 on success
+    """
+
+    # Read in the command line options
+    args, work_dir, docleanup, cspp_afire_version, logfile = argument_parser()
+
+    if args.serve is not None:
+        from afire_server import serve
+        return serve(args.serve, args)
+
+    rc, _ = run_afire(args, work_dir, docleanup, cspp_afire_version)
     return rc
 
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+cspp_active_fire_noaa_client.py
+
+ * DESCRIPTION: Thin client of the CSPP Active Fires server (see afire_server.py). It takes the same
+ options as cspp_active_fire_noaa.py, and sends them with the current directory and the
+ CSPP_ACTIVE_FIRE_* (and NPP_GRANULE_ID_BASETIME) environment variables to the server over its
+ Unix domain socket. The log of the job is written to stdout and stderr as the server
+ streams it back, and the client exits with the return code of the job. Only the standard library
+ is used, so that the client starts quickly.
+
+ The socket is given by a leading "--socket SOCKET" option, or by the CSPP_ACTIVE_FIRE_SOCKET
+ environment variable.
+
+ Usage: cspp_active_fire_noaa_client.py [--socket SOCKET] <cspp_active_fire_noaa.py options>
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import json
+import socket
+
+# The environment variables which are sent to the server, to be applied to the job
+JOB_ENV_PREFIX = 'CSPP_ACTIVE_FIRE_'
+JOB_ENV_VARS = ['NPP_GRANULE_ID_BASETIME']
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = os.environ.get('CSPP_ACTIVE_FIRE_SOCKET')
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        socket_path, argv = argv[1], argv[2:]
+
+    if socket_path is None:
+        sys.stderr.write('Usage: {} [--socket SOCKET] <cspp_active_fire_noaa.py options>\n'
+                         'The socket may also be given by the CSPP_ACTIVE_FIRE_SOCKET environment'
+                         ' variable.\n'.format(os.path.basename(sys.argv[0])))
+        return 2
+
+    client_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client_sock.connect(socket_path)
+    except (IOError, OSError) as err:
+        sys.stderr.write('Unable to connect to the CSPP Active Fires server on {}: {}\n'.format(
+            socket_path, err))
+        return 2
+
+    job_env = {name: value for name, value in os.environ.items()
+               if (name.startswith(JOB_ENV_PREFIX) or name in JOB_ENV_VARS) and
+               name != 'CSPP_ACTIVE_FIRE_SOCKET'}
+
+    rc = None
+    with client_sock:
+        client_sock.sendall((json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': job_env}) +
+                             '\n').encode('utf-8'))
+        for line in client_sock.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if 'text' in message:
+                stream = sys.stdout if message['stream'] == 'stdout' else sys.stderr
+                stream.write(message['text'])
+                stream.flush()
+            elif 'rc' in message:
+                rc = message['rc']
+
+    if rc is None:
+        sys.stderr.write('The CSPP Active Fires server closed the connection before the job'
+                         ' finished.\n')
+        return 1
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
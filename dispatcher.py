@@ -20,6 +20,8 @@ import shutil
 from glob import glob
 import traceback
 import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from subprocess import call, check_call, CalledProcessError
 import numpy as np
@@ -28,34 +30,133 @@ import h5py
 from netCDF4 import Dataset
 
 from utils import link_files, getURID, execution_time, execute_binary_captured_inject_io, cleanup
-
-from ancillary.stage_ancillary import get_lwm
+from utils import log_exe_resources, task_log_file
+from log_common import log_calls
+
+from ancillary.stage_ancillary import get_lwm, get_lwm_footprint, get_lwm_batches, get_lwm_batch
+from ancillary.stage_ancillary import init_lwm_worker
+from fire_text import write_fire_text
+from fire_store import FireStore, fire_store_filename
+from fire_dedup import dedup_fire_store, fire_dedup_filename
+from timing import Timer, report_timer
+from profiling import profile_calls
+from metrics import set_dispatch_state
+from worker_pool import get_pool, release_pool, is_shared, shared_pool_size
 
 LOG = logging.getLogger('dispatcher')
 
+# The HDF5 and netCDF4 libraries are not thread-safe, so the post-processing threads take turns
+# accessing the output files.
+_hdf_lock = threading.Lock()
+
+# The options shared by every task, which are sent to each worker process once by the pool
+# initializer rather than with every task.
+_worker_options = {}
 
-def afire_submitter(args):
+
+class AfireTask():
+    '''
+    A compact description of the work for a single granule, holding only what a pool worker needs,
+    so that each task is cheap to send to the worker.
+    '''
+
+    __slots__ = ['granule_id', 'run_dir', 'cmd', 'input_files', 'lwm_name', 'output_file',
+                 'creation_dt', 'geo_prefix', 'geo_file', 'geo_dt', 'geo_orbit']
+
+    def __init__(self, granule_dict, afire_options):
+        geo_prefix = afire_options['lwm_geo_prefix']
+
+        self.granule_id = granule_dict['granule_id']
+        self.run_dir = granule_dict['run_dir']
+        self.cmd = granule_dict['cmd']
+        self.input_files = [granule_dict[key]['file'] for key in afire_options['input_prefixes']]
+        self.lwm_name = granule_dict['GRLWM']['file']
+        self.output_file = granule_dict['AFEDR']['file']
+        self.creation_dt = granule_dict['creation_dt']
+        self.geo_prefix = geo_prefix
+        self.geo_file = granule_dict[geo_prefix]['file']
+        self.geo_dt = granule_dict[geo_prefix]['dt']
+        self.geo_orbit = granule_dict[geo_prefix]['orbit']
+
+    def lwm_granule_dict(self):
+        '''
+        Return the subset of the granule dictionary used to generate the LWM.
+        '''
+        return {'granule_id': self.granule_id,
+                self.geo_prefix: {'file': self.geo_file, 'dt': self.geo_dt,
+                                  'orbit': self.geo_orbit}}
+
+
+def worker_options(afire_options):
+    '''
+    Return the options required by the pool workers, leaving out the (possibly very long) list of
+    inputs.
+    '''
+    return {key: value for key, value in afire_options.items() if key not in ['inputs']}
+
+
+def afire_pool_initializer(afire_options):
+    '''
+    Initialize each worker process of the pool with the shared options, so that the fixed
+    per-granule overhead of loading libraries, opening the DEM and parsing templates is only paid
+    once per process.
+    '''
+    _worker_options.clear()
+    _worker_options.update(afire_options)
+    init_lwm_worker(afire_options)
+
+
+def shared_pool_task(args):
+    '''
+    Run a task in a worker of the shared pool of a server, first initializing the worker with the
+    options of this run if they differ from those of its last task.
+    '''
+    func, afire_options, task = args
+    if afire_options != _worker_options:
+        afire_pool_initializer(afire_options)
+    return func(task)
+
+
+def pool_tasks(pool, func, tasks, afire_options):
+    '''
+    Return the function and arguments which run func on each of the tasks in the pool. The workers
+    of a shared pool were not initialized for this run, so each of its tasks carries the options.
+    '''
+    if not is_shared(pool):
+        return func, tasks
+    shared_options = worker_options(afire_options)
+    return shared_pool_task, [(func, shared_options, task) for task in tasks]
+
+
+@log_calls(lambda task: task_log_file(_worker_options, task.granule_id))
+@profile_calls('afire', lambda task: (_worker_options, task.granule_id))
+def afire_submitter(task):
     '''
     This routine encapsulates the single unit of work, multiple instances of which are submitted to
-    the multiprocessing queue. It takes as input whatever is required to complete the work unit,
-    and returns return values and output logging from the external process.
+    the multiprocessing queue. It takes as input an AfireTask describing the work unit (the shared
+    options having been set by the pool initializer), and returns return values and output logging
+    from the external process, and the timing of each stage.
     '''
+    timer = Timer(task.granule_id)
+    rc_ancil_dict = {}
+    exe_resources = {}
 
     # This try block wraps all code in this worker function, to capture any exceptions.
     try:
 
-        granule_dict = args['granule_dict']
-        afire_home = args['afire_home']
-        afire_options = args['afire_options']
+        afire_options = _worker_options
+        afire_home = afire_options['afire_home']
 
-        granule_id = granule_dict['granule_id']
-        run_dir = granule_dict['run_dir']
-        cmd = granule_dict['cmd']
+        granule_id = task.granule_id
+        run_dir = task.run_dir
+        cmd = task.cmd
         work_dir = afire_options['work_dir']
         env_vars = {}
 
         rc_exe = 0
         rc_problem = 0
+        created_run_dir = None
+        ran_afire = False
         exe_out = "Finished the Active Fires granule {}".format(granule_id)
 
         LOG.debug("granule_id = {}".format(granule_id))
@@ -69,14 +170,16 @@ def afire_submitter(args):
         LOG.info("Processing granule_id {}...".format(granule_id))
 
         # Create the run dir for this input file
-        log_idx = 0
-        while True:
-            run_dir = pjoin(work_dir, "{}_run_{}".format(granule_dict['run_dir'], log_idx))
-            if not exists(run_dir):
-                os.makedirs(run_dir)
-                break
-            else:
-                log_idx += 1
+        with timer.span('run_dir'):
+            log_idx = 0
+            while True:
+                run_dir = pjoin(work_dir, "{}_run_{}".format(task.run_dir, log_idx))
+                if not exists(run_dir):
+                    os.makedirs(run_dir)
+                    created_run_dir = run_dir
+                    break
+                else:
+                    log_idx += 1
 
         os.chdir(run_dir)
 
@@ -84,10 +187,12 @@ def afire_submitter(args):
         LOG.info("\tStaging the required ancillary data for granule_id {}...".format(granule_id))
         failed_ancillary = False
         try:
-            rc_ancil, rc_ancil_dict, lwm_file = get_lwm(afire_options, granule_dict)
+            rc_ancil, rc_ancil_dict, lwm_file = get_lwm(afire_options, task.lwm_granule_dict(),
+                                                        timer=timer)
             failed_ancillary = True if rc_ancil != 0 else False
         except Exception as err:
             failed_ancillary = True
+            rc_ancil_dict = {'cache': 'failed'}
             LOG.warn('\tProblem generating LWM for granule_id {}'.format(granule_id))
             LOG.error(err)
             LOG.debug(traceback.format_exc())
@@ -111,14 +216,20 @@ def afire_submitter(args):
 
         else:
             # Link the required files and directories into the work directory...
-            paths_to_link = [
-                pjoin(afire_home, 'vendor', afire_options['vfire_exe']),
-                lwm_file,
-            ] + [granule_dict[key]['file'] for key in afire_options['input_prefixes']]
-            number_linked = link_files(run_dir, paths_to_link)
-            LOG.debug("\tWe are linking {} files to the run dir:".format(number_linked))
-            for linked_files in paths_to_link:
-                LOG.debug("\t{}".format(linked_files))
+            with timer.span('link'):
+                paths_to_link = [
+                    pjoin(afire_home, 'vendor', afire_options['vfire_exe']),
+                ] + task.input_files
+                number_linked = link_files(run_dir, paths_to_link)
+                LOG.debug("\tWe are linking {} files to the run dir:".format(number_linked))
+                for linked_files in paths_to_link:
+                    LOG.debug("\t{}".format(linked_files))
+
+                # The cached LWM file is keyed by geolocation, so link it under the name vfire
+                # expects.
+                lwm_link = pjoin(run_dir, task.lwm_name)
+                LOG.debug("\tLink {} -> {}".format(lwm_file, lwm_link))
+                os.symlink(lwm_file, lwm_link)
 
             # Contruct a dictionary of error conditions which should be logged.
             error_keys = ['FAILURE', 'failure', 'FAILED', 'failed', 'FAIL', 'fail',
@@ -131,10 +242,12 @@ def afire_submitter(args):
 
             start_time = time.time()
 
-            rc_exe, exe_out = execute_binary_captured_inject_io(
-                run_dir, cmd, error_dict,
-                log_execution=False, log_stdout=False, log_stderr=False,
-                **env_vars)
+            with timer.span('vfire', io=True):
+                rc_exe, exe_out = execute_binary_captured_inject_io(
+                    run_dir, cmd, error_dict,
+                    log_execution=False, log_stdout=False, log_stderr=False,
+                    resource_dict=exe_resources, timeout=afire_options['vfire_timeout'],
+                    **env_vars)
 
             end_time = time.time()
 
@@ -147,6 +260,7 @@ def afire_submitter(args):
                         afire_time['minutes'], afire_time['seconds']))
 
             LOG.debug("\tGranule ID: {}, rc_exe = {}".format(granule_id, rc_exe))
+            log_exe_resources('afire', granule_id, exe_resources)
 
             os.chdir(current_dir)
 
@@ -156,16 +270,46 @@ def afire_submitter(args):
             logname = "{}_{}.log".format(run_dir, timestamp)
             log_dir = dirname(run_dir)
             logpath = pjoin(log_dir, logname)
-            logfile_obj = open(logpath, 'w')
-            for line in exe_out.splitlines():
-                logfile_obj.write(str(line) + "\n")
-            logfile_obj.close()
+            with timer.span('vfire_log'):
+                logfile_obj = open(logpath, 'w')
+                for line in exe_out.splitlines():
+                    logfile_obj.write(str(line) + "\n")
+                logfile_obj.close()
+
+            ran_afire = True
 
+    except Exception:
+        rc_problem = 1
+        LOG.warn("\tGeneral warning for {}".format(granule_id))
+        LOG.debug(traceback.format_exc())
+        os.chdir(current_dir)
+        #raise
+
+    return [granule_id, rc_exe, rc_problem, exe_out, created_run_dir, ran_afire, timer,
+            rc_ancil_dict, exe_resources]
+
+
+def afire_postprocess(task, rc_exe, rc_problem, run_dir, ran_afire, afire_options,
+                      fire_store=None, timer=None, rc_ancil_dict=None, exe_resources=None):
+    '''
+    Post-process the output of a single Active Fires granule, in a thread of the parent process:
+    update the global attributes of the output file, write the fire pixels to a text file (and
+    optionally append them to the consolidated fire store), move the outputs to the work
+    directory, and remove the run directory. The stages are added to the granule's Timer, whose
+    record is written to the timing report. Returns the updated problem return code.
+    '''
+    granule_id = task.granule_id
+    work_dir = afire_options['work_dir']
+    timer = Timer(granule_id) if timer is None else timer
+    nfire = 0
+
+    try:
+        if ran_afire:
             # Update the various file global attributes
             try:
 
-                old_output_file = pjoin(run_dir, granule_dict['AFEDR']['file'])
-                creation_dt = granule_dict['creation_dt']
+                old_output_file = pjoin(run_dir, task.output_file)
+                creation_dt = task.creation_dt
 
                 # Check whether the target AF text file exists, and remove it.
                 output_txt_file = '{}.txt'.format(splitext(old_output_file)[0])
@@ -179,24 +323,31 @@ def afire_submitter(args):
                 if afire_options['i_band']:
 
                     # Update the I-band attributes, and write the fire data to a text file.
-                    h5_file_obj = h5py.File(old_output_file, "a")
-                    h5_file_obj.attrs.create('date_created', np.string_(creation_dt.isoformat()))
-                    h5_file_obj.attrs.create('granule_id', np.string_(granule_id))
                     history_string = 'CSPP Active Fires version: {}'.format(afire_options['version'])
-                    h5_file_obj.attrs.create('history', np.string_(history_string))
-                    h5_file_obj.attrs.create('Metadata_Link', np.string_(basename(old_output_file)))
-                    h5_file_obj.attrs.create('id', np.string_(getURID(creation_dt)['URID']))
-
-                    # Extract desired data from the NetCDF4 file, for output to the text file
-                    nfire = h5_file_obj.attrs['FirePix'][0]
-                    if int(nfire) > 0:
-                        fire_datasets = ['FP_latitude', 'FP_longitude', 'FP_T4', 'FP_confidence',
-                                         'FP_power']
-                        fire_data = []
-                        for dset in fire_datasets:
-                            fire_data.append(h5_file_obj['/'+dset][:])
-
-                    h5_file_obj.close()
+                    with timer.span('attributes'), _hdf_lock:
+                        h5_file_obj = h5py.File(old_output_file, "a")
+                        h5_file_obj.attrs.create('date_created',
+                                                 np.string_(creation_dt.isoformat()))
+                        h5_file_obj.attrs.create('granule_id', np.string_(granule_id))
+                        h5_file_obj.attrs.create('history', np.string_(history_string))
+                        h5_file_obj.attrs.create('Metadata_Link',
+                                                 np.string_(basename(old_output_file)))
+                        h5_file_obj.attrs.create('id', np.string_(getURID(creation_dt)['URID']))
+
+                        # Extract desired data from the NetCDF4 file, for output to the text file
+                        nfire = h5_file_obj.attrs['FirePix'][0]
+                        if int(nfire) > 0:
+                            fire_datasets = ['FP_latitude', 'FP_longitude', 'FP_T4',
+                                             'FP_confidence', 'FP_power']
+                            fire_data = []
+                            for dset in fire_datasets:
+                                fire_data.append(h5_file_obj['/'+dset][:])
+
+                        h5_file_obj.close()
+
+                        if fire_store is not None:
+                            fire_store.append(granule_id, task.geo_dt,
+                                              fire_data if int(nfire) > 0 else [[]] * 5)
 
 
                     # Check if there are any fire pixels, and write the associated fire data to
@@ -205,49 +356,16 @@ def afire_submitter(args):
                     LOG.info("\tGranule {} has {} fire pixels".format(granule_id, nfire))
 
                     if int(nfire) > 0:
-                        Along_scan_pixel_dim = 0.375
-                        Along_track_pixel_dim = 0.375
-                        fire_pixel_res = [Along_scan_pixel_dim, Along_track_pixel_dim]
-
-                        format_str = '''{0:13.8f}, {1:13.8f}, {2:13.8f}, {5:6.3f}, {6:6.3f},''' \
-                            ''' {3:4d}, {4:13.8f}'''
-
-                        txt_file_header = \
-                            '''# Active Fires I-band EDR\n''' \
-                            '''#\n''' \
-                            '''# source: {}\n''' \
-                            '''# version: {}\n''' \
-                            '''#\n''' \
-                            '''# column 1: latitude of fire pixel (degrees)\n''' \
-                            '''# column 2: longitude of fire pixel (degrees)\n''' \
-                            '''# column 3: I04 brightness temperature of fire pixel (K)\n''' \
-                            '''# column 4: Along-scan fire pixel resolution (km)\n''' \
-                            '''# column 5: Along-track fire pixel resolution (km)\n''' \
-                            '''# column 6: detection confidence ([7,8,9]->[lo,med,hi])\n''' \
-                            '''# column 7: fire radiative power (MW)\n''' \
-                            '''#\n# number of fire pixels: {}\n''' \
-                            '''#'''.format(basename(old_output_file), history_string, nfire)
-
                         nasa_file = output_txt_file.replace('dev','dev_nasa')
                         if exists(nasa_file):
                             LOG.debug('{} exists, removing.'.format(nasa_file))
                             os.remove(nasa_file)
 
-                        LOG.info("\tWriting output text file {}".format(output_txt_file))
-                        txt_file_obj = open(output_txt_file, 'x')
-
                         try:
-                            txt_file_obj.write(txt_file_header + "\n")
-
-                            for FP_latitude, FP_longitude, FP_R13, FP_confidence, FP_power in zip(
-                                    *fire_data):
-                                fire_vars = [FP_latitude, FP_longitude, FP_R13, FP_confidence, FP_power]
-                                line = format_str.format(*(fire_vars + fire_pixel_res))
-                                txt_file_obj.write(line + "\n")
-
-                            txt_file_obj.close()
+                            with timer.span('fire_text'):
+                                write_fire_text(output_txt_file, 'I', basename(old_output_file),
+                                                history_string, nfire, fire_data)
                         except Exception:
-                            txt_file_obj.close()
                             rc_problem = 1
                             LOG.warning("\tProblem writing Active fire text file: {}".format(
                                 output_txt_file))
@@ -256,24 +374,29 @@ def afire_submitter(args):
 
                     # Update the M-band attributes, and write the fire data to a text file.
 
-                    nc_file_obj = Dataset(old_output_file, "a", format="NETCDF4")
-                    setattr(nc_file_obj, 'date_created', creation_dt.isoformat())
-                    setattr(nc_file_obj, 'granule_id', granule_id)
                     history_string = 'CSPP Active Fires version: {}'.format(
                         afire_options['version'])
-                    setattr(nc_file_obj, 'history', history_string)
-                    setattr(nc_file_obj, 'Metadata_Link', basename(old_output_file))
-                    setattr(nc_file_obj, 'id', getURID(creation_dt)['URID'])
-
-                    # Extract desired data from the NetCDF4 file, for output to the text file
-                    nfire = len(nc_file_obj['Fire Pixels'].dimensions['nfire'])
-                    if int(nfire) > 0:
-                        fire_datasets = ['FP_latitude', 'FP_longitude', 'FP_T13', 'FP_confidence',
-                                         'FP_power']
-                        fire_data = []
-                        for dset in fire_datasets:
-                            fire_data.append(nc_file_obj['Fire Pixels'].variables[dset][:])
-                    nc_file_obj.close()
+                    with timer.span('attributes'), _hdf_lock:
+                        nc_file_obj = Dataset(old_output_file, "a", format="NETCDF4")
+                        setattr(nc_file_obj, 'date_created', creation_dt.isoformat())
+                        setattr(nc_file_obj, 'granule_id', granule_id)
+                        setattr(nc_file_obj, 'history', history_string)
+                        setattr(nc_file_obj, 'Metadata_Link', basename(old_output_file))
+                        setattr(nc_file_obj, 'id', getURID(creation_dt)['URID'])
+
+                        # Extract desired data from the NetCDF4 file, for output to the text file
+                        nfire = len(nc_file_obj['Fire Pixels'].dimensions['nfire'])
+                        if int(nfire) > 0:
+                            fire_datasets = ['FP_latitude', 'FP_longitude', 'FP_T13',
+                                             'FP_confidence', 'FP_power']
+                            fire_data = []
+                            for dset in fire_datasets:
+                                fire_data.append(nc_file_obj['Fire Pixels'].variables[dset][:])
+                        nc_file_obj.close()
+
+                        if fire_store is not None:
+                            fire_store.append(granule_id, task.geo_dt,
+                                              fire_data if int(nfire) > 0 else [[]] * 5)
 
                     # Check if there are any fire pixels, and write the associated fire data to
                     # a text file...
@@ -281,44 +404,11 @@ def afire_submitter(args):
                     LOG.info("\tGranule {} has {} fire pixels".format(granule_id, nfire))
 
                     if int(nfire) > 0:
-                        Along_scan_pixel_dim = 0.75
-                        Along_track_pixel_dim = 0.75
-                        fire_pixel_res = [Along_scan_pixel_dim, Along_track_pixel_dim]
-
-                        format_str = '''{0:13.8f}, {1:13.8f}, {2:13.8f}, {5:6.3f}, {6:6.3f},''' \
-                            ''' {3:4d}, {4:13.8f}'''
-
-                        txt_file_header = \
-                            '''# Active Fires M-band EDR\n''' \
-                            '''#\n''' \
-                            '''# source: {}\n''' \
-                            '''# version: {}\n''' \
-                            '''#\n''' \
-                            '''# column 1: latitude of fire pixel (degrees)\n''' \
-                            '''# column 2: longitude of fire pixel (degrees)\n''' \
-                            '''# column 3: M13 brightness temperature of fire pixel (K)\n''' \
-                            '''# column 4: Along-scan fire pixel resolution (km)\n''' \
-                            '''# column 5: Along-track fire pixel resolution (km)\n''' \
-                            '''# column 6: detection confidence (%)\n''' \
-                            '''# column 7: fire radiative power (MW)\n''' \
-                            '''#\n# number of fire pixels: {}\n''' \
-                            '''#'''.format(basename(old_output_file), history_string, nfire)
-
-                        LOG.info("\tWriting output text file {}".format(output_txt_file))
-                        txt_file_obj = open(output_txt_file, 'x')
-
                         try:
-                            txt_file_obj.write(txt_file_header + "\n")
-
-                            for FP_latitude, FP_longitude, FP_T13, FP_confidence, FP_power in zip(
-                                    *fire_data):
-                                fire_vars = [FP_latitude, FP_longitude, FP_T13, FP_confidence, FP_power]
-                                line = format_str.format(*(fire_vars + fire_pixel_res))
-                                txt_file_obj.write(line + "\n")
-
-                            txt_file_obj.close()
+                            with timer.span('fire_text'):
+                                write_fire_text(output_txt_file, 'M', basename(old_output_file),
+                                                history_string, nfire, fire_data)
                         except Exception:
-                            txt_file_obj.close()
                             rc_problem = 1
                             LOG.warning("\tProblem writing Active fire text file: {}".format(
                                 output_txt_file))
@@ -339,7 +429,8 @@ def afire_submitter(args):
 
             for outfile in outfiles:
                 try:
-                    shutil.move(outfile, work_dir)
+                    with timer.span('move', io=True):
+                        shutil.move(outfile, work_dir)
                 except Exception:
                     rc_problem = 1
                     LOG.warning("\tProblem moving output {} from {} to {}".format(
@@ -347,16 +438,80 @@ def afire_submitter(args):
                     LOG.debug(traceback.format_exc())
 
         # If no problems, remove the run dir
-        if (rc_exe == 0) and (rc_problem == 0) and afire_options['docleanup']:
+        if (rc_exe == 0) and (rc_problem == 0) and afire_options['docleanup'] and \
+                run_dir is not None:
+            with timer.span('cleanup'):
                 cleanup([run_dir])
 
     except Exception:
-        LOG.warn("\tGeneral warning for {}".format(granule_id))
+        rc_problem = 1
+        LOG.warn("\tGeneral warning for post-processing of {}".format(granule_id))
         LOG.debug(traceback.format_exc())
-        os.chdir(current_dir)
-        #raise
 
-    return [granule_id, rc_exe, rc_problem, exe_out]
+    timer.log()
+    report_timer(timer, 'granule', granule_id=granule_id, rc_exe=rc_exe, rc_problem=rc_problem,
+                 lwm_rc=rc_ancil_dict, vfire=exe_resources, nfire=int(nfire))
+
+    return rc_problem
+
+
+@log_calls(lambda args: task_log_file(_worker_options,
+                                      'lwm_batch_{}'.format(args[0][0].granule_id)))
+def lwm_batch_submitter(args):
+    '''
+    This routine granulates the LWMs of a batch of contiguous granules from a shared DEM subset,
+    placing them in the LWM cache. Multiple instances of this are submitted to the
+    multiprocessing queue before the Active Fires tasks, which then find their LWMs in the cache.
+    '''
+    tasks, footprint = args
+    granule_ids = [task.granule_id for task in tasks]
+    timer = Timer(granule_ids[0])
+
+    try:
+        LOG.info("Staging the LWMs for granule_ids {}...".format(', '.join(granule_ids)))
+        results = get_lwm_batch(_worker_options, [task.lwm_granule_dict() for task in tasks],
+                                footprint, timer=timer)
+        failed = [granule_id for granule_id, result in zip(granule_ids, results)
+                  if result is None or result[0] != 0]
+        cache_results = ['failed' if result is None else result[1]['cache']
+                         for result in results]
+    except Exception:
+        LOG.warn("\tGeneral warning for LWM batch {}".format(granule_ids))
+        LOG.debug(traceback.format_exc())
+        failed = granule_ids
+        cache_results = ['failed'] * len(granule_ids)
+
+    return [granule_ids, failed, cache_results, timer]
+
+
+def lwm_batch_dispatcher(pool, cpus_to_use, afire_data_dict, afire_tasks, afire_options):
+    '''
+    Dispatch the batched LWM stage to the multiprocessing pool. Batches are limited so that there
+    are at least as many batches as CPUs where possible.
+    '''
+    num_granules = len(afire_data_dict)
+    max_batch_size = min(afire_options['lwm_batch_size'],
+                         max(int(np.ceil(num_granules / float(cpus_to_use))), 1))
+    batches = get_lwm_batches(afire_data_dict, afire_options, max_batch_size)
+
+    task_dict = {task.granule_id: task for task in afire_tasks}
+    lwm_tasks = [([task_dict[granule_id] for granule_id in granule_ids], footprint)
+                 for granule_ids, footprint in batches]
+
+    start_time = time.time()
+
+    LOG.info("Submitting {} LWM {} of {} granules to the pool...".format(
+        len(lwm_tasks), "batch" if len(lwm_tasks) == 1 else "batches", num_granules))
+    result_list = pool.map_async(*pool_tasks(pool, lwm_batch_submitter, lwm_tasks,
+                                             afire_options)).get(9999999)
+
+    for granule_ids, failed, cache_results, timer in result_list:
+        for granule_id in failed:
+            LOG.warn('\tBatched LWM granulation failed for granule_id {}'.format(granule_id))
+        report_timer(timer, 'lwm_batch', granule_ids=granule_ids, failed=failed,
+                     lwm_cache=cache_results)
+
+    LOG.info("Batched LWM generation took {:9.6f} seconds".format(time.time() - start_time))
 
 
 def afire_dispatcher(afire_home, afire_data_dict, afire_options):
@@ -365,14 +520,19 @@ def afire_dispatcher(afire_home, afire_data_dict, afire_options):
     job statuses.
     """
 
-    # Construct a list of task dicts...
+    # Construct a list of task dicts, with the granules having the largest LWM footprint first so
+    # that the most expensive tasks don't end up in the tail of the pool.
     granule_id_list = sorted(afire_data_dict.keys())
-    afire_tasks = []
+    lwm_cost = {}
     for granule_id in granule_id_list:
-        args = {'granule_dict': afire_data_dict[granule_id],
-                'afire_home': afire_home,
-                'afire_options': afire_options}
-        afire_tasks.append(args)
+        footprint, lwm_cost[granule_id] = get_lwm_footprint(afire_options,
+                                                             afire_data_dict[granule_id])
+        afire_data_dict[granule_id]['footprint'] = footprint
+        LOG.debug("Granule {} has estimated LWM cost {}".format(granule_id, lwm_cost[granule_id]))
+    granule_id_list = sorted(granule_id_list, key=lambda x: lwm_cost[x], reverse=True)
+
+    afire_tasks = [AfireTask(afire_data_dict[granule_id], afire_options)
+                   for granule_id in granule_id_list]
 
     # Setup the processing pool
     cpu_count = multiprocessing.cpu_count()
@@ -393,18 +553,90 @@ def afire_dispatcher(afire_home, afire_data_dict, afire_options):
     else:
         cpus_to_use = cpu_count
 
-    LOG.info('We are using {}/{} available CPUs'.format(cpus_to_use, cpu_count))
-    pool = multiprocessing.Pool(cpus_to_use)
+    # A server runs every job in its own (already running) pool
+    if shared_pool_size() > 0:
+        cpus_to_use = shared_pool_size()
+        LOG.info('Using the {} worker processes of the server'.format(cpus_to_use))
 
-    # Submit the Active Fire tasks to the processing pool
-    timeout = 9999999
-    result_list = []
+    LOG.info('We are using {}/{} available CPUs'.format(cpus_to_use, cpu_count))
+    pool = get_pool(cpus_to_use, initializer=afire_pool_initializer,
+                    initargs=(worker_options(afire_options),))
+
+    # Granulate the LWMs of contiguous granules in batches, so that the Active Fire tasks (or an
+    # ancillary-only run) find them in the cache.
+    if afire_options['lwm_batch_size'] > 1:
+        lwm_batch_dispatcher(pool, cpus_to_use, afire_data_dict, afire_tasks, afire_options)
+
+    # Submit the Active Fire tasks to the processing pool. As each task finishes, its output is
+    # post-processed by a thread pool in this process, so that the workers can move straight on
+    # to the next granule.
+    task_dict = {task.granule_id: task for task in afire_tasks}
+    post_futures = {}
+    rc_exe_dict = {}
+    rc_problem_dict = {}
 
     start_time = time.time()
 
     LOG.info("Submitting {} Active Fire {} to the pool...".format(
         len(afire_tasks), "task" if len(afire_tasks) == 1 else "tasks"))
-    result_list = pool.map_async(afire_submitter, afire_tasks).get(timeout)
+    LOG.info("Post-processing the outputs with {} I/O {}".format(
+        afire_options['num_io_threads'],
+        "thread" if afire_options['num_io_threads'] == 1 else "threads"))
+
+    # Optionally consolidate the fire pixels of every granule into a single store
+    fire_store = None
+    if afire_options['fire_store'] and not afire_options['ancillary_only']:
+        try:
+            fire_store = FireStore(fire_store_filename(afire_options['work_dir'],
+                                                       afire_options['i_band'], datetime.utcnow()),
+                                   afire_options['i_band'])
+        except Exception:
+            LOG.warning("Unable to create the consolidated fire store")
+            LOG.debug(traceback.format_exc())
+
+    set_dispatch_state(max(len(afire_tasks) - cpus_to_use, 0), min(cpus_to_use, len(afire_tasks)))
+
+    with ThreadPoolExecutor(max_workers=afire_options['num_io_threads']) as io_pool:
+        for result in pool.imap_unordered(*pool_tasks(pool, afire_submitter, afire_tasks,
+                                                      afire_options)):
+            granule_id, afire_rc, problem_rc, exe_out, run_dir, ran_afire, timer, lwm_rc, \
+                exe_resources = result
+            LOG.debug(">>> granule_id {}: afire_rc = {}, problem_rc = {}".format(
+                granule_id, afire_rc, problem_rc))
+
+            remaining = len(afire_tasks) - len(rc_exe_dict) - 1
+            set_dispatch_state(max(remaining - cpus_to_use, 0), min(cpus_to_use, remaining))
+
+            # Did the actual afire binary succeed?
+            rc_exe_dict[granule_id] = afire_rc
+            post_futures[granule_id] = io_pool.submit(
+                afire_postprocess, task_dict[granule_id], afire_rc, problem_rc, run_dir,
+                ran_afire, afire_options, fire_store, timer, lwm_rc, exe_resources)
+
+        # Collect the post-processing results
+        for granule_id, post_future in post_futures.items():
+            rc_problem_dict[granule_id] = post_future.result()
+
+    release_pool(pool)
+
+    if fire_store is not None:
+        try:
+            fire_store.close()
+        except Exception:
+            LOG.warning("Problem indexing the consolidated fire store {}".format(
+                fire_store.store_file))
+            LOG.debug(traceback.format_exc())
+
+        # Optionally merge the duplicate detections of overlapping granules and passes
+        if afire_options['fire_dedup']:
+            try:
+                dedup_fire_store(fire_store.store_file, fire_dedup_filename(fire_store.store_file),
+                                 afire_options['dedup_distance'],
+                                 afire_options['dedup_time_window'])
+            except Exception:
+                LOG.warning("Problem merging the duplicate fire pixels of {}".format(
+                    fire_store.store_file))
+                LOG.debug(traceback.format_exc())
 
     end_time = time.time()
 
@@ -416,19 +648,6 @@ def afire_dispatcher(afire_home, afire_data_dict, afire_options):
                 total_afire_time['minutes'], total_afire_time['seconds']))
     LOG.info('')
 
-    rc_exe_dict = {}
-    rc_problem_dict = {}
-
-    # Loop through each of the Active Fire results collect error information
-    for result in result_list:
-        granule_id, afire_rc, problem_rc, exe_out = result
-        LOG.debug(">>> granule_id {}: afire_rc = {}, problem_rc = {}".format(
-            granule_id, afire_rc, problem_rc))
-
-        # Did the actual afire binary succeed?
-        rc_exe_dict[granule_id] = afire_rc
-        rc_problem_dict[granule_id] = problem_rc
-
     return rc_exe_dict, rc_problem_dict
 
 
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+fire_dedup.py
+
+ * DESCRIPTION: Merge duplicate detections of the same fire, from overlapping scans at granule
+ edges and overlapping passes of the same or different satellites.
+
+ Detections are duplicates if they are within a distance (and optionally a time window) of each
+ other, and duplicate groups are the connected components of that relation. Candidate pairs are
+ found with a spatial hash of the detections' positions on the unit sphere (so that the dateline
+ and poles need no special treatment), with cells the size of the distance threshold, so only
+ detections in neighbouring cells are compared. The groups are then found with a vectorized
+ union-find (label propagation with pointer jumping).
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import logging
+from itertools import product
+
+import numpy as np
+from netCDF4 import Dataset
+
+from fire_store import fire_store_columns, query_fire_store, TIME_UNITS
+
+LOG = logging.getLogger('fire_dedup')
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def cartesian(latitude, longitude):
+    '''
+    Return the positions of the detections in km on a spherical Earth.
+    '''
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return EARTH_RADIUS_KM * np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)),
+                                      axis=1)
+
+
+def expand_ranges(starts, counts):
+    '''
+    Expand ranges of positions, given their starts and lengths, into the index of the range and
+    the position of each element.
+    '''
+    ranges = np.repeat(np.arange(counts.size), counts)
+    offsets = np.arange(ranges.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return ranges, starts[ranges] + offsets
+
+
+def candidate_pairs(coords, cell_sizes):
+    '''
+    Return the index pairs of the points in the same or adjacent cells of a hash grid with the
+    given cell size along each axis. Each unordered pair is returned once.
+    '''
+    cells = np.floor(coords / cell_sizes).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    spans = cells.max(axis=0) + 2
+    if np.sum(np.log2(spans.astype(np.float64))) >= 62:
+        raise ValueError("The duplicate search grid is too fine for the extent of the detections")
+
+    # Mixed radix cell keys, the points sorted by key, and the occupied cells
+    radix = np.cumprod(np.concatenate(([1], spans[::-1][:-1])))[::-1]
+    keys = cells @ radix
+    order = np.argsort(keys, kind='stable')
+    cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True,
+                                                    return_counts=True)
+
+    # Pairs within a cell, and with the neighbouring cells at a positive offset (pairs with the
+    # cells at negative offsets are found from the other cell).
+    first = []
+    second = []
+    for offset in product([-1, 0, 1], repeat=coords.shape[1]):
+        if offset < (0,) * len(offset):
+            continue
+        neighbour_keys = cell_keys + np.dot(offset, radix)
+        neighbours = np.minimum(np.searchsorted(cell_keys, neighbour_keys), cell_keys.size - 1)
+        found = np.nonzero(cell_keys[neighbours] == neighbour_keys)[0]
+        neighbours = neighbours[found]
+
+        # Every point of each cell, paired with every point of its neighbour cell
+        cell_pairs, positions = expand_ranges(cell_starts[found], cell_counts[found])
+        point_pairs, neighbour_positions = expand_ranges(cell_starts[neighbours][cell_pairs],
+                                                         cell_counts[neighbours][cell_pairs])
+        idx = order[positions[point_pairs]]
+        neighbour_idx = order[neighbour_positions]
+        if not any(offset):
+            keep = idx < neighbour_idx
+            idx, neighbour_idx = idx[keep], neighbour_idx[keep]
+        first.append(idx)
+        second.append(neighbour_idx)
+
+    return np.concatenate(first), np.concatenate(second)
+
+
+def connected_components(num_points, first, second):
+    '''
+    Return a component label for each point, given the pairs of connected points. The label is
+    the smallest point index in the component.
+    '''
+    labels = np.arange(num_points)
+    while True:
+        min_labels = np.minimum(labels[first], labels[second])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, first, min_labels)
+        np.minimum.at(new_labels, second, min_labels)
+
+        # Pointer jumping, so that each label is the root of its tree
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def find_duplicates(latitude, longitude, times=None, distance_km=1., time_window=None):
+    '''
+    Return a duplicate group label for each detection. Detections are linked if they are within
+    distance_km of each other, and (if both times and time_window are given) within time_window
+    seconds.
+    '''
+    num_fires = len(latitude)
+    if num_fires == 0:
+        return np.array([], dtype=np.int64)
+
+    coords = cartesian(latitude, longitude)
+    cell_sizes = [distance_km] * 3
+    if times is not None and time_window is not None:
+        times = np.asarray(times, dtype=np.float64)
+        coords = np.column_stack((coords, times - times.min()))
+        cell_sizes.append(time_window)
+
+    first, second = candidate_pairs(coords, np.array(cell_sizes, dtype=np.float64))
+
+    # Keep the candidates within the distance (chord distance is within a few cm of the great
+    # circle distance at these scales), and time window.
+    chord = np.sqrt(np.sum((coords[first, :3] - coords[second, :3]) ** 2, axis=1))
+    keep = chord <= distance_km
+    if coords.shape[1] == 4:
+        keep &= np.abs(coords[first, 3] - coords[second, 3]) <= time_window
+    first, second = first[keep], second[keep]
+
+    LOG.debug("Found {} duplicate pairs among {} detections".format(first.size, num_fires))
+
+    return connected_components(num_fires, first, second)
+
+
+def merge_duplicates(fires, labels):
+    '''
+    Merge the detections of each duplicate group. The fires dictionary holds the fire store
+    columns, "time" and "granule_id". The merged detection has the mean position of the group, the
+    maximum brightness temperature, confidence and power, and its provenance: the number of
+    detections, the first and last times, and the granules they came from. Returns a dictionary
+    of the merged columns.
+    '''
+    groups, group_idx, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    num_groups = groups.size
+
+    # Average the positions on the sphere, so that groups straddling the dateline are handled.
+    coords = cartesian(fires['latitude'], fires['longitude'])
+    mean_coords = np.stack([np.bincount(group_idx, weights=coords[:, axis], minlength=num_groups)
+                            for axis in range(3)], axis=1)
+    merged = {
+        'latitude': np.degrees(np.arctan2(mean_coords[:, 2],
+                                          np.hypot(mean_coords[:, 0], mean_coords[:, 1]))),
+        'longitude': np.degrees(np.arctan2(mean_coords[:, 1], mean_coords[:, 0])),
+    }
+
+    def group_reduce(values, ufunc, initial):
+        result = np.full(num_groups, initial, dtype=np.asarray(values).dtype)
+        ufunc.at(result, group_idx, values)
+        return result
+
+    for var_name in ['brightness_temperature', 'confidence', 'power']:
+        values = np.asarray(fires[var_name])
+        initial = np.iinfo(values.dtype).min if values.dtype.kind in 'iu' else -np.inf
+        merged[var_name] = group_reduce(values, np.maximum, initial)
+
+    merged['first_time'] = group_reduce(np.asarray(fires['time'], dtype=np.float64),
+                                        np.minimum, np.inf)
+    merged['last_time'] = group_reduce(np.asarray(fires['time'], dtype=np.float64),
+                                       np.maximum, -np.inf)
+    merged['member_count'] = counts.astype(np.int32)
+
+    # The granules contributing to each group. Most groups have a single granule, so only the
+    # others are joined one at a time.
+    granule_names, granule_idx = np.unique(np.asarray(fires['granule_id'], dtype=str),
+                                           return_inverse=True)
+    pairs = np.unique(group_idx.astype(np.int64) * granule_names.size + granule_idx)
+    pair_groups, pair_granules = np.divmod(pairs, granule_names.size)
+    granule_counts = np.bincount(pair_groups, minlength=num_groups)
+    granule_ids = granule_names.astype(object)[pair_granules[np.cumsum(granule_counts) - 1]]
+    pair_starts = np.cumsum(granule_counts) - granule_counts
+    for group in np.nonzero(granule_counts > 1)[0]:
+        granule_ids[group] = ','.join(granule_names[pair_granules[
+            pair_starts[group]:pair_starts[group] + granule_counts[group]]])
+    merged['granule_ids'] = granule_ids
+
+    return merged
+
+
+def write_merged_fires(dedup_file, merged, distance_km, time_window):
+    '''
+    Write the merged detections and their provenance to a NetCDF4 file.
+    '''
+    file_obj = Dataset(dedup_file, 'w', format='NETCDF4')
+    try:
+        file_obj.createDimension('fire', merged['latitude'].size)
+        var_types = dict([(column[0], column[1]) for column in fire_store_columns])
+        var_types.update({'first_time': 'f8', 'last_time': 'f8', 'member_count': 'i4'})
+        for var_name, var_type in var_types.items():
+            file_obj.createVariable(var_name, var_type, ('fire',), zlib=True,
+                                    complevel=1)[:] = merged[var_name]
+        file_obj['first_time'].units = TIME_UNITS
+        file_obj['last_time'].units = TIME_UNITS
+        file_obj.createVariable('granule_ids', str, ('fire',))[:] = merged['granule_ids']
+
+        file_obj.dedup_distance_km = distance_km
+        if time_window is not None:
+            file_obj.dedup_time_window_seconds = time_window
+    finally:
+        file_obj.close()
+
+
+def dedup_fire_store(store_file, dedup_file, distance_km=1., time_window=None):
+    '''
+    Merge the duplicate detections in a consolidated fire store, and write them to dedup_file.
+    Returns the number of detections, and of merged detections.
+    '''
+    fires = query_fire_store(store_file)
+    labels = find_duplicates(fires['latitude'], fires['longitude'], fires['time'],
+                             distance_km=distance_km, time_window=time_window)
+    merged = merge_duplicates(fires, labels)
+
+    LOG.info("Writing {} merged detections of {} fire pixels to {}".format(
+        merged['latitude'].size, labels.size, dedup_file))
+    write_merged_fires(dedup_file, merged, distance_km, time_window)
+
+    return labels.size, merged['latitude'].size
+
+
+def fire_dedup_filename(store_file):
+    '''
+    Return the filename of the merged detections of a consolidated fire store.
+    '''
+    return store_file.replace('_fire_store_', '_fire_dedup_')
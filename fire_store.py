@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+fire_store.py
+
+ * DESCRIPTION: A consolidated store of the fire pixels of every granule in a run, so that they
+ can be mapped and queried without reopening (or re-parsing the text files of) each granule
+ output.
+
+ The store is a NetCDF4 file with an unlimited "fire" dimension, to which the fire pixel columns
+ of each granule are appended as it completes. When the store is closed, a 1 degree lat/lon grid
+ bucket index is written, holding the fire rows sorted by bucket and the offset of each bucket in
+ that list, so that a bounding box query only reads the rows in the buckets it intersects. Rows
+ appended after the index was written are scanned by the queries.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import logging
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+LOG = logging.getLogger('fire_store')
+
+# The fire pixel columns: the store variable name, the type, and the granule dataset names in the
+# I-band and M-band outputs.
+fire_store_columns = [
+    ('latitude', 'f4', 'FP_latitude', 'FP_latitude'),
+    ('longitude', 'f4', 'FP_longitude', 'FP_longitude'),
+    ('brightness_temperature', 'f4', 'FP_T4', 'FP_T13'),
+    ('confidence', 'i2', 'FP_confidence', 'FP_confidence'),
+    ('power', 'f4', 'FP_power', 'FP_power'),
+]
+
+# The grid bucket index
+BUCKET_SIZE = 1.
+BUCKET_ROWS = int(180. / BUCKET_SIZE)
+BUCKET_COLS = int(360. / BUCKET_SIZE)
+
+EPOCH = datetime(1970, 1, 1)
+TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+
+
+def fire_buckets(latitude, longitude):
+    '''
+    Return the grid bucket of each fire pixel.
+    '''
+    rows = np.clip(np.floor((np.asarray(latitude, dtype=np.float64) + 90.) / BUCKET_SIZE),
+                   0, BUCKET_ROWS - 1).astype(np.int32)
+    cols = np.floor((np.asarray(longitude, dtype=np.float64) + 180.) / BUCKET_SIZE)
+    cols = np.mod(cols, BUCKET_COLS).astype(np.int32)
+    return rows * BUCKET_COLS + cols
+
+
+def bbox_buckets(south, north, west, east):
+    '''
+    Return the grid buckets intersecting a bounding box. Boxes crossing the dateline are given with
+    west > east.
+    '''
+    row_start, row_end = fire_buckets([south, north], [0., 0.]) // BUCKET_COLS
+    col_start, col_end = np.clip(np.floor((np.array([west, east]) + 180.) / BUCKET_SIZE),
+                                 0, BUCKET_COLS - 1).astype(np.int32)
+    if west > east:
+        cols = np.concatenate((np.arange(col_start, BUCKET_COLS), np.arange(0, col_end + 1)))
+    else:
+        cols = np.arange(col_start, col_end + 1)
+    rows = np.arange(row_start, row_end + 1)
+    return (rows[:, np.newaxis] * BUCKET_COLS + cols[np.newaxis, :]).ravel()
+
+
+def in_bbox(latitude, longitude, south, north, west, east):
+    '''
+    Return a mask of the fire pixels inside a bounding box.
+    '''
+    mask = (latitude >= south) & (latitude <= north)
+    if west > east:
+        return mask & ((longitude >= west) | (longitude <= east))
+    return mask & (longitude >= west) & (longitude <= east)
+
+
+class FireStore():
+    '''
+    A consolidated fire pixel store for a run, to which each granule's fire pixels are appended.
+    This class is not thread-safe, the caller must serialize access.
+    '''
+
+    def __init__(self, store_file, i_band):
+        self.store_file = store_file
+        self.i_band = i_band
+
+        LOG.info("Creating the consolidated fire store {}".format(store_file))
+        self.file_obj = Dataset(store_file, 'w', format='NETCDF4')
+        self.file_obj.createDimension('fire', None)
+        self.file_obj.createDimension('granule', None)
+
+        for var_name, var_type, i_dset, m_dset in fire_store_columns:
+            var_obj = self.file_obj.createVariable(var_name, var_type, ('fire',), zlib=True,
+                                                   complevel=1, chunksizes=(16384,))
+            var_obj.source_dataset = i_dset if i_band else m_dset
+
+        var_obj = self.file_obj.createVariable('time', 'f8', ('fire',), zlib=True, complevel=1,
+                                               chunksizes=(16384,))
+        var_obj.units = TIME_UNITS
+        var_obj.long_name = 'granule start time of the fire pixel'
+        self.file_obj.createVariable('granule', 'i4', ('fire',), zlib=True, complevel=1,
+                                     chunksizes=(16384,))
+        self.file_obj.createVariable('granule_id', str, ('granule',))
+        var_obj = self.file_obj.createVariable('granule_time', 'f8', ('granule',))
+        var_obj.units = TIME_UNITS
+
+        self.file_obj.band = 'I' if i_band else 'M'
+        self.file_obj.bucket_size = BUCKET_SIZE
+        self.file_obj.indexed_fires = np.int64(0)
+
+        self.nfire = 0
+        self.ngranule = 0
+
+    def append(self, granule_id, granule_dt, fire_data):
+        '''
+        Append the fire pixel columns of a granule (latitude, longitude, brightness temperature,
+        confidence and power) to the store.
+        '''
+        nfire = len(fire_data[0])
+        granule_time = (granule_dt - EPOCH).total_seconds()
+
+        self.file_obj['granule_id'][self.ngranule] = granule_id
+        self.file_obj['granule_time'][self.ngranule] = granule_time
+
+        if nfire > 0:
+            fire_slice = slice(self.nfire, self.nfire + nfire)
+            for (var_name, var_type, i_dset, m_dset), column in zip(fire_store_columns,
+                                                                      fire_data):
+                self.file_obj[var_name][fire_slice] = np.ma.getdata(column).astype(var_type)
+            self.file_obj['time'][fire_slice] = np.full(nfire, granule_time)
+            self.file_obj['granule'][fire_slice] = np.full(nfire, self.ngranule, dtype=np.int32)
+
+        self.nfire += nfire
+        self.ngranule += 1
+        self.file_obj.sync()
+
+        LOG.debug("Appended {} fire pixels of granule {} to {}".format(nfire, granule_id,
+                                                                       self.store_file))
+
+    def close(self):
+        '''
+        Write the grid bucket index, and close the store.
+        '''
+        if 'fire_index' in self.file_obj.dimensions:
+            raise ValueError("The fire store {} is already indexed".format(self.store_file))
+
+        latitude = self.file_obj['latitude'][:self.nfire]
+        longitude = self.file_obj['longitude'][:self.nfire]
+        buckets = fire_buckets(np.ma.getdata(latitude), np.ma.getdata(longitude))
+
+        # The fire rows sorted by bucket, and the offset of each bucket's rows in that list
+        index_rows = np.argsort(buckets, kind='stable').astype(np.int64)
+        bucket_offsets = np.searchsorted(buckets[index_rows],
+                                         np.arange(BUCKET_ROWS * BUCKET_COLS + 1))
+
+        self.file_obj.createDimension('fire_index', self.nfire)
+        self.file_obj.createDimension('bucket_offset', BUCKET_ROWS * BUCKET_COLS + 1)
+        self.file_obj.createVariable('index_rows', 'i8', ('fire_index',), zlib=True,
+                                     complevel=1)[:] = index_rows
+        self.file_obj.createVariable('bucket_offsets', 'i8', ('bucket_offset',), zlib=True,
+                                     complevel=1)[:] = bucket_offsets
+        self.file_obj.indexed_fires = np.int64(self.nfire)
+
+        self.file_obj.close()
+        LOG.info("Closed the fire store {} with {} fire pixels from {} granules".format(
+            self.store_file, self.nfire, self.ngranule))
+
+
+def query_fire_store(store_file, south=-90., north=90., west=-180., east=180., start_dt=None,
+                     end_dt=None):
+    '''
+    Return the fire pixels of a store inside a bounding box and time window, as a dictionary of
+    column arrays (including "time" and "granule_id"). Boxes crossing the dateline are given with
+    west > east.
+    '''
+    file_obj = Dataset(store_file, 'r')
+    file_obj.set_auto_mask(False)
+    try:
+        nfire = len(file_obj.dimensions['fire'])
+        indexed_fires = int(file_obj.indexed_fires) if 'index_rows' in file_obj.variables else 0
+
+        # Candidate rows from the index, plus any rows appended since it was written
+        rows = [np.arange(indexed_fires, nfire)]
+        if indexed_fires > 0:
+            bucket_offsets = file_obj['bucket_offsets'][:]
+            buckets = bbox_buckets(south, north, west, east)
+            starts, ends = bucket_offsets[buckets], bucket_offsets[buckets + 1]
+            index_rows = file_obj['index_rows']
+            for start, end in zip(starts[ends > starts], ends[ends > starts]):
+                rows.append(index_rows[start:end])
+        rows = np.unique(np.concatenate(rows))
+
+        columns = [column[0] for column in fire_store_columns] + ['time', 'granule']
+        result = {}
+        if rows.size > 0:
+            # Read the smallest contiguous block holding the candidates, then pick them out.
+            block = slice(rows[0], rows[-1] + 1)
+            for var_name in columns:
+                result[var_name] = file_obj[var_name][block][rows - rows[0]]
+        else:
+            for var_name in columns:
+                result[var_name] = np.array([], dtype=file_obj[var_name].dtype)
+
+        mask = in_bbox(result['latitude'], result['longitude'], south, north, west, east)
+        if start_dt is not None:
+            mask &= result['time'] >= (start_dt - EPOCH).total_seconds()
+        if end_dt is not None:
+            mask &= result['time'] <= (end_dt - EPOCH).total_seconds()
+
+        result = {var_name: values[mask] for var_name, values in result.items()}
+        granule_ids = np.array(file_obj['granule_id'][:], dtype=object)
+        result['granule_id'] = granule_ids[result['granule']]
+    finally:
+        file_obj.close()
+
+    return result
+
+
+def fire_store_filename(work_dir, i_band, run_dt):
+    '''
+    Return the filename of the consolidated fire store of a run.
+    '''
+    return os.path.join(work_dir, '{}_fire_store_{}.nc'.format(
+        'AFIMG' if i_band else 'AFMOD', run_dt.strftime('%Y%m%d%H%M%S')))
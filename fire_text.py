@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+fire_text.py
+
+ * DESCRIPTION: Routines to write the fire pixels of an Active Fires granule to the text file
+ which accompanies the NetCDF4 output. The fire pixel columns are formatted in blocks of rows,
+ rather than one row at a time, and the file is written with a single write.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import logging
+from itertools import repeat
+
+import numpy as np
+
+LOG = logging.getLogger('fire_text')
+
+# The format of a single fire pixel row: latitude, longitude, brightness temperature, along-scan
+# and along-track pixel resolution, confidence, and fire radiative power.
+FIRE_ROW_FORMAT = '%13.8f, %13.8f, %13.8f, %6.3f, %6.3f, %4d, %13.8f\n'
+FIRE_ROW_COLUMNS = 7
+
+# The number of rows formatted with each (repeated) format string
+FIRE_BLOCK_ROWS = 1024
+
+# The band-specific parts of the text file header
+fire_text_bands = {
+    'I': {'name': 'I-band', 'channel': 'I04', 'pixel_res': [0.375, 0.375],
+          'confidence': 'detection confidence ([7,8,9]->[lo,med,hi])'},
+    'M': {'name': 'M-band', 'channel': 'M13', 'pixel_res': [0.75, 0.75],
+          'confidence': 'detection confidence (%)'},
+}
+
+
+def fire_text_header(band, source, history, nfire):
+    '''
+    Return the header of the fire pixel text file, for the "I" or "M" band.
+    '''
+    band_dict = fire_text_bands[band]
+    return \
+        '''# Active Fires {} EDR\n''' \
+        '''#\n''' \
+        '''# source: {}\n''' \
+        '''# version: {}\n''' \
+        '''#\n''' \
+        '''# column 1: latitude of fire pixel (degrees)\n''' \
+        '''# column 2: longitude of fire pixel (degrees)\n''' \
+        '''# column 3: {} brightness temperature of fire pixel (K)\n''' \
+        '''# column 4: Along-scan fire pixel resolution (km)\n''' \
+        '''# column 5: Along-track fire pixel resolution (km)\n''' \
+        '''# column 6: {}\n''' \
+        '''# column 7: fire radiative power (MW)\n''' \
+        '''#\n# number of fire pixels: {}\n''' \
+        '''#'''.format(band_dict['name'], source, history, band_dict['channel'],
+                       band_dict['confidence'], nfire)
+
+
+def format_fire_rows(fire_data, pixel_res):
+    '''
+    Format the fire pixel rows. The fire_data list holds the latitude, longitude, brightness
+    temperature, confidence and fire radiative power arrays, and pixel_res the along-scan and
+    along-track pixel resolution. The columns are converted to Python scalars in bulk, and each
+    block of rows is formatted with a single string formatting operation.
+    '''
+    latitude, longitude, temperature, confidence, power = \
+        [np.ma.getdata(column).ravel().tolist() for column in fire_data]
+    nrows = len(latitude)
+
+    # Interleave the columns into a single flat sequence of row values
+    row_values = [value for row in zip(latitude, longitude, temperature,
+                                       repeat(pixel_res[0], nrows), repeat(pixel_res[1], nrows),
+                                       confidence, power)
+                  for value in row]
+
+    block_format = FIRE_ROW_FORMAT * FIRE_BLOCK_ROWS
+    block_size = FIRE_ROW_COLUMNS * FIRE_BLOCK_ROWS
+    blocks = []
+    for start in range(0, len(row_values) - block_size + 1, block_size):
+        blocks.append(block_format % tuple(row_values[start:start + block_size]))
+
+    remainder = nrows % FIRE_BLOCK_ROWS
+    if remainder:
+        blocks.append((FIRE_ROW_FORMAT * remainder) %
+                      tuple(row_values[len(row_values) - FIRE_ROW_COLUMNS * remainder:]))
+
+    return ''.join(blocks)
+
+
+def write_fire_text(output_txt_file, band, source, history, nfire, fire_data):
+    '''
+    Write the fire pixel text file for the "I" or "M" band with a single write. The file must not
+    already exist.
+    '''
+    txt_file_header = fire_text_header(band, source, history, nfire)
+    body = format_fire_rows(fire_data, fire_text_bands[band]['pixel_res'])
+
+    LOG.info("\tWriting output text file {}".format(output_txt_file))
+    with open(output_txt_file, 'x') as txt_file_obj:
+        txt_file_obj.write(txt_file_header + "\n" + body)
@@ -11,15 +11,30 @@ Licensed under GNU GPLv3.
 """
 
 import sys
+import atexit
+import functools
 import logging
-from cffi import FFI
+import threading
+from contextlib import contextmanager
 
-ffi = FFI()
+# The cffi FFI of the C logging callbacks, which is only created (and cffi imported) by
+# C_log_support().
+ffi = None
 
 LOG = logging.getLogger(__name__)
 
 logging_configured = False
 
+# The queue of the log records of this process and its forked pool workers, and the listener
+# thread in the parent which passes them to the stream and file handlers.
+_log_queue = None
+_log_listener = None
+_log_handler = None
+_log_formatter = None
+
+# The events set by the listener thread when it reaches the marker record of each flush
+_flush_events = {}
+
 
 class SingleLevelFilter(logging.Filter):
     '''
@@ -36,12 +51,17 @@ class SingleLevelFilter(logging.Filter):
             return (record.levelno in self.passlevels)
 
 
-def configure_logging(level=logging.WARNING, FILE=None):
+def configure_logging(level=logging.WARNING, FILE=None, queued=False):
     """
-    route logging INFO and DEBUG to stdout instead of stderr, affects entire application
+    route logging INFO and DEBUG to stdout instead of stderr, affects entire application. If
+    queued, the handlers are driven by a listener thread (see start_log_listener()).
     """
 
     global logging_configured
+    global _log_formatter
+
+    # Restore the handlers to the root logger, so that any new ones are added alongside them
+    stop_log_listener()
     # create a formatter to be used across everything
     #fm = logging.Formatter('%(levelname)s:%(name)s:%(msg)s') # [%(filename)s:%(lineno)d]')
 
@@ -89,6 +109,164 @@ def configure_logging(level=logging.WARNING, FILE=None):
         rootLogger.addHandler(h3)
 
     rootLogger.setLevel(level)
+    _log_formatter = fm
+
+    if queued:
+        start_log_listener()
+
+
+def start_log_listener():
+    '''
+    Move the handlers of the root logger to a QueueListener thread, replacing them with a
+    QueueHandler. Pool workers forked after this inherit the QueueHandler, so every process only
+    puts its records on the queue (which doesn't block), and the formatting and writing of the
+    stream and log file is done by the single listener thread of the parent.
+    '''
+    global _log_queue
+    global _log_listener
+    global _log_handler
+    import multiprocessing
+    from logging.handlers import QueueHandler, QueueListener
+
+    rootLogger = logging.getLogger()
+    handlers = list(rootLogger.handlers)
+    for handler in handlers:
+        rootLogger.removeHandler(handler)
+
+    class FlushingQueueListener(QueueListener):
+        '''
+        A QueueListener which signals the marker records of flush_log_queue(), rather than
+        handling them.
+        '''
+        def handle(self, record):
+            flush_event = _flush_events.get(getattr(record, 'flush_id', None))
+            if flush_event is not None:
+                flush_event.set()
+            else:
+                QueueListener.handle(self, record)
+
+    _log_queue = multiprocessing.Queue(-1)
+    _log_listener = FlushingQueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    _log_handler = QueueHandler(_log_queue)
+    rootLogger.addHandler(_log_handler)
+
+
+def stop_log_listener():
+    '''
+    Write any queued log records, stop the listener thread, and return its handlers to the root
+    logger.
+    '''
+    global _log_queue
+    global _log_listener
+    global _log_handler
+
+    if _log_listener is None:
+        return
+
+    rootLogger = logging.getLogger()
+    rootLogger.removeHandler(_log_handler)
+    _log_handler = None
+
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        rootLogger.addHandler(handler)
+
+    _log_queue.close()
+    _log_queue.join_thread()
+    _log_queue = None
+    _log_listener = None
+
+
+atexit.register(stop_log_listener)
+
+
+def add_log_handler(handler, level=logging.NOTSET):
+    '''
+    Add a handler, with the formatting of the other handlers, to the root logger, or to the
+    listener thread if the logging is queued. Since the queue is not replaced, this also gets the
+    records of the pool workers which are already running.
+    '''
+    if _log_formatter is not None:
+        handler.setFormatter(_log_formatter)
+    handler.setLevel(level)
+    if _log_listener is None:
+        logging.getLogger().addHandler(handler)
+    else:
+        _log_listener.handlers = _log_listener.handlers + (handler,)
+
+
+def remove_log_handler(handler):
+    '''
+    Remove a handler added by add_log_handler(), and close it.
+    '''
+    if _log_listener is None:
+        logging.getLogger().removeHandler(handler)
+    else:
+        # Wait for the records already queued, so that none are lost to this handler.
+        flush_log_queue()
+        _log_listener.handlers = tuple([other for other in _log_listener.handlers
+                                        if other is not handler])
+    handler.close()
+
+
+def flush_log_queue(timeout=5.):
+    '''
+    Wait until the listener thread has handled every record put on the queue by this process so
+    far, by queueing a marker record and waiting for the listener to reach it.
+    '''
+    if _log_listener is None:
+        return
+    flush_event = threading.Event()
+    _flush_events[id(flush_event)] = flush_event
+    marker = logging.LogRecord('log_common', logging.DEBUG, __file__, 0, 'flush', None, None)
+    marker.flush_id = id(flush_event)
+    _log_queue.put_nowait(marker)
+    flush_event.wait(timeout)
+    _flush_events.pop(id(flush_event), None)
+
+
+@contextmanager
+def task_log(log_file):
+    '''
+    Write the log records of the enclosed block to their own file, only passing warnings and
+    errors to the other handlers. This changes the handlers of the whole process, so is only for
+    the tasks of the pool worker processes, which run one at a time.
+    '''
+    rootLogger = logging.getLogger()
+    handler_levels = [(handler, handler.level) for handler in rootLogger.handlers]
+
+    task_handler = logging.FileHandler(filename=log_file)
+    if _log_formatter is not None:
+        task_handler.setFormatter(_log_formatter)
+    for handler, handler_level in handler_levels:
+        handler.setLevel(max(handler_level, logging.WARNING))
+    rootLogger.addHandler(task_handler)
+
+    try:
+        yield
+    finally:
+        rootLogger.removeHandler(task_handler)
+        task_handler.close()
+        for handler, handler_level in handler_levels:
+            handler.setLevel(handler_level)
+
+
+def log_calls(task_log_file):
+    '''
+    Decorate a function so that each call is logged to its own file. task_log_file is called with
+    the arguments of the function, and returns the log file of the call, or None to log as usual.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            log_file = task_log_file(*args, **kwargs)
+            if log_file is None:
+                return func(*args, **kwargs)
+            with task_log(log_file):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 
 def status_line(status):
@@ -120,7 +298,7 @@ log_callback = None
 log_lib = None
 
 
-def C_log_support(ffi_in):
+def C_log_support(ffi_in=None):
     """
     Initalizer for C callbacks
     """
@@ -129,6 +307,10 @@ def C_log_support(ffi_in):
     global log_callback
     global log_lib
 
+    if ffi_in is None:
+        from cffi import FFI
+        ffi_in = FFI()
+
     ffi = ffi_in
     ffi.cdef("""
     void log_from_C(char * type, char * message );
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+metrics.py
+
+ * DESCRIPTION: Prometheus-compatible metrics of the processing, for the monitoring of long running
+ deployments: the granules processed and failed, the latency of each processing stage, the LWM
+ cache hits and misses, the nagg runs, the dispatch queue depth and active workers, and the fire
+ pixels found. The metrics are kept in the parent process, from the timing records of each task
+ and the granule outcomes of each run, and are exported in the Prometheus text exposition format,
+ either as a node-exporter textfile (written atomically, and updated during the run), or from a
+ small HTTP endpoint on the local host.
+
+ Since each run is usually a separate process, the counters and histograms are seeded from any
+ existing metrics textfile, so that they keep accumulating across runs.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import re
+import logging
+import tempfile
+import threading
+import time
+
+LOG = logging.getLogger('metrics')
+
+# The upper bounds of the stage latency histogram buckets (seconds)
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120., 300., 600.]
+
+# The minimum time between updates of the metrics textfile during a run (seconds)
+WRITE_INTERVAL = 15.
+
+# The metrics of this run, which are only kept in the parent process.
+_metrics = None
+
+# Matches a sample of the text exposition format: the name, the labels and the value.
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)\s*$')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+METRIC_DEFS = [
+    ('cspp_afire_runs_total', 'counter', 'The runs of CSPP Active Fires, by result.'),
+    ('cspp_afire_granules_total', 'counter',
+     'The granules attempted, and those which succeeded, crashed or had a problem.'),
+    ('cspp_afire_stage_duration_seconds', 'histogram',
+     'The wall time of each processing stage of a task.'),
+    ('cspp_afire_lwm_cache_requests_total', 'counter',
+     'The LWM cache lookups, by result: a hit, the reuse of a previous repeat cycle, a miss '
+     'which was granulated, or a failure.'),
+    ('cspp_afire_nagg_files_total', 'counter', 'The aggregated files run through nagg, by result.'),
+    ('cspp_afire_fire_pixels_total', 'counter', 'The fire pixels found in the granules.'),
+    ('cspp_afire_queue_depth', 'gauge', 'The granules waiting for a pool worker.'),
+    ('cspp_afire_active_workers', 'gauge', 'The pool workers processing a granule.'),
+    ('cspp_afire_last_run_timestamp_seconds', 'gauge', 'The end time of the last run.'),
+    ('cspp_afire_last_run_duration_seconds', 'gauge', 'The wall time of the last run.'),
+]
+
+
+def format_labels(labels):
+    '''
+    Return the label set of a sample, for the text exposition format.
+    '''
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(['{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                                                        .replace('"', '\\"')
+                                                        .replace('\n', '\\n'))
+                                     for key, value in labels]))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics():
+    '''
+    The counters, gauges and histograms of the processing, with the text exposition of their
+    current values. Each sample is keyed by the metric name and a sorted tuple of its labels.
+    Metrics may be updated from any thread.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {name: (kind, help_str) for name, kind, help_str in METRIC_DEFS}
+        self.values = {name: {} for name, kind, help_str in METRIC_DEFS}
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            key = tuple(sorted(labels.items()))
+            self.values[name][key] = self.values[name].get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        '''
+        Add an observation to a histogram, whose value for each label set is the list of the
+        bucket counts (not cumulative), the sum and the count of the observations.
+        '''
+        with self.lock:
+            key = tuple(sorted(labels.items()))
+            buckets, total, count = self.values[name].get(
+                key, ([0] * (len(LATENCY_BUCKETS) + 1), 0., 0))
+            buckets = list(buckets)
+            buckets[len([bound for bound in LATENCY_BUCKETS if value > bound])] += 1
+            self.values[name][key] = (buckets, total + value, count + 1)
+
+    def render(self):
+        '''
+        Return the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self.lock:
+            for name, kind, help_str in METRIC_DEFS:
+                lines.append('# HELP {} {}'.format(name, help_str))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for key, value in sorted(self.values[name].items()):
+                    if kind != 'histogram':
+                        lines.append('{}{} {}'.format(name, format_labels(key),
+                                                      format_value(value)))
+                        continue
+                    buckets, total, count = value
+                    cumulative = 0
+                    for bound, bucket in zip(LATENCY_BUCKETS + [float('inf')], buckets):
+                        cumulative += bucket
+                        lines.append('{}_bucket{} {}'.format(
+                            name, format_labels(key + (('le', format_value(bound)),)),
+                            cumulative))
+                    lines.append('{}_sum{} {}'.format(name, format_labels(key), repr(total)))
+                    lines.append('{}_count{} {}'.format(name, format_labels(key), count))
+        return '\n'.join(lines) + '\n'
+
+    def load(self, metrics_file):
+        '''
+        Seed the counters and histograms from a metrics textfile written by a previous run. The
+        gauges describe the state of that run, so they are not kept.
+        '''
+        histograms = {}
+        with open(metrics_file, 'r') as file_obj:
+            for line in file_obj:
+                match = SAMPLE_RE.match(line)
+                if line.startswith('#') or match is None:
+                    continue
+                name, labels, value = match.groups()
+                labels = LABEL_RE.findall(labels or '')
+                if name in self.values and self.types[name][0] == 'counter':
+                    self.values[name][tuple(sorted(labels))] = float(value)
+                    continue
+
+                # The samples of a histogram
+                for suffix in ['_bucket', '_sum', '_count']:
+                    base = name[:-len(suffix)]
+                    if name.endswith(suffix) and self.types.get(base, ('',))[0] == 'histogram':
+                        le = dict(labels).get('le')
+                        key = tuple(sorted([label for label in labels if label[0] != 'le']))
+                        histogram = histograms.setdefault((base, key), {'buckets': {}})
+                        if suffix == '_bucket':
+                            histogram['buckets'][le] = float(value)
+                        else:
+                            histogram[suffix] = float(value)
+
+        # Convert the cumulative bucket counts, which must have the same bounds as ours
+        bounds = [format_value(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        for (name, key), histogram in histograms.items():
+            if sorted(histogram['buckets'].keys()) != sorted(bounds):
+                LOG.debug("Discarding the histogram {}{} with different buckets".format(
+                    name, format_labels(key)))
+                continue
+            cumulative = [histogram['buckets'][bound] for bound in bounds]
+            buckets = [int(count - previous) for count, previous in
+                       zip(cumulative, [0.] + cumulative[:-1])]
+            self.values[name][key] = (buckets, histogram.get('_sum', 0.),
+                                      int(histogram.get('_count', 0)))
+
+
+class MetricsExporter():
+    '''
+    Exports the metrics of this run to a node-exporter textfile and/or a local HTTP endpoint.
+    '''
+
+    def __init__(self, metrics_file=None, metrics_port=None, lwm_batched=False):
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.lwm_batched = lwm_batched
+        self.last_write = 0.
+        self.server = None
+
+        if metrics_file is not None and os.path.exists(metrics_file):
+            try:
+                self.metrics.load(metrics_file)
+            except (IOError, OSError, ValueError) as err:
+                LOG.warning("Unable to read the previous metrics from {}: {}".format(
+                    metrics_file, err))
+
+        if metrics_port is not None:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self.metrics
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ['/', '/metrics']:
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    LOG.debug("Metrics request from {}: {}".format(self.address_string(),
+                                                                   format % args))
+
+            try:
+                self.server = ThreadingHTTPServer(('127.0.0.1', metrics_port), MetricsHandler)
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                LOG.info("Serving the metrics on http://127.0.0.1:{}/metrics".format(
+                    self.server.server_address[1]))
+            except (IOError, OSError) as err:
+                LOG.warning("Unable to serve the metrics on port {}: {}".format(
+                    metrics_port, err))
+                self.server = None
+
+    def write(self, force=True):
+        '''
+        Atomically replace the metrics textfile, if there is one. Unless forced, the file is only
+        written if it has not been written in the last WRITE_INTERVAL seconds.
+        '''
+        if self.metrics_file is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_write < WRITE_INTERVAL:
+            return
+        self.last_write = now
+
+        # The temporary file is in the same directory, so that it can be renamed over the target,
+        # and doesn't end in ".prom", so that the node-exporter ignores it.
+        metrics_dir = os.path.dirname(os.path.abspath(self.metrics_file))
+        try:
+            file_handle, temp_file = tempfile.mkstemp(prefix='.cspp_afire_metrics_',
+                                                      dir=metrics_dir)
+            with os.fdopen(file_handle, 'w') as file_obj:
+                file_obj.write(self.metrics.render())
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, self.metrics_file)
+        except (IOError, OSError) as err:
+            LOG.warning("Unable to write the metrics file {}: {}".format(self.metrics_file, err))
+
+    def close(self):
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def open_metrics(afire_options):
+    '''
+    Start collecting the metrics of this run, if a metrics file or port is given.
+    '''
+    global _metrics
+    if afire_options['metrics_file'] is not None or afire_options['metrics_port'] is not None:
+        from timing import add_timer_observer
+        _metrics = MetricsExporter(afire_options['metrics_file'], afire_options['metrics_port'],
+                                   afire_options['lwm_batch_size'] > 1)
+        add_timer_observer(observe_timer)
+    return _metrics
+
+
+def observe_timer(timer, kind, **fields):
+    '''
+    Add the timing record of a task to the metrics of this run, if there are any: the latency of
+    each of its stages, and the LWM cache lookups, nagg runs and fire pixels it records.
+    '''
+    if _metrics is None:
+        return
+    metrics = _metrics.metrics
+
+    for stage, total in timer.totals().items():
+        metrics.observe('cspp_afire_stage_duration_seconds', total['wall'], kind=kind,
+                        stage=stage)
+
+    # The outcome of each LWM lookup is reported by get_lwm(). The LWMs of a batched run are
+    # looked up by the batch tasks, so the Active Fires tasks find them all in the cache.
+    if kind == 'lwm_batch':
+        for cache_result in fields.get('lwm_cache', []):
+            metrics.inc('cspp_afire_lwm_cache_requests_total', result=cache_result)
+    elif kind == 'granule' and not _metrics.lwm_batched:
+        cache_result = (fields.get('lwm_rc') or {}).get('cache')
+        if cache_result is not None:
+            metrics.inc('cspp_afire_lwm_cache_requests_total', result=cache_result)
+
+    if kind == 'nagg':
+        metrics.inc('cspp_afire_nagg_files_total',
+                    result='success' if fields['rc_exe'] == 0 and fields['rc_problem'] == 0
+                    else 'failed')
+
+    if kind == 'granule':
+        metrics.inc('cspp_afire_fire_pixels_total', fields.get('nfire', 0))
+
+    _metrics.write(force=False)
+
+
+def set_dispatch_state(queued, active):
+    '''
+    Set the number of granules waiting for a pool worker, and the number of active workers.
+    '''
+    if _metrics is None:
+        return
+    _metrics.metrics.set('cspp_afire_queue_depth', queued)
+    _metrics.metrics.set('cspp_afire_active_workers', active)
+    _metrics.write(force=False)
+
+
+def count_granules(attempted_runs, successful_runs, crashed_runs, problem_runs):
+    '''
+    Count the granule outcomes of a run.
+    '''
+    if _metrics is None:
+        return
+    for result, granule_ids in [('attempted', attempted_runs), ('success', successful_runs),
+                                ('crashed', crashed_runs), ('problem', problem_runs)]:
+        _metrics.metrics.inc('cspp_afire_granules_total', len(granule_ids), result=result)
+
+
+def close_metrics(rc, wall):
+    '''
+    Record the result and wall time of the run, and write the final metrics.
+    '''
+    global _metrics
+    if _metrics is None:
+        return
+    from timing import remove_timer_observer
+    remove_timer_observer(observe_timer)
+    metrics = _metrics.metrics
+    metrics.inc('cspp_afire_runs_total', result='success' if rc == 0 else 'failed')
+    metrics.set('cspp_afire_last_run_timestamp_seconds', time.time())
+    metrics.set('cspp_afire_last_run_duration_seconds', wall)
+    metrics.set('cspp_afire_queue_depth', 0)
+    metrics.set('cspp_afire_active_workers', 0)
+    _metrics.close()
+    _metrics = None
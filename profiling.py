@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+profiling.py
+
+ * DESCRIPTION: Optional profiling of the processing of a run, with cProfile and (optionally)
+ tracemalloc. Each profiled task (the whole run in the parent, and each granule, LWM and nagg
+ task in the pool workers) writes its own profile to the "profiles" directory of the work
+ directory: a .pstats file, which can be read with pstats or snakeviz, and a text file of the
+ peak traced memory and the top allocations by line. Since each task writes its own files, this
+ works across the multiprocessing boundary.
+
+ A task run inside another profiled task of the same process and thread (such as the LWM of a
+ granule) is included in the outer task's profile, rather than profiled separately.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import cProfile
+import functools
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+LOG = logging.getLogger('profiling')
+
+PROFILE_DIR = 'profiles'
+
+# The number of frames stored for each traced allocation, and the number of top allocations
+# written for each task.
+TRACEMALLOC_FRAMES = 1
+TOP_ALLOCATIONS = 25
+
+# The (process, thread) of each profile being collected
+_active = set()
+
+
+def write_top_allocations(alloc_file, snapshot, current, peak):
+    '''
+    Write the current and peak traced memory, and the top allocations of a snapshot by line.
+    '''
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    with open(alloc_file, 'w') as file_obj:
+        file_obj.write("Traced memory: current {:.3f} MB, peak {:.3f} MB\n".format(
+            current / 1048576., peak / 1048576.))
+        file_obj.write("Top {} allocations by line:\n".format(TOP_ALLOCATIONS))
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            file_obj.write("{}\n".format(stat))
+
+
+@contextmanager
+def profiled(afire_options, stage, name):
+    '''
+    Profile the enclosed block as the task "name" of the given stage, if the "profile" or
+    "profile_memory" options are set.
+    '''
+    key = (os.getpid(), threading.get_ident())
+    use_cprofile = afire_options.get('profile', False)
+    use_tracemalloc = afire_options.get('profile_memory', False)
+    if not (use_cprofile or use_tracemalloc) or key in _active:
+        yield
+        return
+
+    _active.add(key)
+    profiler = None
+    if use_tracemalloc:
+        # Tracing may have been inherited from the parent, but each task has its own traces.
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if use_cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        _active.discard(key)
+
+        profile_dir = os.path.join(afire_options['work_dir'], PROFILE_DIR)
+        profile_prefix = os.path.join(profile_dir, '{}_{}'.format(stage, name))
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            if profiler is not None:
+                profiler.dump_stats(profile_prefix + '.pstats')
+            if use_tracemalloc:
+                write_top_allocations(profile_prefix + '.tracemalloc.txt', snapshot, current,
+                                      peak)
+            LOG.debug("Wrote the profile of {} {} to {}.*".format(stage, name, profile_prefix))
+        except (IOError, OSError) as err:
+            LOG.warning("Unable to write the profile of {} {}: {}".format(stage, name, err))
+
+
+def profile_calls(stage, task_info):
+    '''
+    Decorate a function so that each call is profiled as a task of the given stage. task_info is
+    called with the arguments of the function, and returns the options dictionary and the name
+    of the task.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            afire_options, name = task_info(*args, **kwargs)
+            with profiled(afire_options, stage, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+timing.py
+
+ * DESCRIPTION: Lightweight timing of the processing stages. A Timer collects named spans of the
+ wall-clock time, CPU time and bytes read and written by the calling thread. Timers are created in
+ the pool workers and returned with the task results, so the parent can add its own stages and
+ write a record for each granule to the run's timing report, a JSON lines file which ends with a
+ summary of the whole run.
+
+ The spans may also be written as a Chrome trace (the JSON trace event format, which can be
+ opened in Perfetto or chrome://tracing), with a track for each thread of each process, to show
+ the parallelism of the pool workers and any idle time. The monotonic clock used for the spans is
+ shared by every process, so the spans of the workers and the parent line up.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import json
+import logging
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import proc_io
+
+LOG = logging.getLogger('timing')
+
+# The timing report and trace of this run, which are only opened in the parent process.
+_report = None
+_trace = None
+
+# The functions called with each reported Timer (e.g. to add it to the metrics of this run)
+_timer_observers = []
+
+
+def thread_io():
+    '''
+    Return the bytes read and written by the calling thread, and the size of the /proc io file
+    read to find them (which is itself counted as bytes read by the next call).
+    '''
+    try:
+        with open('/proc/thread-self/io', 'rb') as file_obj:
+            contents = file_obj.read()
+    except (IOError, OSError):
+        return 0, 0, 0
+    counters = dict([line.split(b':') for line in contents.splitlines() if b':' in line])
+    return int(counters.get(b'rchar', 0)), int(counters.get(b'wchar', 0)), len(contents)
+
+
+class Timer():
+    '''
+    Collects named spans of the wall-clock time, CPU time, and bytes read and written (by any
+    means, including from the page cache) by the calling thread, with the start time, process and
+    thread of each span. The bytes read and written cost two reads of /proc, so they are only
+    counted for the spans of the main I/O stages, and are zero for the others. A Timer may be
+    pickled, so that spans recorded in a pool worker can be continued by the parent.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage, io=False):
+        '''
+        Time the enclosed block as the given stage, and count its bytes read and written if io is
+        set.
+        '''
+        start_read, start_written, proc_size = thread_io() if io else (0, 0, 0)
+        start_cpu = time.thread_time()
+        start_wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            end_read, end_written, _ = thread_io() if io else (0, 0, 0)
+            self.spans.append((stage, wall, cpu, end_read - start_read - proc_size,
+                               end_written - start_written, start_wall, os.getpid(),
+                               threading.get_ident()))
+
+    def totals(self):
+        '''
+        Return the totals of each stage, in the order the stages were first seen.
+        '''
+        totals = {}
+        for stage, wall, cpu, read, written in [span[:5] for span in self.spans]:
+            total = totals.setdefault(stage, {'count': 0, 'wall': 0., 'cpu': 0., 'read': 0,
+                                              'written': 0})
+            total['count'] += 1
+            total['wall'] += wall
+            total['cpu'] += cpu
+            total['read'] += read
+            total['written'] += written
+        return totals
+
+    def record(self, kind, **fields):
+        '''
+        Return a timing report record of the given kind, holding the stage totals and any other
+        fields.
+        '''
+        totals = self.totals()
+        record = {'record': kind, 'name': self.name}
+        record.update(fields)
+        for key in ['wall', 'cpu', 'read', 'written']:
+            record[key] = sum([total[key] for total in totals.values()])
+        record['stages'] = totals
+        return record
+
+    def log(self):
+        '''
+        Log the stage totals at debug level.
+        '''
+        for stage, total in self.totals().items():
+            LOG.debug("\t{} {}: wall {:.6f} s, cpu {:.6f} s, read {} B, written {} B".format(
+                self.name, stage, total['wall'], total['cpu'], total['read'], total['written']))
+
+
+class TimingReport():
+    '''
+    A JSON lines file of timing records, with a summary of the run written when it is closed.
+    Records may be written from any thread.
+    '''
+
+    def __init__(self, report_file):
+        self.report_file = report_file
+        self.lock = threading.Lock()
+        self.stage_totals = {}
+        self.num_records = 0
+
+        self.start_wall = time.perf_counter()
+        self.start_rusage = [resource.getrusage(who) for who in
+                             [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+        self.start_io = proc_io()
+
+        LOG.info("Writing the timing report {}".format(report_file))
+        self.file_obj = open(report_file, 'w')
+
+    def write(self, record):
+        '''
+        Write a record, and add its stage totals to those of the run.
+        '''
+        with self.lock:
+            self.file_obj.write(json.dumps(record) + '\n')
+            self.file_obj.flush()
+            self.num_records += 1
+            for stage, total in record.get('stages', {}).items():
+                run_total = self.stage_totals.setdefault(
+                    '{}.{}'.format(record['record'], stage),
+                    {'count': 0, 'wall': 0., 'cpu': 0., 'read': 0, 'written': 0})
+                for key in run_total.keys():
+                    run_total[key] += total[key]
+
+    def close(self):
+        '''
+        Write the run summary, and close the report. The CPU time includes that of the pool
+        workers and their children, which have all been reaped by now.
+        '''
+        end_rusage = [resource.getrusage(who) for who in
+                      [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+        end_io = proc_io()
+
+        cpu = {}
+        for label, start, end in zip(['self', 'children'], self.start_rusage, end_rusage):
+            cpu[label] = {'user': end.ru_utime - start.ru_utime,
+                          'system': end.ru_stime - start.ru_stime}
+
+        # The bytes read and written by every timed stage, and by the parent process as a whole
+        summary = {
+            'record': 'summary',
+            'wall': time.perf_counter() - self.start_wall,
+            'cpu': sum([sum(times.values()) for times in cpu.values()]),
+            'cpu_detail': cpu,
+            'read': sum([total['read'] for total in self.stage_totals.values()]),
+            'written': sum([total['written'] for total in self.stage_totals.values()]),
+            'parent_io': {key: end_io[key] - self.start_io.get(key, 0) for key in end_io},
+            'records': self.num_records,
+            'stages': self.stage_totals,
+        }
+
+        with self.lock:
+            self.file_obj.write(json.dumps(summary) + '\n')
+            self.file_obj.close()
+
+        LOG.info("Run wall time {:.3f} s, CPU time {:.3f} s (timing report {})".format(
+            summary['wall'], summary['cpu'], self.report_file))
+
+
+class TraceRecorder():
+    '''
+    Collects the spans of Timers as Chrome trace events, and writes them to a trace file when it
+    is closed. Spans may be added from any thread.
+    '''
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.lock = threading.Lock()
+        self.start_wall = time.perf_counter()
+        self.events = []
+        self.threads = {}
+
+    def add(self, timer, category):
+        '''
+        Add the spans of a Timer, as complete events of the given category.
+        '''
+        with self.lock:
+            for stage, wall, cpu, read, written, start, pid, thread in timer.spans:
+                tid = self.threads.setdefault((pid, thread), len(self.threads) + 1)
+                self.events.append({
+                    'name': stage, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': round((start - self.start_wall) * 1e6, 3),
+                    'dur': round(wall * 1e6, 3),
+                    'args': {'name': timer.name, 'cpu': cpu, 'read': read, 'written': written},
+                })
+
+    def close(self):
+        '''
+        Write the trace file, naming the parent and worker processes.
+        '''
+        parent_pid = os.getpid()
+        metadata = []
+        for pid in sorted(set([pid for pid, thread in self.threads.keys()])):
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                             'args': {'name': 'cspp_active_fire_noaa' if pid == parent_pid
+                                      else 'worker {}'.format(pid)}})
+        for (pid, thread), tid in self.threads.items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                             'args': {'name': 'thread {}'.format(tid)}})
+
+        with self.lock:
+            with open(self.trace_file, 'w') as file_obj:
+                json.dump({'traceEvents': metadata + sorted(self.events,
+                                                             key=lambda event: event['ts']),
+                           'displayTimeUnit': 'ms'}, file_obj)
+
+        LOG.info("Wrote {} trace events to {}".format(len(self.events), self.trace_file))
+
+
+def open_report(work_dir, run_dt):
+    '''
+    Open the timing report of this run in the work directory.
+    '''
+    global _report
+    _report = TimingReport(os.path.join(work_dir, 'cspp_afire_timing_{}.json'.format(
+        run_dt.strftime('%Y%m%d%H%M%S'))))
+    return _report
+
+
+def add_timer_observer(observer):
+    '''
+    Call observer(timer, kind, **fields) with every Timer reported by report_timer().
+    '''
+    if observer not in _timer_observers:
+        _timer_observers.append(observer)
+
+
+def remove_timer_observer(observer):
+    '''
+    Stop calling an observer added by add_timer_observer().
+    '''
+    if observer in _timer_observers:
+        _timer_observers.remove(observer)
+
+
+def report_timer(timer, kind, **fields):
+    '''
+    Write the record of a Timer to the timing report of this run, add its spans to the trace of
+    this run, and pass it to any observers (such as the metrics of this run).
+    '''
+    for observer in _timer_observers:
+        observer(timer, kind, **fields)
+    if _report is not None:
+        _report.write(timer.record(kind, **fields))
+    if _trace is not None:
+        _trace.add(timer, kind)
+
+
+def close_report():
+    '''
+    Write the run summary to the timing report of this run, if there is one, and close it.
+    '''
+    global _report
+    if _report is not None:
+        _report.close()
+        _report = None
+
+
+def open_trace(work_dir, run_dt):
+    '''
+    Start recording the Chrome trace of this run, to be written to the work directory.
+    '''
+    global _trace
+    _trace = TraceRecorder(os.path.join(work_dir, 'cspp_afire_trace_{}.json'.format(
+        run_dt.strftime('%Y%m%d%H%M%S'))))
+    return _trace
+
+
+def close_trace():
+    '''
+    Write the Chrome trace of this run, if there is one.
+    '''
+    global _trace
+    if _trace is not None:
+        _trace.close()
+        _trace = None
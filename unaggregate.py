@@ -19,6 +19,11 @@ import traceback
 from datetime import datetime
 
 from utils import create_dir, link_files, execution_time, execute_binary_captured_inject_io
+from utils import log_exe_resources, task_log_file
+from log_common import log_calls
+from timing import Timer, report_timer
+from profiling import profile_calls
+from worker_pool import get_pool, release_pool
 
 LOG = logging.getLogger('unaggregate')
 
@@ -61,12 +66,19 @@ def find_aggregated(data_dict):
     return aggregated_list, data_dict
 
 
+@log_calls(lambda args: task_log_file(args['afire_options'],
+                                      'nagg_{}'.format(os.path.basename(args['agg_input_file']))))
+@profile_calls('nagg', lambda args: (args['afire_options'],
+                                     os.path.basename(args['agg_input_file'])))
 def nagg_submitter(args):
     '''
     This routine encapsulates the single unit of work, multiple instances of which are submitted to
     the multiprocessing queue. It takes as input whatever is required to complete the work unit,
-    and returns return values and output logging from the external process.
+    and returns return values and output logging from the external process, and the timing of
+    each stage.
     '''
+    timer = Timer(os.path.basename(args['agg_input_file']))
+    exe_resources = {}
 
     # This try block wraps all code in this worker function, to capture any exceptions.
     try:
@@ -131,10 +143,11 @@ def nagg_submitter(args):
         if cmd is not None:
             start_time = time.time()
 
-            rc_exe, exe_out = execute_binary_captured_inject_io(
-                unagg_inputs_dir, cmd, error_dict,
-                log_execution=False, log_stdout=False, log_stderr=False,
-                **env_vars)
+            with timer.span('nagg', io=True):
+                rc_exe, exe_out = execute_binary_captured_inject_io(
+                    unagg_inputs_dir, cmd, error_dict,
+                    log_execution=False, log_stdout=False, log_stderr=False,
+                    resource_dict=exe_resources, **env_vars)
 
             end_time = time.time()
 
@@ -147,6 +160,7 @@ def nagg_submitter(args):
                         nagg_time['minutes'], nagg_time['seconds']))
 
             LOG.debug("\tnagg({}), rc_exe = {}".format(os.path.basename(agg_input_file), rc_exe))
+            log_exe_resources('nagg', os.path.basename(agg_input_file), exe_resources)
         else:
             exe_out = '''Aggregated file {} cannot be unaggregated by nagg,''' \
                 ''' unrecognized prefix {}.'''.format(prefix, os.path.basename(agg_input_file))
@@ -157,10 +171,11 @@ def nagg_submitter(args):
         timestamp = creation_dt.isoformat()
         logname = "nagg_unaggregate-{}-{}.log".format(os.path.basename(agg_input_file), timestamp)
         logpath = os.path.join(unagg_inputs_dir, logname)
-        logfile_obj = open(logpath, 'w')
-        for line in exe_out.splitlines():
-            logfile_obj.write(line + "\n")
-        logfile_obj.close()
+        with timer.span('nagg_log'):
+            logfile_obj = open(logpath, 'w')
+            for line in exe_out.splitlines():
+                logfile_obj.write(line + "\n")
+            logfile_obj.close()
 
         os.chdir(current_dir)
 
@@ -170,7 +185,7 @@ def nagg_submitter(args):
         os.chdir(current_dir)
         raise
 
-    return [os.path.basename(agg_input_file), rc_exe, rc_problem, exe_out]
+    return [os.path.basename(agg_input_file), rc_exe, rc_problem, exe_out, timer, exe_resources]
 
 
 def unaggregate_inputs(afire_home, agg_input_files, afire_options):
@@ -218,7 +233,7 @@ def unaggregate_inputs(afire_home, agg_input_files, afire_options):
         cpus_to_use = cpu_count
 
     LOG.debug('We are using {}/{} available CPUs'.format(cpus_to_use, cpu_count))
-    pool = multiprocessing.Pool(cpus_to_use)
+    pool = get_pool(cpus_to_use)
 
     # Submit the Active Fire tasks to the processing pool
     timeout = 9999999
@@ -229,6 +244,7 @@ def unaggregate_inputs(afire_home, agg_input_files, afire_options):
     LOG.info("Submitting {} nagg {} to the pool...".format(
         len(nagg_tasks), "task" if len(nagg_tasks) == 1 else "tasks"))
     result_list = pool.map_async(nagg_submitter, nagg_tasks).get(timeout)
+    release_pool(pool)
 
     end_time = time.time()
 
@@ -241,8 +257,9 @@ def unaggregate_inputs(afire_home, agg_input_files, afire_options):
 
     # Loop through each of the Active Fire results collect error information
     for result in result_list:
-        agg_input_file, nagg_rc, problem_rc, exe_out = result
+        agg_input_file, nagg_rc, problem_rc, exe_out, timer, exe_resources = result
         LOG.debug(">>> agg_input_file {}: nagg_rc = {}, problem_rc = {}".format(
             agg_input_file, nagg_rc, problem_rc))
+        report_timer(timer, 'nagg', rc_exe=nagg_rc, rc_problem=problem_rc, nagg=exe_resources)
 
     return unagg_inputs_dir
@@ -13,20 +13,19 @@ Licensed under GNU GPLv3.
 
 import os
 import sys
-import re
+import signal
 import string
 import logging
 import log_common
 import traceback
 import time
-from glob import glob
 import types
 import fileinput
 import shutil
 from copy import copy
-import uuid
+import resource
 from subprocess import Popen, CalledProcessError, call, PIPE
-from datetime import datetime, timedelta
+from datetime import datetime
 from threading import Thread
 from queue import Queue, Empty
 from six import string_types
@@ -101,6 +100,8 @@ def getURID(URID_timeObj=None):
     Create a new URID to be used in making the asc filenames
     '''
 
+    import uuid
+
     URID_dict = {}
 
     if URID_timeObj is None:
@@ -333,6 +334,108 @@ def execution_time(startTime, endTime):
     return time_dict
 
 
+def peak_rss_mb():
+    '''
+    Returns the peak resident set size of this process, in MB.
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def proc_io(io_file='/proc/self/io'):
+    '''
+    Return the I/O counters of a /proc io file as a dictionary, or an empty dictionary if they are
+    not available. By default, these are the counters of this process.
+    '''
+    try:
+        with open(io_file, 'r') as file_obj:
+            return {key: int(value) for key, value in
+                    [line.split(':') for line in file_obj.read().splitlines() if ':' in line]}
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def current_rss_mb():
+    '''
+    Returns the current resident set size of this process, in MB, or the peak resident set size
+    if /proc/self/statm is not available.
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as file_obj:
+            resident_pages = int(file_obj.read().split()[1])
+        return resident_pages * resource.getpagesize() / 1024. ** 2
+    except (IOError, OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def child_resources(pid, status, rusage, io_counters):
+    '''
+    Return a dictionary of the resources used by a child process (and its waited-for
+    descendants), from its wait4() status and rusage, and its /proc/PID/io counters.
+    '''
+    return {
+        'pid': pid,
+        'rc': -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status),
+        'peak_rss_mb': rusage.ru_maxrss / 1024.,
+        'user_cpu': rusage.ru_utime,
+        'system_cpu': rusage.ru_stime,
+        'voluntary_ctxt_switches': rusage.ru_nvcsw,
+        'involuntary_ctxt_switches': rusage.ru_nivcsw,
+        'major_faults': rusage.ru_majflt,
+        'read_chars': io_counters.get('rchar'),
+        'written_chars': io_counters.get('wchar'),
+        'read_bytes': io_counters.get('read_bytes'),
+        'write_bytes': io_counters.get('write_bytes'),
+    }
+
+
+def poll_with_resources(pop, resource_dict):
+    '''
+    Like Popen.poll(), but when the child has exited, read its /proc/PID/io while it is a zombie
+    (which then includes the I/O of the descendants it reaped, such as the binary run by the
+    shell), and reap it with wait4() to get its rusage. The resources are added to resource_dict.
+    '''
+    if pop.returncode is not None:
+        return pop.returncode
+
+    try:
+        if os.waitid(os.P_PID, pop.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+            return None
+        io_counters = proc_io('/proc/{}/io'.format(pop.pid))
+        pid, status, rusage = os.wait4(pop.pid, 0)
+    except ChildProcessError:
+        # Reaped elsewhere, so the resources are lost
+        return pop.poll()
+
+    resource_dict.update(child_resources(pid, status, rusage, io_counters))
+    pop.returncode = resource_dict['rc']
+    return pop.returncode
+
+
+def log_exe_resources(exe_name, name, resource_dict):
+    '''
+    Log the resources used by an execution of an external binary.
+    '''
+    if not resource_dict:
+        return
+    LOG.info("\t{} resources for {}: peak RSS {:.1f} MB, user/system CPU {:.3f}/{:.3f} s,"
+             " read/written {}/{} bytes".format(
+                 exe_name, name, resource_dict['peak_rss_mb'], resource_dict['user_cpu'],
+                 resource_dict['system_cpu'], resource_dict['read_chars'],
+                 resource_dict['written_chars']))
+    LOG.debug("\t{} resources for {}: {}".format(exe_name, name, resource_dict))
+
+
+def task_log_file(afire_options, name):
+    '''
+    Return the log file of a pool worker task in the work directory, if each task is logged to its
+    own file, or else None.
+    '''
+    if not afire_options.get('granule_logs', False):
+        return None
+    return os.path.join(afire_options['work_dir'], 'cspp_active_fire_noaa.{}.{}.log'.format(
+        name, datetime.utcnow().isoformat()))
+
+
 class NonBlockingStreamReader:
     '''
     Implements a reader for a data stream (associated with a subprocess) which
@@ -386,10 +489,13 @@ class UnexpectedEndOfStream(Exception):
 
 
 def execute_binary_captured_inject_io(work_dir, cmd, err_dict, log_execution=True, log_stdout=True,
-                                      log_stderr=True, **kv):
+                                      log_stderr=True, resource_dict=None, timeout=None, **kv):
     '''
     Execute an external script, capturing stdout and stderr without blocking the
-    called script.
+    called script. If a resource_dict is given, the peak RSS, CPU times, context switches and
+    I/O of the script (and the binaries it runs) are added to it. If a timeout (in seconds) is
+    given, the script is run in its own session, and the whole session is killed if the script
+    runs for longer than that.
     '''
 
     LOG.debug('executing {} with kv={}'.format(cmd, kv))
@@ -400,7 +506,9 @@ def execute_binary_captured_inject_io(work_dir, cmd, err_dict, log_execution=Tru
                 stdin=PIPE,
                 stdout=PIPE,
                 stderr=PIPE,
-                close_fds=True)
+                close_fds=True,
+                start_new_session=timeout is not None)
+    deadline = None if timeout is None else time.monotonic() + timeout
 
     # wrap pop.std* streams with NonBlockingStreamReader objects:
     nbsr_stdout = NonBlockingStreamReader(pop.stdout)
@@ -409,9 +517,27 @@ def execute_binary_captured_inject_io(work_dir, cmd, err_dict, log_execution=Tru
     error_keys = err_dict['error_keys']
     del(err_dict['error_keys'])
 
+    if resource_dict is None:
+        poll = pop.poll
+    else:
+        def poll():
+            return poll_with_resources(pop, resource_dict)
+
     # get the output
     out_str = ""
-    while pop.poll() is None and nbsr_stdout.thread.is_alive() and nbsr_stderr.thread.is_alive():
+    while poll() is None and nbsr_stdout.thread.is_alive() and nbsr_stderr.thread.is_alive():
+
+        '''
+        Kill the script (and anything it started) if it has run for too long
+        '''
+        if deadline is not None and time.monotonic() > deadline:
+            LOG.error("{} has run for longer than {} seconds, killing it".format(
+                cmd.split(" ")[0], timeout))
+            try:
+                os.killpg(pop.pid, signal.SIGKILL)
+            except OSError as err:
+                LOG.debug("Unable to kill {}: {}".format(cmd.split(" ")[0], err))
+            deadline = None
 
         '''
         Trawl through the stdout stream
@@ -504,13 +630,14 @@ def execute_binary_captured_inject_io(work_dir, cmd, err_dict, log_execution=Tru
             rc = 0
             break
 
-        rc = pop.returncode
+        # When collecting resources, the child must be reaped here to get its rusage.
+        rc = pop.returncode if resource_dict is None else poll()
         LOG.debug("{} : pop.returncode = {}".format(cmd.split(" ")[-1], rc))
         if rc is not None:
             continue_polling = False
-
-        rc_poll_attempts += 1
-        time.sleep(0.5)
+        else:
+            rc_poll_attempts += 1
+            time.sleep(0.5)
 
     LOG.debug("{}: rc = {}".format(cmd, rc))
 
@@ -724,78 +851,3 @@ def setup_cache_dir(cache_dir, work_dir, cache_env_name):
 
     LOG.info('Using cache dir {}'.format(returned_cache_dir))
     return returned_cache_dir
-
-
-def clean_cache(cache_dir, cache_time_window, granule_dt):
-    """
-    Purge the cache of old files.
-    """
-
-    anc_file_pattern = ['(?P<kind>[A-Z]+)_',
-                        '(?P<sat>[A-Za-z0-9]+)_', 'd(?P<date>\d+)_',
-                        't(?P<start_time>\d+)_',
-                        'e(?P<end_time>\d+)_',
-                        'b(?P<orbit>\d+)_',
-                        '(?P<site>[a-zA-Z0-9]+)_',
-                        '(?P<domain>[a-zA-Z0-9]+)\.nc']
-    anc_file_pattern = "".join(anc_file_pattern)
-    re_anc_file_pattern = re.compile(anc_file_pattern)
-
-    afire_anc_dirs = sorted(glob(os.path.join(cache_dir, '*_*_*_*-*h')))
-
-    too_old_files = []
-    future_files = []
-
-    for afire_anc_dir in afire_anc_dirs:
-
-        LOG.debug('afire_anc_dir: {}'.format(afire_anc_dir))
-
-        afire_nc_files = sorted(glob(os.path.join(afire_anc_dir, 'GRLWM_*.nc')))
-        if afire_nc_files != []:
-            LOG.debug('In {} :'.format(afire_anc_dir))
-            LOG.debug(
-                '\t{0}'.format(
-                    ", ".join(["{}".format(os.path.basename(x)) for x in afire_nc_files])))
-
-        afire_date_pattern = '%Y%m%d_%H%M%S'
-
-        for files in afire_nc_files:
-            file_basename = os.path.basename(files)
-
-            file_info = dict(re_anc_file_pattern.match(file_basename).groupdict())
-
-            date_str = '{}_{}'.format(file_info['date'], file_info['start_time'])
-            deciseconds = int(date_str[-1])
-            date_str = date_str[:-1]
-            anc_file_dt = datetime.strptime(date_str, afire_date_pattern) + \
-                timedelta(seconds=0.1 * deciseconds)
-            LOG.debug('\tAncillary cache file has time = {0}'.format(anc_file_dt))
-
-            time_diff = (granule_dt - anc_file_dt).total_seconds()
-            time_diff_hours = time_diff / 3600.
-            LOG.debug('\tTime between {0} and {1} is {2} seconds ({3} hours)'.format(
-                granule_dt, anc_file_dt, time_diff, time_diff_hours))
-
-            if time_diff < 0:
-                LOG.debug(
-                    '\tAncillary cache file {0} is in the future...'.format(
-                        os.path.basename(files)))
-                future_files.append(files)
-            elif time_diff_hours > cache_time_window:
-                LOG.debug(
-                    '\tAncillary cache file {0} is more than {1} hours older than target...'.format(
-                        os.path.basename(files), cache_time_window))
-                too_old_files.append(files)
-            else:
-                pass
-
-    if too_old_files != []:
-        LOG.info("Removing old ancillary cache files from {0} ...".format(cache_dir))
-        for too_old_file in too_old_files:
-            LOG.debug('\tdeleting {0}'.format(os.path.basename(too_old_file)))
-            if os.path.isfile(too_old_file):
-                os.remove(too_old_file)
-            else:
-                LOG.warn("Removal candidate {0} does not exist".format(too_old_file))
-    else:
-        LOG.info("No old files need to be removed from the ancillary cache {0}".format(cache_dir))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+worker_pool.py
+
+ * DESCRIPTION: The multiprocessing pools of the nagg and Active Fires stages. A run normally
+ creates (and closes) its own pool for each stage, but in server mode (see afire_server.py) a
+ single shared pool is started with the server, so that every job runs in the same warm worker
+ processes, which keep their loaded libraries, DEM file and templates between jobs.
+
+Created on 2026-10-19.
+Copyright (c) 2026 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import logging
+import multiprocessing
+
+LOG = logging.getLogger('worker_pool')
+
+# The pool shared by the jobs of a server, and its number of processes
+_shared_pool = None
+_shared_processes = 0
+
+
+def start_shared_pool(processes, initializer=None, initargs=()):
+    '''
+    Start the pool shared by every later run in this process.
+    '''
+    global _shared_pool
+    global _shared_processes
+    _shared_pool = multiprocessing.Pool(processes, initializer=initializer, initargs=initargs)
+    _shared_processes = processes
+    LOG.info("Started a shared pool of {} worker {}".format(
+        processes, "process" if processes == 1 else "processes"))
+    return _shared_pool
+
+
+def stop_shared_pool():
+    '''
+    Close the shared pool, if there is one, and wait for its workers to exit.
+    '''
+    global _shared_pool
+    global _shared_processes
+    if _shared_pool is not None:
+        _shared_pool.close()
+        _shared_pool.join()
+        _shared_pool = None
+        _shared_processes = 0
+
+
+def shared_pool_size():
+    '''
+    Return the number of processes of the shared pool, or 0 if there isn't one.
+    '''
+    return _shared_processes
+
+
+def is_shared(pool):
+    return pool is not None and pool is _shared_pool
+
+
+def get_pool(processes, initializer=None, initargs=()):
+    '''
+    Return the shared pool if there is one, or else a new pool of the given number of processes,
+    each initialized with the given initializer. The workers of the shared pool are not
+    initialized for this run, so its tasks must carry whatever state they need.
+    '''
+    if _shared_pool is not None:
+        return _shared_pool
+    return multiprocessing.Pool(processes, initializer=initializer, initargs=initargs)
+
+
+def release_pool(pool):
+    '''
+    Close a pool returned by get_pool() and wait for its workers to exit, unless it is the shared
+    pool.
+    '''
+    if not is_shared(pool):
+        pool.close()
+        pool.join()